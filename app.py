@@ -16,6 +16,7 @@ import urllib.parse
 import click
 import traceback
 import datetime
+import time
 import openpyxl.workbook
 import xlsxwriter
 import atexit
@@ -54,7 +55,17 @@ from oajf.db import (
     deleteSetting as db_deleteSetting,
 )
 from oajf.models import OASTATUS, APPLICATION_REQUIREMENT, Journal, Publisher, Link, Excel, Setting, LINKTYPE, APPREQ_REQUIRED, APPREQ_NOT_REQUIRED
-from oajf.util import logfunc,get_publishers,get_settings,getDOAJChangesFileAsExcelWorkbook,getDOAJDump,getSettingValueLang
+from oajf.util import logfunc,get_publishers,reload_publisher,get_settings,getDOAJChangesFileAsExcelWorkbook,getDOAJDump,getSettingValueLang
+from oajf.filestore import init as filestore_init
+from oajf import tabular
+from oajf.issn import checkColumn as issn_checkColumn, DUPLICATE as ISSN_DUPLICATE
+from oajf import jobs
+from oajf.tasks import JOB_UPLOAD,JOB_UPLOAD_PREVIEW,JOB_UPLOAD_CONFIRM,JOB_DOAJ_SYNC,JOB_DOAJ_WITHDRAWN,JOB_EXPORT_JOURNALS
+from oajf.journalimport import MODES as IMPORT_MODES,MODE_SYNC
+from oajf import events
+from oajf.querylog import getQueryStats
+from oajf.db import updatePoolMetrics
+from oajf import metrics
 from oajf.cli import register_cli
 
 from oajf.config import LOGCONFIG
@@ -88,8 +99,11 @@ def get_locale():
     lang = session.get("lang")
     if lang is not None:
         return lang
-    session["lang"] = request.accept_languages.best_match(['de', 'en'])
-    return session["lang"]
+    # the detected language is not stored in the session, that would create a session for every visitor
+    lang = getattr(g, 'lang', None)
+    if lang is None:
+        lang = g.lang = request.accept_languages.best_match(['de', 'en'])
+    return lang
 
 @app.route("/locale/<language>/<path>")
 def set_locale(language=None,path=None):
@@ -132,6 +146,8 @@ elif os.environ.get("SERVER_SOFTWARE",'').startswith("gunicorn"):
 else:
     db = db_init(app)
 
+filestore = filestore_init(app)
+events.init(app)
 register_cli(app)
 
 PAGE_LENGTH = 100
@@ -153,6 +169,22 @@ def utility_processor():
         getSettingValueLang = getSettingValueLang
         )
 
+@app.before_request
+def before_request_metrics():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def after_request_metrics(response):
+    start = g.get('request_start', None)
+    if start is not None:
+        metrics.REQUEST_DURATION.labels(request.endpoint or 'none', request.method, response.status_code).observe(time.perf_counter() - start)
+    return response
+
+@app.teardown_request
+def teardown_request_metrics(exception=None):
+    # the request's connections are back in the pool
+    updatePoolMetrics()
+
 def login_required(view):
     @functools.wraps(view)
     def wrapped_view(**kwargs):
@@ -235,6 +267,12 @@ def index():
     except:
         page = 0
 
+    # paging and sorting resubmit the keyword, only searches started by the user are recorded
+    source = request.form.get("source","") if request.method == "POST" else "search"
+    if keyword and source in ("search","autocomplete"):
+        kind = events.EVENT_AUTOCOMPLETE if source == "autocomplete" else events.EVENT_SEARCH
+        events.record(kind,keyword=keyword,results=len(journals))
+
     length = len(journals)
     number_of_pages = length // PAGE_LENGTH + 1
     page = min(max(page, 0), number_of_pages - 1)
@@ -247,6 +285,9 @@ def index():
 @app.post("/item_clicked")
 @logfunc
 def item_clicked():
+    journal_id = request.form.get("journal_id",None,type=int)
+    if journal_id:
+        events.record(events.EVENT_CLICK,journal_id=journal_id)
     return ('', 204)
 
 @app.post("/fetch")
@@ -330,9 +371,8 @@ def admin_edit_journals():
     order = order.strip(",")
     order = order.replace(",,",",")
 
-    journals = db_readJournals(keyword=keyword, only_active=only_active,publisher=publisher,order=order)
-
     if request.method == 'GET' or action == "search" or (request.method == 'POST' and 'btn-search' in request.form):
+        journals = db_readJournals(keyword=keyword, only_active=only_active,publisher=publisher,order=order,include_archived=not only_active)
         length = len(journals)
         number_of_pages = length // PAGE_LENGTH + 1
         page = min(max(page, 0), number_of_pages - 1)
@@ -349,37 +389,13 @@ def admin_edit_journals():
     
     
     else:
-        out = io.BytesIO()        
-        wb = xlsxwriter.Workbook(out,{'in_memory': True})
-        sheet = wb.add_worksheet('journals')
-        row = 0
-        col = iter(range(0,20))
-        sheet.write(row,next(col),'id')
-        sheet.write(row,next(col),'title')
-        sheet.write(row,next(col),'url')
-        sheet.write(row,next(col),'e-issn')
-        sheet.write(row,next(col),'print-issn')
-        sheet.write(row,next(col),'valid')
-        sheet.write(row,next(col),'publisher')
-
-        for j in journals:
-            row += 1
-            col = iter(range(0,20))
-            sheet.write(row,next(col),j.id)
-            sheet.write(row,next(col),j.title)
-            sheet.write(row,next(col),j.url)
-            sheet.write(row,next(col),j.e_issn)
-            sheet.write(row,next(col),j.print_issn)
-            sheet.write(row,next(col),str(j.valid_till))
-            sheet.write(row,next(col),str(j.publisher))
-        wb.close()
-
-        # need to set to position 0
-        out.seek(0)
-        return send_file(out,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name='Journals.xlsx')
+        params = {
+            'keyword': keyword,
+            'only_active': only_active,
+            'publisher_id': publisher.id if publisher else None,
+            'order': order,
+        }
+        return submitJob(JOB_EXPORT_JOURNALS,params)
 
 
 @app.post("/admin_save_journal")
@@ -434,12 +450,11 @@ def admin_upload_get():
 @login_required
 def admin_upload_post():
     get_publishers()
-    conn: mariadb.Connection
-    l_new: List[Journal] = []
     publisher: Publisher = None
     params = {}
 
-    delete_journals = request.form.get('delete_journals',None)
+    mode = request.form.get('mode',MODE_SYNC)
+    dry_run = request.form.get('dry_run',None)
     if "excel" not in request.files:
         flash(_("Kein File im request."),MESSAGE_TYPE_ERROR)
         return render_template("admin_upload.html",publisher=publisher)
@@ -453,11 +468,12 @@ def admin_upload_post():
     if request.form["publisher"] == "":
         flash(_("Kein Verlag angegeben."),MESSAGE_TYPE_ERROR)
         return render_template("admin_upload.html",publisher=publisher)
+    if mode not in IMPORT_MODES:
+        flash(_("Ungültiger Importmodus."),MESSAGE_TYPE_ERROR)
+        return render_template("admin_upload.html",publisher=publisher)
     
-    if match := re.search(r'[\w\d_\-]+?\.xlsx',file.filename):
-        pass
-    else:
-        flash(_("Falscher Dateityp, es werden nur .xlsx-Dateien unterstützt."),MESSAGE_TYPE_ERROR)
+    if not tabular.isSupported(file.filename):
+        flash(_("Falscher Dateityp, es werden nur .xlsx-, .csv- und .tsv-Dateien unterstützt."),MESSAGE_TYPE_ERROR)
         return render_template("admin_upload.html",publisher=publisher)
 
     publisher_id = int(request.form["publisher"])
@@ -467,123 +483,64 @@ def admin_upload_post():
 
     params['publisher'] = publisher
     params['valid'] = valid
-    params['delete_journals'] = delete_journals
+    params['mode'] = mode
+    params['dry_run'] = dry_run
 
     filename = secure_filename(file.filename)
-    file.seek(0)
-    contents = file.read()
-    file.seek(0)
 
+    # the file is imported by the job worker, see JOB_UPLOAD in oajf/tasks.py
     try:
-        wb = openpyxl.load_workbook(file, read_only=True,data_only=True)
-        ws = wb.active
-
-        if (ws.cell(1,1).value.lower() != 'titel' and ws.cell(1,1).value.lower() != 'title'):
-            flash(_("'Titel' oder 'Title' in Zelle A1 erwartet."),MESSAGE_TYPE_ERROR)
-            return render_template("admin_upload.html",**params)
-        if (ws.cell(1,2).value.lower() != 'link'):
-            flash(_("'Link' in Zelle B1 erwartet."),MESSAGE_TYPE_ERROR)
-            return render_template("admin_upload.html",**params)
-        if (ws.cell(1,3).value.lower() != 'e-issn'):
-            flash(_("'E-ISSN' in Zelle C1 erwartet."),MESSAGE_TYPE_ERROR)
-            return render_template("admin_upload.html",**params)
-        if (ws.cell(1,4).value.lower() != 'print-issn'):
-            flash(_("'Print-ISSN' in Zelle D1 erwartet."),MESSAGE_TYPE_ERROR)
-            return render_template("admin_upload.html",**params)
-
-        row_idx = 1
-        content_errors = 0
-        for row in ws.iter_rows(min_row=2, max_col=5, values_only=True):
-            if content_errors > 4:
-                break
-
-            if row[0] is None:
-                break
-
-            row_idx += 1
-            
-            title = str(row[0])
-            title = title.strip()
-            link = str(row[1])
-            link = link.strip()
-
-            e_issn = str(row[2])
-            e_issn = e_issn.strip()
-            if e_issn and e_issn != 'None':
-                if m:=re.search('([0-9X]{4}-[0-9X]{4})',e_issn): 
-                    e_issn = m[1]
-                else:
-                    content_errors += 1
-                    msg = _(f"Ungültige E-ISSN {0} (Zeile {1})") 
-                    flash(msg.format(e_issn,row_idx),MESSAGE_TYPE_ERROR)
-
-            print_issn = str(row[3])
-            print_issn = print_issn.strip()
-            if print_issn and print_issn != 'None':
-                if m:=re.search('([0-9X]{4}-[0-9X]{4})',print_issn): 
-                    print_issn = m[1]
-                else:
-                    content_errors += 1
-                    msg = _(f"Ungültige Print-ISSN {0} (Zeile {1})") 
-                    flash(msg.format(print_issn,row_idx),MESSAGE_TYPE_ERROR)
-
-            if e_issn == 'None': e_issn = None
-            if print_issn == 'None': print_issn = None
-            if link == 'None': link = None
-
-            j = Journal()
-            j.title = title
-            j.publisher = publisher
-            j.valid_till = valid_till
-            j.title = title
-            j.url = link
-            j.e_issn = e_issn
-            j.print_issn = print_issn
-            l_new.append(j)
-
+        # an unreferenced file left behind by a failed import is removed by filestoreGC
+        file.seek(0)
+        file_hash,file_size = filestore.put(file.stream)
+        job_params = {
+            'publisher_id': publisher_id,
+            'valid': valid_till.isoformat(),
+            'filename': filename,
+            'file_hash': file_hash,
+            'file_size': file_size,
+            'mode': mode,
+        }
+        return submitJob(JOB_UPLOAD_PREVIEW if dry_run else JOB_UPLOAD,job_params)
     except Exception as e:
         app.logger.error(f"exception={type(e).__name__}")
         app.logger.error(f"stacktrace={traceback.format_exc()}")
-        flash(_("Import fehlgeschlagen. Fehler beim Parsen der Input-Datei."),MESSAGE_TYPE_ERROR)
-        return render_template("admin_upload.html",**params)
+        flash("Import aufgrund eines Datenbankfehlers fehlgeschlagen",MESSAGE_TYPE_ERROR)
+    
+    return render_template("admin_upload.html",**params)
 
-    if content_errors > 0:
-        return render_template("admin_upload.html",**params)
 
-    try:
-        conn = get_db()
-        if delete_journals:
-            cnt_deleted_journals = db_deleteJournal(None,transaction_conn=conn,publisher_id=publisher_id)
+@app.get("/admin_upload_preview")
+@logfunc
+@login_required
+def admin_upload_preview():
+    get_publishers()
+    job_id = request.args.get('job',None,type=int)
+    preview = readJobResult(job_id,JOB_UPLOAD_PREVIEW) if job_id else None
+    if preview is None:
+        return redirect(url_for('admin_jobs'))
+    return render_template("admin_upload_preview.html",preview=preview,job_id=job_id)
 
-        e = Excel()
-        e.name = filename
-        e.file = contents
-        e.valid = valid
-        e.publisher = g.m_publishers[publisher_id]
 
-        db_saveExcelFile(e,transaction_conn=conn)
-    
-        for j in l_new:
-            db_saveJournal(j,conn)
+@app.post("/admin_upload_confirm")
+@logfunc
+@login_required
+def admin_upload_confirm():
+    """
+    applies the rows staged by the dry run job, the token is the upload_id of its preview
+    """
+    job_id = request.form.get('job',None,type=int)
+    token = request.form.get('token','')
 
-        conn.commit()
-        flash(_("Excel-Datei erfolgreich importiert."),MESSAGE_TYPE_SUCCESS)
-        msg = ngettext("{0} Zeitschrift gelöscht.","{0} Zeitschriften gelöscht.",cnt_deleted_journals)
-        flash(msg.format(cnt_deleted_journals),MESSAGE_TYPE_SUCCESS)
-        
-        flash(ngettext(f"{len(l_new)} Zeitschriften importiert",f"{len(l_new)} Zeitschriften importiert",len(l_new)),MESSAGE_TYPE_SUCCESS)
+    job = jobs.readJob(job_id) if job_id else None
+    preview = job.readResultJson() if job and job.kind == JOB_UPLOAD_PREVIEW and job.status == jobs.JOB_DONE else None
+    if preview is None or preview.get('upload_id',None) != token:
+        flash(_("Vorschau nicht gefunden."),MESSAGE_TYPE_ERROR)
+        return redirect(url_for('admin_jobs'))
 
-    except Exception as e:
-        app.logger.error(f"exception={type(e).__name__}")
-        app.logger.error(f"stacktrace={traceback.format_exc()}")
-        flash("Import aufgrund eines Datenbankfehlers fehlgeschlagen",MESSAGE_TYPE_ERROR)
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
-    
-    return render_template("admin_upload.html",**params)
+    job_params = dict(job.params)
+    job_params['upload_id'] = token
+    return submitJob(JOB_UPLOAD_CONFIRM,job_params)
 
 
 @app.route("/admin_delete", methods = ['GET','POST'])
@@ -594,59 +551,69 @@ def admin_delete():
     if request.method == 'GET':
         return render_template("admin_delete.html")
 
-    conn: mariadb.Connection
+    conn: mariadb.Connection = None
     cnt_deleted = 0
 
     if "excel" not in request.files:
         flash("Keine Datei hochgeladen.",MESSAGE_TYPE_ERROR)
         return render_template("admin_delete.html")
     file = request.files["excel"]
-    print (file.filename)
-    if match := re.search(r'[\w\d_\-]+?\.xlsx',file.filename):
-        pass
-    else:
-        flash("Falscher Dateityp, es werden nur .xlsx-Dateien unterstützt",MESSAGE_TYPE_ERROR)
+    if not tabular.isSupported(file.filename):
+        flash("Falscher Dateityp, es werden nur .xlsx-, .csv- und .tsv-Dateien unterstützt",MESSAGE_TYPE_ERROR)
         return render_template("admin_delete.html")
 
-    wb = openpyxl.load_workbook(file, read_only=True)
-    ws = wb.active
-    mode = ws.cell(1,1).value
+    rows = tabular.readRows(file.stream,file.filename)
+    try:
+        header = next(rows,None)
+    except Exception as e:
+        app.logger.error(f"exception={type(e).__name__}")
+        flash("Datei konnte nicht gelesen werden.",MESSAGE_TYPE_ERROR)
+        return render_template("admin_delete.html")
+    mode = header[0] if header else None
     if mode is None:
+        rows.close()
         flash("Spaltenkopf darf nicht leer sein.",MESSAGE_TYPE_ERROR)
         return render_template("admin_delete.html")
     
-    mode = mode.lower()
+    mode = str(mode).strip().lower()
     if mode != 'e-issn' and mode != 'id':
+        rows.close()
         flash("Spaltenkopf muss 'E-ISSN' oder 'Id' sein.",MESSAGE_TYPE_ERROR)
         return render_template("admin_delete.html")
         
 
     try:
+        values = []
+        for row in rows:
+            if not row or row[0] is None:
+                break
+            values.append(row[0])
+        rows.close()
+
+        if mode == 'e-issn':
+            # one check for the whole column, repeated issns are deleted once
+            e_issns,errors = issn_checkColumn(values,seen={})
+            cnt_invalid = len([e for e in errors if e[2] != ISSN_DUPLICATE])
+            if cnt_invalid:
+                flash(f"{cnt_invalid} ungültige E-ISSN übersprungen.",MESSAGE_TYPE_WARNING)
+            values = [e_issn for e_issn in e_issns if e_issn]
+        else:
+            ids = []
+            for value in values:
+                try:
+                    ids.append(int(str(value).strip()))
+                except:
+                    pass
+            values = ids
+
         conn = get_db()
         cur = conn.cursor()
 
-        for row in ws.iter_rows(min_row=2, max_col=1, values_only=True):
-            if row[0] is None:
-                break
-            value = str(row[0])
-            if value:
-                value = value.strip()
-                if mode == 'e-issn':
-                    if value and (m:=re.search('([0-9X]{4}-[0-9X]{4})',value)): 
-                        value = m[1]
-                    else:
-                        value = None
-                else:
-                    try:
-                        value = int(value)
-                    except:
-                        value = None
-
-            if value:
-                if mode == 'e-issn':
-                    cnt_deleted += db_deleteJournal(None,transaction_conn=conn,e_issn=value)
-                else:
-                    cnt_deleted += db_deleteJournal(None,transaction_conn=conn,id=value)
+        for value in values:
+            if mode == 'e-issn':
+                cnt_deleted += db_deleteJournal(None,transaction_conn=conn,e_issn=value)
+            else:
+                cnt_deleted += db_deleteJournal(None,transaction_conn=conn,id=value)
         conn.commit()
         flash(f"{cnt_deleted} Zeitschriften gelöscht.",MESSAGE_TYPE_SUCCESS)            
     except Exception as e:
@@ -730,6 +697,28 @@ def admin_save_setting():
     get_publishers(force_reload=True)
     return redirect(url_for('admin_settings'))
 
+#
+# prometheus metrics, aggregated over all worker processes in multiprocess mode
+#
+@app.get("/metrics")
+def metrics_endpoint():
+    allowed = app.config.get('METRICS',{}).get('allowed_ips',['127.0.0.1'])
+    if request.remote_addr not in allowed:
+        return ('', 403)
+
+    updatePoolMetrics()
+    data, content_type = metrics.generate()
+    return Response(data, mimetype=None, content_type=content_type)
+
+#
+# query statistics of this worker process
+#
+@app.get("/admin_query_stats")
+@logfunc
+@superadmin_required
+def admin_query_stats():
+    return jsonify([x.toDict() for x in getQueryStats()])
+
 #
 # publisher
 #
@@ -784,13 +773,15 @@ def admin_delete_publisher():
         if conn:
             conn.close()
 
-    get_publishers(force_reload=True)
+    reload_publisher(id)
     return redirect(url_for("admin_publishers_get"))
 
 @app.post("/admin_copy_publisher")
 @logfunc
 @login_required
 def admin_copy_publisher():
+    id = None
+    p = None
     try:
         get_publishers()
         id = int(request.form["id"])
@@ -806,7 +797,11 @@ def admin_copy_publisher():
         app.logger.error(f"exception={type(e).__name__}")
         app.logger.error(f"stacktrace={traceback.format_exc()}")
 
-    get_publishers(force_reload=True)
+    # the cached original was modified in place, so refresh it as well as the copy
+    if id is not None:
+        reload_publisher(id)
+    if p is not None and p.id and int(p.id) != -1:
+        reload_publisher(p.id)
     return redirect(url_for('admin_publishers_get'))
 
 @app.post("/admin_save_publisher")
@@ -845,6 +840,7 @@ def admin_save_publisher():
 
         for i,x in enumerate(links_id):
             link = Link()
+            link.id = x if x else None
             link.link = links_link[i]
             link.linktype = LINKTYPE.get(links_linktype[i],None)
             link.linktext_de = links_linktext_de[i]
@@ -860,7 +856,8 @@ def admin_save_publisher():
         app.logger.error(f"exception={type(e).__name__}")
         app.logger.error(f"stacktrace={traceback.format_exc()}")
 
-    get_publishers(force_reload=True)
+    if p.id and int(p.id) != -1:
+        reload_publisher(p.id)
     return redirect(url_for('admin_publishers_get'))
 
 @app.get("/admin_excel_list")
@@ -901,11 +898,36 @@ def admin_excel_download(id):
         return render_template("admin_excel_list.html",l_excel=l_excel)
 
     e = l_excel[0]
-    return send_file(
-        io.BytesIO(e.file),
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    mimetype = tabular.getMimetype(e.name)
+
+    # not yet migrated to the filestore
+    if not e.file_hash:
+        return send_file(
+            io.BytesIO(e.file),
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=e.name)
+
+    # hand out the stored gzip file as is, send_file streams it from disk and handles ranges
+    if 'gzip' in request.accept_encodings:
+        rv = send_file(
+            filestore.getPath(e.file_hash),
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=e.name,
+            conditional=True)
+        rv.headers['Content-Encoding'] = 'gzip'
+        rv.vary.add('Accept-Encoding')
+        return rv
+
+    # otherwise decompress on the fly, without range support
+    rv = send_file(
+        filestore.open(e.file_hash),
+        mimetype=mimetype,
         as_attachment=True,
         download_name=e.name)
+    rv.vary.add('Accept-Encoding')
+    return rv
 
 @app.post('/admin_excel_delete')
 @logfunc
@@ -926,6 +948,19 @@ def admin_excel_delete():
     return redirect(url_for('admin_excel_list'))
 
 
+# the jobs are started by POST only, a GET of the pages (menu, reload) never downloads anything
+@app.post("/doaj_import_update_start")
+@logfunc
+@login_required
+def doaj_import_update_start():
+    return submitJob(JOB_DOAJ_SYNC,{})
+
+@app.post("/doaj_withdrawn_start")
+@logfunc
+@login_required
+def doaj_withdrawn_start():
+    return submitJob(JOB_DOAJ_WITHDRAWN,{})
+
 @app.route("/doaj_import_update",methods=['GET','POST'])
 @logfunc
 @login_required
@@ -940,79 +975,17 @@ def doaj_import_update():
     p = publishers[0]
 
     if request.method == 'GET':
-        try:
-            l_journal_csv: List[Journal] = []
-            l_journal_db: List[Journal] 
-            m_eissn: Dict[str,Journal] = {}
-            m_pissn: Dict[str,Journal] = {}
-
-            l_journal_db = db_readJournals(publisher=p,publisher_shallow=True)
-
-            for j in l_journal_db:
-                if j.e_issn:
-                    if j.e_issn in m_eissn:
-                        flash(_(f"E-ISSN mehrfach gefunden für Zeitschriften in der Datenbank: {j.e_issn}"))
-                    else:
-                        m_eissn[j.e_issn] = j
-
-                if j.print_issn:
-                    if j.print_issn in m_pissn:
-                        flash(_(f"Print-ISSN mehrfach gefunden für Zeitschriften in der Datenbank: {j.print_issn}"))
-                    else:
-                        m_pissn[j.print_issn] = j
-
-            l_journal_csv,errs = getDOAJDump()
-            if errs:
-                for e in errs:
-                    flash(e,MESSAGE_TYPE_ERROR)
-                return render_template("admin_doaj_dump.html",l_new=[],l_updated=[])
-
-            for j in l_journal_csv:
-                e_issn_found = False
-                print_issn_found = False
-                if j.e_issn:
-                    if j.e_issn in m_eissn:
-                        e_issn_found = True
-            
-                if j.print_issn:
-                    if j.print_issn in m_pissn:
-                        print_issn_found = True
-
-                if e_issn_found:
-                    j_db = m_eissn[j.e_issn]
-                    diffs = j.getDifferences(j_db)
-                    if diffs:
-                        j.id = j_db.id
-                        j.valid_till = j_db.valid_till
-                        j.diffs = diffs
-                        l_updated.append(j)
-                elif print_issn_found:
-                    j_db = m_pissn[j.print_issn]
-                    diffs = j.getDifferences(j_db)
-                    if diffs:
-                        j.id = j_db.id
-                        j.valid_till = j_db.valid_till
-                        j.diffs = diffs
-                        l_updated.append(j)
-                else:
-                    j.id = -1
-                    j.publisher = p
-                    j.valid_till = datetime.datetime.today()
-                    j.valid_till = j.valid_till.replace(month=12,day=31,hour=23,minute=59,second=59)
-                    l_new.append(j)
-            
-            if len(l_new) == 0 and len(l_updated) == 0:
-                flash("Weder neue noch zu aktualisierende Zeitschriften gefunden.",MESSAGE_TYPE_WARNING)
-
-        except Exception as e:
-            l_new = []
-            l_updated = []
-            app.logger.error(f"exception={type(e).__name__}")
-            app.logger.error(f"stacktrace={traceback.format_exc()}")
-            flash('Fehler beim Holen der DOAJ-Änderungen.',MESSAGE_TYPE_ERROR)
-            flash(e,MESSAGE_TYPE_ERROR)
-
-        return render_template("admin_doaj_dump.html",l_new=l_new,l_updated=l_updated)
+        # the dump is fetched and compared by the job worker, see JOB_DOAJ_SYNC in oajf/tasks.py
+        job_id = request.args.get('job',None,type=int)
+        if job_id is None:
+            return render_template("admin_doaj_dump.html",l_new=[],l_updated=[],
+                                   start_url=url_for('doaj_import_update_start'),
+                                   start_text=_("Lädt den DOAJ-Dump und vergleicht ihn mit den Zeitschriften des DOAJ-Verlags."))
+
+        result = readJobResult(job_id,JOB_DOAJ_SYNC)
+        if result is None:
+            return redirect(url_for('admin_jobs'))
+        return render_template("admin_doaj_dump.html",l_new=result['l_new'],l_updated=result['l_updated'])
     elif request.method == 'POST':
         data = request.form.get("data_as_json")
         data = json.loads(data)
@@ -1087,57 +1060,17 @@ def doaj_import_update():
 @login_required
 def doaj_withdrawn():
     if request.method == 'GET':
-        map_issn: Dict[str,List[str]] = {}
-        l_journal: List[Journal] = []
-
-        wb,data,errs = getDOAJChangesFileAsExcelWorkbook()
-        if errs:
-            for e in errs:
-                flash(e,MESSAGE_TYPE_ERROR)
-            return render_template("admin_doaj_withdrawn.html",l_journal=[])
-
-        try:
-            sheet = wb['Withdrawn']
-            for i,row in enumerate(sheet.rows):
-                if i < 6:
-                    continue
-
-                title = row[0].value 
-                if title: title = title.strip()
-                issn = row[1].value 
-                if issn: issn = issn.strip()
-                date = row[2].value
-                reason = row[3].value 
-                if reason: reason = reason.strip()
-
-                if issn is not None and issn != 'None':
-                    map_issn[issn] = [title,date,reason]
-
-            get_publishers()
-
-            for k,v in map_issn.items():
-                for j in db_readJournals(e_issn=k,only_active=True,publisher_shallow=True):
-                    j.publisher = g.m_publishers[j.publisher.id]
-                    j.withdraw_reason = map_issn[k][2]
-                    j.withdraw_date = map_issn[k][1]
-                    if j.publisher.is_doaj == 1 or j.publisher.doaj_linked == 1:
-                        j.to_be_deleted = 1 
-                    else:
-                        j.to_be_deleted = 0
-
-                    l_journal.append(j)
-            
-            if len(l_journal) == 0:
-                flash("Keine zu löschenden Zeitschriften gefunden.",MESSAGE_TYPE_WARNING)
-
-        except Exception as e:
-            l_journal = []
-            app.logger.error(f"exception={type(e).__name__}")
-            app.logger.error(f"stacktrace={traceback.format_exc()}")
-            flash('Fehler beim Holen der DOAJ-Änderungen.',MESSAGE_TYPE_ERROR)
-            flash(e,MESSAGE_TYPE_ERROR)
-
-        return render_template("admin_doaj_withdrawn.html",l_journal=l_journal)
+        # the changes file is fetched and checked by the job worker, see JOB_DOAJ_WITHDRAWN in oajf/tasks.py
+        job_id = request.args.get('job',None,type=int)
+        if job_id is None:
+            return render_template("admin_doaj_withdrawn.html",l_journal=[],
+                                   start_url=url_for('doaj_withdrawn_start'),
+                                   start_text=_("Lädt die Liste der aus dem DOAJ entfernten Zeitschriften und sucht die aktiven davon."))
+
+        result = readJobResult(job_id,JOB_DOAJ_WITHDRAWN)
+        if result is None:
+            return redirect(url_for('admin_jobs'))
+        return render_template("admin_doaj_withdrawn.html",l_journal=result['l_journal'])
     elif request.method == 'POST':
         ids = []
 
@@ -1174,6 +1107,108 @@ def doaj_withdrawn():
 
 
 
+#
+# background jobs
+#
+# endpoints showing the result of a finished job, the other jobs offer their result file for download
+JOB_RESULT_ENDPOINTS = {
+    JOB_UPLOAD_PREVIEW: 'admin_upload_preview',
+    JOB_DOAJ_SYNC: 'doaj_import_update',
+    JOB_DOAJ_WITHDRAWN: 'doaj_withdrawn',
+}
+
+def submitJob(kind: str, params: dict):
+    """
+    queues a job for the current user and redirects to the job list,
+    a job already finished (JOBS['inline']) leads straight to its result
+    """
+    try:
+        job_id = jobs.enqueue(kind,params,created_by=session.get('uid',None),lang=get_locale())
+    except Exception as e:
+        app.logger.error(f"exception={type(e).__name__}")
+        app.logger.error(f"stacktrace={traceback.format_exc()}")
+        flash(_("Auftrag konnte nicht angelegt werden."),MESSAGE_TYPE_ERROR)
+        return redirect(url_for('admin_jobs'))
+
+    job = jobs.readJob(job_id)
+    if job and job.status == jobs.JOB_DONE and kind in JOB_RESULT_ENDPOINTS:
+        return redirect(url_for(JOB_RESULT_ENDPOINTS[kind],job=job_id))
+
+    flash(_("Auftrag {0} angelegt.").format(job_id),MESSAGE_TYPE_INFO)
+    return redirect(url_for('admin_jobs',job=job_id))
+
+def readJobResult(job_id: int, kind: str):
+    """
+    returns the json result of a finished job and flashes its messages, None if there is none
+    """
+    job = jobs.readJob(job_id)
+    if job is None or job.kind != kind:
+        flash(_("Auftrag nicht gefunden."),MESSAGE_TYPE_ERROR)
+        return None
+    if not job.isFinished():
+        flash(_("Auftrag {0} ist noch nicht abgeschlossen.").format(job_id),MESSAGE_TYPE_WARNING)
+        return None
+
+    for type,msg in job.messages:
+        flash(msg,type)
+    if job.status != jobs.JOB_DONE:
+        return None
+    return job.readResultJson()
+
+@app.get("/admin_jobs")
+@logfunc
+@login_required
+def admin_jobs():
+    l_job: List[jobs.Job] = []
+
+    try:
+        l_job = jobs.readJobs()
+    except Exception as e:
+        flash(_('Fehler beim Lesen der Aufträge.'),MESSAGE_TYPE_ERROR)
+        app.logger.error(f"exception={type(e).__name__}")
+        app.logger.error(f"stacktrace={traceback.format_exc()}")
+
+    return render_template("admin_jobs.html",l_job=l_job,job_id=request.args.get('job',None,type=int),
+                           JOB_RESULT_ENDPOINTS=JOB_RESULT_ENDPOINTS)
+
+@app.get("/admin_job/<int:id>")
+@login_required
+def admin_job_status(id):
+    job = jobs.readJob(id)
+    if job is None:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(job.toDict())
+
+@app.get("/admin_job_download/<int:id>")
+@logfunc
+@login_required
+def admin_job_download(id):
+    job = jobs.readJob(id)
+    if job is None or not job.result_hash:
+        flash(_('Auftrag hat kein Ergebnis.'),MESSAGE_TYPE_ERROR)
+        return redirect(url_for('admin_jobs'))
+
+    # the result is stored gzip compressed like the excel uploads
+    if 'gzip' in request.accept_encodings:
+        rv = send_file(
+            filestore.getPath(job.result_hash),
+            mimetype=job.result_mimetype,
+            as_attachment=True,
+            download_name=job.result_name,
+            conditional=True)
+        rv.headers['Content-Encoding'] = 'gzip'
+        rv.vary.add('Accept-Encoding')
+        return rv
+
+    rv = send_file(
+        job.openResult(),
+        mimetype=job.result_mimetype,
+        as_attachment=True,
+        download_name=job.result_name)
+    rv.vary.add('Accept-Encoding')
+    return rv
+
+
 # --------------------------------------------------------------------------------------
 def authLDAP(uid: str, password: str):
     """
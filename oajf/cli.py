@@ -1,9 +1,12 @@
 import datetime
+import time
+import signal
 import traceback
 import json
 import datetime
 import shutil
 import re
+import io
 from typing import List,Dict
 
 from flask import Flask,g
@@ -26,7 +29,22 @@ from oajf.db import (
     deleteSetting as db_deleteSetting,
     saveSetting as db_saveSetting
 )
-from oajf.util import get_publishers,get_settings,getDOAJChangesFileAsExcelWorkbook,getDOAJDump
+from oajf.db import readExcelFileHashes as db_readExcelFileHashes
+from oajf.db import syncJournalSearch as db_syncJournalSearch
+from oajf.db import archiveJournals as db_archiveJournals
+from oajf.querylog import execute
+from oajf.snapshot import exportSnapshot as snapshot_exportSnapshot
+from oajf.filestore import init as filestore_init
+from oajf import geoip
+from oajf.sessiongc import deleteExpiredSessions
+from oajf.events import rollupEvents as events_rollupEvents
+from oajf import jobs
+from oajf import tasks
+from oajf.util import get_publishers,get_settings,getDOAJChangesFileAsExcelWorkbook,iterDOAJDump,DOAJDumpError,getDOAJWithdrawnIssns
+
+def _addMonths(d: datetime.date, n: int) -> datetime.date:
+    m = d.month - 1 + n
+    return d.replace(year=d.year + m // 12, month=m % 12 + 1, day=1)
 
 def register_cli(app: Flask):
     oajf_cli = AppGroup('oajf')
@@ -157,20 +175,212 @@ def register_cli(app: Flask):
 
     @oajf_cli.command(short_help="Renews geoip info.")
     @click.argument('file')
-    def importGeoIP(file: str):
+    @click.option('--force',is_flag=True,default=False,help="Swap in the new ranges even if there are far fewer than before.")
+    def importGeoIP(file: str, force: bool):
         """
         Import geoip-file.
+        The file is loaded into geoip_staging and checked, then the tables are swapped atomically,
+        lookups never see an empty or partially loaded table.
         """
         db = db_init(app)
 
+        conn = None
         try:
             conn = get_db()
             cur = conn.cursor()
-            sql = "DELETE FROM `geoip`;"
-            cur.execute(sql)
-            sql = f"LOAD DATA LOCAL INFILE '{file}' INTO TABLE `geoip` FIELDS TERMINATED BY ',' (ip_from,ip_to,country_code);"
-            cur.execute(sql)
+            execute(cur,"DROP TABLE IF EXISTS `geoip_staging`;")
+            execute(cur,"CREATE TABLE `geoip_staging` LIKE `geoip`;")
+            # continue the ids of the current table, running workers notice the new rows by MAX(id)
+            execute(cur,"SELECT COALESCE(MAX(id),0), COUNT(*) FROM `geoip`;")
+            max_id,cnt_current = cur.fetchone()
+            execute(cur,f"ALTER TABLE `geoip_staging` AUTO_INCREMENT={int(max_id) + 1};")
+            sql = f"LOAD DATA LOCAL INFILE '{file}' INTO TABLE `geoip_staging` FIELDS TERMINATED BY ',' (ip_from,ip_to,country_code);"
+            execute(cur,sql)
             conn.commit()
+
+            execute(cur,"SELECT COUNT(*) FROM `geoip_staging`;")
+            cnt = cur.fetchone()[0]
+            execute(cur,"SELECT COUNT(*) FROM `geoip_staging` WHERE ip_from > ip_to OR CHAR_LENGTH(country_code) <> 2;")
+            cnt_invalid = cur.fetchone()[0]
+            sql = """
+                SELECT COUNT(*) FROM (
+                    SELECT ip_from, LAG(ip_to) OVER (ORDER BY ip_from) AS prev_to FROM `geoip_staging`
+                ) r WHERE r.prev_to >= r.ip_from;
+            """
+            execute(cur,sql)
+            cnt_overlapping = cur.fetchone()[0]
+
+            errors = []
+            if cnt == 0:
+                errors.append("no ranges loaded")
+            if cnt_invalid:
+                errors.append(f"{cnt_invalid} invalid ranges")
+            if cnt_overlapping:
+                errors.append(f"{cnt_overlapping} overlapping ranges")
+            if not force and cnt < cnt_current / 2:
+                errors.append(f"{cnt} ranges loaded, {cnt_current} before (use --force)")
+            if errors:
+                execute(cur,"DROP TABLE IF EXISTS `geoip_staging`;")
+                print("geoip import rejected: " + ", ".join(errors))
+                exit(1)
+
+            execute(cur,"RENAME TABLE `geoip` TO `geoip_old`, `geoip_staging` TO `geoip`;")
+            execute(cur,"DROP TABLE `geoip_old`;")
+            print(f"{cnt} geoip ranges imported")
+
+            path = app.config.get('GEOIP_FILE',None)
+            if path:
+                cnt = geoip.writeRangeFile(path,geoip.readRanges(cur))
+                print(f"{cnt} ranges written to {path}")
+            geoip.invalidate()
+        except Exception as e:
+            if conn is not None:
+                conn.rollback()
+            print(e)
+            print(traceback.format_exc())
+            exit(1)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    @oajf_cli.command(short_help="Writes the geoip ranges into the range file.")
+    @click.argument('file',required=False)
+    def exportGeoIP(file: str):
+        """
+        Writes the geoip table into the binary range file memory-mapped by the workers, defaults to GEOIP_FILE.
+        """
+        db = db_init(app)
+
+        file = file or app.config.get('GEOIP_FILE',None)
+        if not file:
+            print("no file given and GEOIP_FILE not configured")
+            exit(1)
+
+        conn = None
+        try:
+            conn = get_db()
+            cur = conn.cursor()
+            cnt = geoip.writeRangeFile(file,geoip.readRanges(cur))
+            print(f"{cnt} ranges written to {file}")
+        except Exception as e:
+            print(e)
+            print(traceback.format_exc())
+            exit(1)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+    @oajf_cli.command(short_help="Deletes expired sessions.")
+    @click.option('--batch-size',default = 500, help="Sessions deleted per transaction.")
+    @click.option('--pause',default = 0.1, help="Seconds to wait between batches.")
+    def expireSessions(batch_size,pause):
+        """
+        Deletes sessions past their expiry date in batches, sessions without expiry date
+        PERMANENT_SESSION_LIFETIME after their last activity.
+        """
+        db = db_init(app)
+
+        try:
+            cnt = deleteExpiredSessions(app.permanent_session_lifetime,batch_size=batch_size,pause=pause)
+            print(f"{cnt} expired sessions deleted")
+        except Exception as e:
+            print(e)
+            print(traceback.format_exc())
+            exit(1)
+
+    @oajf_cli.command(short_help="Adds monthly partitions to session_history and drops expired ones.")
+    @click.option('--keep-months',default = 13, help="Drop partitions of months older than this.")
+    @click.option('--months-ahead',default = 2, help="Create partitions for this many future months.")
+    def rotateSessionHistory(keep_months,months_ahead):
+        """
+        Maintains the monthly partitions pYYYYMM of session_history, meant to run monthly.
+        Rows of months without a partition end up in pmax and are never dropped.
+        """
+        db = db_init(app)
+
+        conn = None
+        try:
+            conn = get_db()
+            cur = conn.cursor()
+            execute(cur,"""
+                SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+                WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='session_history' AND PARTITION_NAME IS NOT NULL
+            """)
+            months = sorted(row[0] for row in cur.fetchall() if re.fullmatch(r'p\d{6}',row[0]))
+
+            first = datetime.date.today().replace(day=1)
+            for i in range(0,months_ahead + 1):
+                month = _addMonths(first,i)
+                name = f"p{month:%Y%m}"
+                # partitions can only be split off pmax, above the last existing month
+                if months and name <= months[-1]:
+                    continue
+                execute(cur,f"""
+                    ALTER TABLE session_history REORGANIZE PARTITION pmax INTO (
+                    PARTITION {name} VALUES LESS THAN ('{_addMonths(month,1):%Y-%m-%d}'),
+                    PARTITION pmax VALUES LESS THAN (MAXVALUE))
+                """)
+                months.append(name)
+                print(f"partition {name} added")
+
+            cutoff = f"p{_addMonths(first,-keep_months):%Y%m}"
+            dropped = [name for name in months if name < cutoff]
+            for name in dropped:
+                execute(cur,f"ALTER TABLE session_history DROP PARTITION {name}")
+                print(f"partition {name} dropped")
+            print(f"{len(dropped)} partitions dropped")
+        except Exception as e:
+            print(e)
+            print(traceback.format_exc())
+            exit(1)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    @oajf_cli.command(short_help="Aggregates usage events into hourly counts.")
+    @click.option('--keep-days',default = 90, help="Delete raw events older than this many days, 0 keeps them.")
+    def rollupEvents(keep_days):
+        """
+        Adds the events of completed hours to event_hourly, meant to run hourly.
+        """
+        db = db_init(app)
+
+        try:
+            written,deleted = events_rollupEvents(keep_days=keep_days)
+            print(f"{written} hourly rows written, {deleted} events deleted")
+        except Exception as e:
+            print(e)
+            print(traceback.format_exc())
+            exit(1)
+
+    @oajf_cli.command(short_help="Moves excel files stored in the database into the filestore.")
+    def migrateExcelFiles():
+        """
+        Moves the contents of excelfilehistory.file into the filestore, one file at a time.
+        """
+        db = db_init(app)
+        store = filestore_init(app)
+
+        conn = None
+        cnt = 0
+        try:
+            conn = get_db()
+            cur = conn.cursor()
+            execute(cur,"SELECT id FROM excelfilehistory WHERE file_hash IS NULL AND file IS NOT NULL")
+            ids = [row[0] for row in cur.fetchall()]
+
+            for id in ids:
+                execute(cur,"SELECT file FROM excelfilehistory WHERE id=?",(id,))
+                row = cur.fetchone()
+                digest,size = store.put(io.BytesIO(row[0]))
+                del row
+                execute(cur,"UPDATE excelfilehistory SET file_hash=?,file_size=?,file=NULL WHERE id=?",(digest,size,id))
+                conn.commit()
+                cnt += 1
+                print(f"moved excel file {id} to filestore as {digest}")
+
+            print(f"{cnt} excel files moved to filestore")
         except Exception as e:
             if conn is not None:
                 conn.rollback()
@@ -180,6 +390,126 @@ def register_cli(app: Flask):
             if conn is not None:
                 conn.close()
 
+    @oajf_cli.command(short_help="Runs queued background jobs until stopped.")
+    @click.option('--threads',default = None, type=int, help="Jobs run in parallel, defaults to JOBS['threads'].")
+    def jobWorker(threads):
+        """
+        Runs uploads, DOAJ syncs and exports queued by the web application.
+        SIGTERM and SIGINT stop the worker after the running jobs are finished.
+        """
+        db = db_init(app)
+        filestore_init(app)
+
+        config = app.config.get('JOBS', {})
+        worker = jobs.JobWorker(app,
+                                threads=threads or config.get('threads', 2),
+                                poll_interval=config.get('poll_interval', 2.0))
+        signal.signal(signal.SIGTERM,worker.stop)
+        signal.signal(signal.SIGINT,worker.stop)
+        print(f"job worker {worker.worker} started with {worker.threads} threads")
+        worker.run()
+        print("job worker stopped")
+
+    @oajf_cli.command(short_help="Deletes finished background jobs.")
+    @click.option('--keep-days',default = None, type=int, help="Keep jobs finished within this many days, defaults to JOBS['keep_days'].")
+    def purgeJobs(keep_days):
+        """
+        Deletes finished jobs, their result files are removed by filestoreGC afterwards.
+        """
+        db = db_init(app)
+
+        if keep_days is None:
+            keep_days = app.config.get('JOBS', {}).get('keep_days', 14)
+        try:
+            cnt = jobs.purgeJobs(keep_days)
+            print(f"{cnt} jobs deleted")
+        except Exception as e:
+            print(e)
+            print(traceback.format_exc())
+
+    @oajf_cli.command(short_help="Deletes files from the filestore which are not referenced anymore.")
+    @click.option('--min-age',default = 3600, help="Keep files younger than this many seconds.")
+    def filestoreGC(min_age):
+        """
+        Deletes files from the filestore not referenced by excelfilehistory or by jobs.
+        """
+        db = db_init(app)
+        store = filestore_init(app)
+
+        referenced = db_readExcelFileHashes() | jobs.readJobFileHashes()
+        cnt = store.collectGarbage(referenced,min_age=min_age)
+        print(f"{cnt} unreferenced files deleted from filestore")
+
+    @oajf_cli.command(short_help="Rebuilds the journal_search table from journals and publishers.")
+    def rebuildJournalSearch():
+        """
+        Rewrites all rows of journal_search in one transaction.
+        """
+        db = db_init(app)
+
+        try:
+            cnt = db_syncJournalSearch()
+            print(f"{cnt} journals written to journal_search")
+        except Exception as e:
+            print(e)
+            print(traceback.format_exc())
+            exit(1)
+
+    @oajf_cli.command(short_help="Moves expired journals into the archive table.")
+    @click.option('--batch-size',default = 1000, help="Journals moved per transaction.")
+    @click.option('--grace-days',default = 0, help="Keep journals expired less than this many days ago.")
+    @click.option('--pause',default = 0.1, help="Seconds to wait between batches.")
+    def archiveJournals(batch_size,grace_days,pause):
+        """
+        Moves expired journals from journal to journal_archive in batches, meant to run nightly.
+        Archived journals are still listed in the admin view with "nur aktive Journals" unchecked.
+        """
+        db = db_init(app)
+
+        cnt = 0
+        try:
+            while True:
+                n = db_archiveJournals(batch_size=batch_size,grace_days=grace_days)
+                if n == 0:
+                    break
+                cnt += n
+                print(f"{cnt} journals archived")
+                time.sleep(pause)
+            print(f"{cnt} expired journals moved to journal_archive")
+        except Exception as e:
+            print(e)
+            print(traceback.format_exc())
+            exit(1)
+
+    @oajf_cli.command(short_help="Exports publishers, links, journals and settings into a sqlite snapshot.")
+    @click.argument('file',required=False)
+    def exportSnapshot(file: str):
+        """
+        Exports the tables read by the public pages into a sqlite file.
+        Defaults to the file configured in DATABASE['snapshot'].
+        """
+        db = db_init(app)
+
+        if not file:
+            file = app.config['DATABASE'].get('snapshot',None)
+        if not file:
+            print("no snapshot file given or configured")
+            exit(1)
+
+        conn = None
+        try:
+            conn = get_db()
+            counts = snapshot_exportSnapshot(conn,file)
+            for k,v in counts.items():
+                print(f"{v} rows exported from {k}")
+            print(f"snapshot written to {file}")
+        except Exception as e:
+            print(e)
+            print(traceback.format_exc())
+            exit(1)
+        finally:
+            if conn is not None:
+                conn.close()
 
     @oajf_cli.command(short_help="Imports publishers from json files.")
     @click.argument('file')
@@ -258,21 +588,7 @@ def register_cli(app: Flask):
             exit(1)
 
         try:
-            sheet = wb['Withdrawn']
-            for i,row in enumerate(sheet.rows):
-                if i < 6:
-                    continue
-
-                title = row[0].value
-                if title: title = title.strip()
-                issn = row[1].value
-                if issn: issn = issn.strip()
-                date = row[2].value
-                reason = row[3].value
-                if reason: reason = reason.strip()
-
-                if issn is not None and issn != 'None':
-                    map_issn[issn] = [title,date,reason]
+            map_issn = getDOAJWithdrawnIssns(wb)
 
             get_publishers()
             conn = get_db()
@@ -348,7 +664,6 @@ def register_cli(app: Flask):
 
         j: Journal = None
         p: Publisher
-        l_journal_csv: List[Journal] = []
         l_journal_db: List[Journal]
         l_updated: List[Journal] = []
         l_new: List[Journal] = []
@@ -374,49 +689,36 @@ def register_cli(app: Flask):
                 else:
                     m_pissn[j.print_issn] = j
 
-        l_journal_csv,errs = getDOAJDump(url)
-        for j in l_journal_csv:
-            e_issn_found = False
-            print_issn_found = False
-            if j.e_issn:
-                if j.e_issn in m_eissn:
-                    e_issn_found = True
-                else:
-                    pass
-    #                   print(f"journal e_issn not found : {j.title}, {j.e_issn}, {j.added_on_date}, {j.last_updated_date}")
-
-            if j.print_issn:
-                if j.print_issn in m_pissn:
-                    print_issn_found = True
+        # the dump is streamed, only the new and changed journals are kept as Journal
+        try:
+            for rec in iterDOAJDump(url):
+                j_db = None
+                if rec.e_issn and rec.e_issn in m_eissn:
+                    j_db = m_eissn[rec.e_issn]
+                    matched_by = 'e-issn'
+                elif rec.print_issn and rec.print_issn in m_pissn:
+                    j_db = m_pissn[rec.print_issn]
+                    matched_by = 'p-issn'
+
+                if j_db:
+                    diffs = rec.getDifferences(j_db)
+                    if diffs:
+                        j = rec.toJournal()
+                        j.id = j_db.id
+                        j.valid_till = j_db.valid_till
+                        j.diffs = diffs
+                        l_updated.append(j)
+                        print(f"journal updated ({matched_by} matched): title:{j.title}, e-issn:{j.e_issn}, p-issn:{j.print_issn} - new/old:{j.diffs}")
                 else:
-                    pass
-    #                    print(f"journal print_issn not found : {j.title}, {j.print_issn}, {j.added_on_date}, {j.last_updated_date}")
-
-            if e_issn_found:
-                j_db = m_eissn[j.e_issn]
-                diffs = j.getDifferences(j_db)
-                if diffs:
-                    j.id = j_db.id
-                    j.valid_till = j_db.valid_till
-                    j.diffs = diffs
-                    l_updated.append(j)
-                    print(f"journal updated (e-issn matched): title:{j.title}, e-issn:{j.e_issn}, p-issn:{j.print_issn} - new/old:{j.diffs}")
-            elif print_issn_found:
-                j_db = m_pissn[j.print_issn]
-                diffs = j.getDifferences(j_db)
-                if diffs:
-                    j.id = j_db.id
-                    j.valid_till = j_db.valid_till
-                    j.diffs = diffs
-                    l_updated.append(j)
-                    print(f"journal updated (p-issn matched): title:{j.title}, e-issn:{j.e_issn}, p-issn:{j.print_issn} - new/old:{j.diffs}")
-            else:
-                j.id = -1
-                j.publisher = p
-                j.valid_till = datetime.datetime.today()
-                j.valid_till = j.valid_till.replace(month=12,day=31,hour=23,minute=59,second=59)
-                l_new.append(j)
-
+                    j = rec.toJournal()
+                    j.id = -1
+                    j.publisher = p
+                    j.valid_till = datetime.datetime.today()
+                    j.valid_till = j.valid_till.replace(month=12,day=31,hour=23,minute=59,second=59)
+                    l_new.append(j)
+        except DOAJDumpError as e:
+            print(f"ERROR: {e.args[0]}")
+            exit(1)
 
         if len(l_updated)>0:
             if click.confirm(f'Update {len(l_updated)} changed journals?'):
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from yacryptopan import CryptoPAn
+
+from oajf import metrics
+
+# cryptopan runs one aes encryption per address bit, most sessions come from a small set
+# of nat and proxy addresses, so results are kept in a bounded lru cache
+#
+# with prefix_cache the flip bits of address prefixes are cached as well, at every PREFIX_STEP bits.
+# bit n of the result only depends on the first n bits of the address, so addresses of the same
+# network share the encryptions of their common prefix
+
+
+def _lruGet(cache: OrderedDict, key):
+    value = cache.get(key, None)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def _lruPut(cache: OrderedDict, key, value, maxsize: int):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > maxsize:
+        cache.popitem(last=False)
+
+
+class CachedCryptoPAn(CryptoPAn):
+    PREFIX_STEP = {4: 8, 6: 16}
+
+    def __init__(self, key: bytes, maxsize: int = 10000, prefix_cache: bool = True):
+        super().__init__(key)
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.prefixes: Optional[OrderedDict] = OrderedDict() if prefix_cache else None
+
+    def anonymize(self, addr: str) -> str:
+        with self.lock:
+            result = _lruGet(self.cache, addr)
+        metrics.cacheHit('cryptopan', result is not None)
+        if result is not None:
+            return result
+
+        result = super().anonymize(addr)
+        with self.lock:
+            _lruPut(self.cache, addr, result, self.maxsize)
+        return result
+
+    def anonymize_bin(self, addr: int, version: int) -> int:
+        if self.prefixes is None:
+            return super().anonymize_bin(addr, version)
+
+        assert(version == 4 or version == 6)
+        if version == 4:
+            pos_max = 32
+            ext_addr = addr << 96
+        else:
+            pos_max = 128
+            ext_addr = addr
+        step = self.PREFIX_STEP[version]
+
+        # longest cached prefix
+        start = 0
+        flips = 0
+        with self.lock:
+            for length in range(pos_max - step, 0, -step):
+                cached = _lruGet(self.prefixes, (version, length, ext_addr >> (128 - length)))
+                if cached is not None:
+                    start = length
+                    flips = cached
+                    break
+        metrics.cacheHit('cryptopan_prefix', start > 0)
+
+        new_prefixes = []
+        for pos in range(start, pos_max):
+            if pos > start and pos % step == 0:
+                new_prefixes.append(((version, pos, ext_addr >> (128 - pos)), flips))
+            # same computation as CryptoPAn.anonymize_bin
+            prefix = ext_addr >> (128 - pos) << (128 - pos)
+            padded_addr = prefix | (self._padding_int & self._masks[pos])
+            f = self._cipher.encrypt(padded_addr.to_bytes(16, 'big'))
+            flips = (flips << 1) | (f[0] >> 7)
+
+        if new_prefixes:
+            with self.lock:
+                for key, value in new_prefixes:
+                    _lruPut(self.prefixes, key, value, self.maxsize * 4)
+
+        return addr ^ flips
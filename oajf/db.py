@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import re
+import time
 import logging
+import unicodedata
 import traceback
-from threading import Lock
+from threading import RLock
 from functools import wraps
 from typing import List,Dict,Tuple
 
@@ -11,17 +14,54 @@ try:
 except:
     pass
 
-from flask import g,current_app
+from flask import g,current_app,request,has_app_context,has_request_context
+from flask.globals import request_ctx
 from oajf.models import Journal,Publisher,Link,Excel,Setting,OASTATUS, APPLICATION_REQUIREMENT,LINKTYPE
+from oajf.querylog import execute,setPoolWait,init as querylog_init
+from oajf import metrics
+from oajf.snapshot import Snapshot,isSnapshot
 
 database = None
 
+# read-your-writes: after a write, reads of the same client go to the primary for this many seconds
+STICKY_SECONDS = 10
+STICKY_COOKIE = 'oajf-db-sticky'
+# scopes for stickiness: application data and session data are tracked separately,
+# so the session write at the end of each request doesn't pin all data reads to the primary
+SCOPE_DATA = 'data'
+SCOPE_SESSION = 'session'
+
+# journal_search holds the journals together with the publisher columns used for filtering and sorting,
+# so public queries don't need to join publisher
+JOURNAL_SEARCH_COLUMNS = "journal_id,title,title_norm,link,print_issn,e_issn,valid_till,publisher_id,publisher_name,oa_status,application_requirement"
+JOURNAL_SEARCH_BATCH_SIZE = 1000
+# expired journals are moved to journal_archive by "flask oajf archivejournals"
+JOURNAL_ARCHIVE_COLUMNS = "id,title,title_norm,link,print_issn,e_issn,valid_till,publisher_id,archived_at"
+
 def init(app):
-    global database
+    global database, STICKY_SECONDS, STICKY_COOKIE
 
     if database is None:
         with app.app_context():
             db_config = current_app.config['DATABASE']
+            querylog_init(app)
+            replica = None
+            replica_config = db_config.get('replica', None)
+            if replica_config:
+                replica = DB(
+                    host = replica_config['host'],
+                    port = replica_config['port'],
+                    db = replica_config.get('database',db_config['database']),
+                    user = replica_config.get('user',db_config['user']),
+                    passwd = replica_config.get('password',db_config['password']),
+                    poolsize = replica_config.get('poolsize',db_config['poolsize']),
+                    autocommit = True,
+                    app = app,
+                    pool_name = "oajf_replica",
+                )
+                STICKY_SECONDS = replica_config.get('sticky_seconds',STICKY_SECONDS)
+                STICKY_COOKIE = replica_config.get('sticky_cookie',STICKY_COOKIE)
+
             database = DB(
                 host = db_config['host'],
                 port = db_config['port'],
@@ -31,27 +71,102 @@ def init(app):
                 poolsize = db_config['poolsize'],
                 autocommit = db_config['autocommit'],
                 app = app,
+                replica = replica,
             )
+            if db_config.get('snapshot', None):
+                database.snapshot = Snapshot(db_config['snapshot'])
             database.connect()
 
     return database
 
 
-def get_db():
+# read_only connections are served by the replica if one is configured
+# and there was no recent write in the given scope by the same client
+# with snapshot=True public reads are served from the sqlite snapshot if configured,
+# logged in users always see live data
+# write paths and explicit transactions always use the primary
+def get_db(read_only=False,scope=SCOPE_DATA,snapshot=False):
+    if read_only and not isPrimarySticky(scope):
+        if snapshot and database.snapshot and not _isAdminRequest() and database.snapshot.available():
+            return database.snapshot.getConnection()
+        if database.replica:
+            return database.getConnection(read_only=True)
     conn = database.getConnection()
     return conn
 
-def getPoolStats():
-    has_pool:bool = database.pool is not None
+def _isAdminRequest() -> bool:
+    if not has_request_context():
+        return False
+    # None while the session is being opened, read the attribute directly to not mark the session accessed
+    # (flask >= 3.1 stores it as _session behind a property)
+    ctx = vars(request_ctx._get_current_object())
+    session = ctx.get('_session', ctx.get('session', None))
+    return session is not None and 'uid' in session
+
+def markWrite(scope=SCOPE_DATA):
+    if not has_app_context():
+        return
+    marks = g.get('db_sticky', None)
+    if marks is None:
+        marks = g.db_sticky = {}
+    marks[scope] = time.time() + STICKY_SECONDS
+
+def isPrimarySticky(scope=SCOPE_DATA) -> bool:
+    if scope is None:
+        return False
+    now = time.time()
+    if has_app_context():
+        marks = g.get('db_sticky', None)
+        if marks and marks.get(scope, 0) > now:
+            return True
+    if has_request_context():
+        return _readStickyCookie().get(scope, 0) > now
+    return False
+
+# cookie value: scope:timestamp pairs separated by '|'
+def _readStickyCookie() -> Dict[str,float]:
+    marks = {}
+    value = request.cookies.get(STICKY_COOKIE, '')
+    for x in value.split('|'):
+        scope,_sep,until = x.partition(':')
+        try:
+            marks[scope] = float(until)
+        except ValueError:
+            pass
+    return marks
+
+# called by the session interface after the session has been saved,
+# so writes to the session table are covered as well
+def setStickyCookie(response):
+    marks = g.get('db_sticky', None)
+    if marks:
+        merged = _readStickyCookie()
+        merged.update(marks)
+        value = '|'.join([f"{k}:{v:.3f}" for k,v in merged.items()])
+        response.set_cookie(STICKY_COOKIE, value, max_age=STICKY_SECONDS, httponly=True, samesite='Strict')
+    return response
+
+# mariadb.ConnectionPool has no public api for the number of free and used connections
+def getPoolStats(db=None):
+    db = db if db else database
+    has_pool:bool = db is not None and db.pool is not None
     free:int = 0
     used:int = 0
-    
 
-    if database and database.pool:
-        free, used = len(database.pool._connections_free), len(database.pool._connections_used)
+    if has_pool:
+        free = len(getattr(db.pool,'_connections_free',()))
+        used = len(getattr(db.pool,'_connections_used',()))
 
     return free, used, has_pool
 
+# called after every request and when a connection is handed out, each worker process keeps its gauges current,
+# the livesum over all processes is only right if none of them reports stale values
+def updatePoolMetrics():
+    for db in (database, database.replica if database else None):
+        free, used, has_pool = getPoolStats(db)
+        if has_pool:
+            metrics.setPoolConnections(db.pool_name, free, used)
+
 
 def ensurePublishersLoaded(force_reload=False):
     l_publisher = getattr(g, 'publishers', None)
@@ -63,9 +178,83 @@ def ensurePublishersLoaded(force_reload=False):
     
     l_publisher
 
+_re_title_separator = re.compile(r"[\W_]+")
+
+def normalizeTitle(title: str) -> str:
+    """
+    folds a title for searching: accents removed, casefolded, '&' spelled 'and',
+    punctuation and whitespace collapsed into single blanks
+    """
+    if not title:
+        return ''
+    s = unicodedata.normalize('NFKD',title)
+    s = ''.join(c for c in s if not unicodedata.combining(c))
+    s = s.casefold().replace('&',' and ')
+    s = _re_title_separator.sub(' ',s)
+    return s.strip()[:300]
+
+def syncJournalSearch(transaction_conn=None,journal_ids=None,publisher_id=None) -> int:
+    """
+    rewrites the journal_search rows of the given journals or of all journals of a publisher
+    without arguments the whole table is rebuilt
+    """
+    rows_affected = 0
+    conn = None
+
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
+        cur = conn.cursor()
+
+        sql_select = """
+            SELECT j.id, j.title, j.link, j.print_issn, j.e_issn, j.valid_till, j.publisher_id,
+            p.name, p.oa_status, p.application_requirement
+            FROM journal j JOIN publisher p ON j.publisher_id=p.id
+        """
+        sql_delete = "DELETE FROM journal_search "
+        sql_insert = f"""
+            INSERT INTO journal_search
+            ({JOURNAL_SEARCH_COLUMNS})
+            VALUES (?,?,?,?,?,?,?,?,?,?,?)
+        """
+        if journal_ids is not None:
+            ids = ",".join(str(int(id)) for id in journal_ids)
+            if not ids:
+                return 0
+            sql_select += f"WHERE j.id IN ({ids}) "
+            sql_delete += f"WHERE journal_id IN ({ids}) "
+        elif publisher_id is not None:
+            sql_select += f"WHERE j.publisher_id={int(publisher_id)} "
+            sql_delete += f"WHERE publisher_id={int(publisher_id)} "
+
+        execute(cur,sql_select)
+        rows = []
+        for row in cur.fetchall():
+            rows.append((row[0],row[1],normalizeTitle(row[1]),row[2],row[3],row[4],row[5],row[6],row[7],row[8],row[9]))
+
+        execute(cur,sql_delete)
+        for i in range(0,len(rows),JOURNAL_SEARCH_BATCH_SIZE):
+            execute(cur,sql_insert,rows[i:i+JOURNAL_SEARCH_BATCH_SIZE],many=True)
+        rows_affected = len(rows)
+
+        if not transaction_conn:
+            conn.commit()
+    except Exception as e:
+        if not transaction_conn and conn:
+            conn.rollback()
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+    return rows_affected
+
 def saveJournal(o:Journal,transaction_conn=None,) -> Journal:
     try:
         conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
         cur = conn.cursor()
         sql_update = """
             UPDATE journal 
@@ -77,9 +266,31 @@ def saveJournal(o:Journal,transaction_conn=None,) -> Journal:
             (title,link,print_issn,e_issn,valid_till,publisher_id)
             VALUES (?,?,?,?,?,?)
         """
+        sql_search = f"""
+            REPLACE INTO journal_search
+            ({JOURNAL_SEARCH_COLUMNS})
+            SELECT j.id,j.title,?,j.link,j.print_issn,j.e_issn,j.valid_till,j.publisher_id,
+            p.name,p.oa_status,p.application_requirement
+            FROM journal j JOIN publisher p ON j.publisher_id=p.id
+            WHERE j.id=?
+        """
+        sql_update_archive = """
+            UPDATE journal_archive
+            SET title=?,title_norm=?,link=?,print_issn=?,e_issn=?,valid_till=?
+            WHERE id=?
+        """
+        # an archived journal valid again is moved back into journal, ids are kept
+        sql_restore = """
+            INSERT INTO journal
+            (id,title,link,print_issn,e_issn,valid_till,publisher_id)
+            SELECT id,title,link,print_issn,e_issn,valid_till,publisher_id
+            FROM journal_archive
+            WHERE id=? AND valid_till >= CURDATE()
+        """
+        sql_delete_archive = "DELETE FROM journal_archive WHERE id=?"
 
         if o.id is None or int(o.id) == -1:
-            cur.execute(sql_insert,
+            execute(cur,sql_insert,
                         (o.title,
                         o.url,
                         o.print_issn,
@@ -89,7 +300,7 @@ def saveJournal(o:Journal,transaction_conn=None,) -> Journal:
                         ))
             o.id = cur.lastrowid
         else:
-            cur.execute(sql_update,
+            execute(cur,sql_update,
                         (o.title,
                         o.url,
                         o.print_issn,
@@ -97,6 +308,23 @@ def saveJournal(o:Journal,transaction_conn=None,) -> Journal:
                         o.valid_till,
                         o.id,
                         ))
+            # archived journals are listed in the admin view and can be edited there
+            execute(cur,sql_update_archive,
+                        (o.title,
+                        normalizeTitle(o.title),
+                        o.url,
+                        o.print_issn,
+                        o.e_issn,
+                        o.valid_till,
+                        o.id,
+                        ))
+            execute(cur,sql_restore,(o.id,))
+            if cur.rowcount > 0:
+                execute(cur,sql_delete_archive,(o.id,))
+
+        # the publisher columns are copied in the same statement, o.publisher isn't always loaded
+        execute(cur,sql_search,(normalizeTitle(o.title),o.id))
+
         if not transaction_conn:
             conn.commit()
     except Exception as e:
@@ -117,25 +345,192 @@ def deleteJournal(o:Journal,transaction_conn=None,id=None, e_issn=None,publisher
 
     try:
         conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
         cur = conn.cursor()
         sql = "DELETE FROM journal WHERE 1 = 1 "
+        sql_search = "DELETE FROM journal_search WHERE 1 = 1 "
+        sql_archive = "DELETE FROM journal_archive WHERE 1 = 1 "
         if o: 
             sql += "AND id=? "
+            sql_search += "AND journal_id=? "
+            sql_archive += "AND id=? "
             params.append(o.id)
         elif id: 
             sql += "AND id=? "
+            sql_search += "AND journal_id=? "
+            sql_archive += "AND id=? "
             params.append(id)
         elif e_issn: 
             sql += "AND e_issn=? " 
+            sql_search += "AND e_issn=? " 
+            sql_archive += "AND e_issn=? " 
             params.append(e_issn)
         elif publisher_id: 
             sql += "AND publisher_id=? " 
+            sql_search += "AND publisher_id=? " 
+            sql_archive += "AND publisher_id=? " 
             params.append(publisher_id)
 
         if params:
-            cur.execute(sql,params)
+            execute(cur,sql,params)
+            rows_affected = cur.rowcount
+            execute(cur,sql_search,params)
+            execute(cur,sql_archive,params)
+            rows_affected += cur.rowcount
+            print(f"rows_affected {rows_affected}")
+
+            if not transaction_conn:
+                conn.commit()
+    except Exception as e:
+        if params:
+            if not transaction_conn and conn:
+                conn.rollback()
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+    return rows_affected
+
+def archiveJournals(transaction_conn=None,batch_size=1000,grace_days=0) -> int:
+    """
+    moves one batch of journals expired more than grace_days ago from journal to journal_archive,
+    ids are kept. returns the number of archived journals, 0 when nothing is left to archive
+    """
+    rows_affected = 0
+    conn = None
+
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
+        cur = conn.cursor()
+
+        # range scan on idx_valid_till
+        execute(cur,"SELECT id FROM journal WHERE valid_till < CURDATE() - INTERVAL ? DAY ORDER BY valid_till LIMIT ?",(int(grace_days),int(batch_size)))
+        ids = ",".join(str(row[0]) for row in cur.fetchall())
+
+        if ids:
+            execute(cur,f"""
+                REPLACE INTO journal_archive
+                ({JOURNAL_ARCHIVE_COLUMNS})
+                SELECT j.id,j.title,COALESCE(s.title_norm,j.title),j.link,j.print_issn,j.e_issn,j.valid_till,j.publisher_id,NOW()
+                FROM journal j LEFT JOIN journal_search s ON s.journal_id=j.id
+                WHERE j.id IN ({ids})
+            """)
+            execute(cur,f"DELETE FROM journal_search WHERE journal_id IN ({ids})")
+            execute(cur,f"DELETE FROM journal WHERE id IN ({ids})")
+            rows_affected = cur.rowcount
+
+        if not transaction_conn:
+            conn.commit()
+    except Exception as e:
+        if not transaction_conn and conn:
+            conn.rollback()
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+    return rows_affected
+
+#
+# journal_staging
+# uploads are parsed into journal_staging in committed chunks and moved into journal in one short transaction
+#
+
+def saveJournalStaging(upload_id: str,rows: List[Tuple],transaction_conn=None) -> int:
+    """
+    inserts rows of (row_idx,title,link,print_issn,e_issn) of an upload into journal_staging
+    """
+    if not rows:
+        return 0
+
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        cur = conn.cursor()
+        sql_insert = """
+            INSERT INTO journal_staging
+            (upload_id,row_idx,title,link,print_issn,e_issn)
+            VALUES (?,?,?,?,?,?)
+        """
+        execute(cur,sql_insert,[(upload_id,) + tuple(row) for row in rows],many=True)
+
+        if not transaction_conn:
+            conn.commit()
+    except Exception as e:
+        if not transaction_conn and conn:
+            conn.rollback()
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+    return len(rows)
+
+def applyJournalStaging(upload_id: str,publisher_id: int,valid_till,transaction_conn=None) -> int:
+    """
+    copies the staged rows of an upload into journal and rewrites the publisher's journal_search rows
+    returns the number of inserted journals, the staged rows are left for deleteJournalStaging
+    """
+    rows_affected = 0
+
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
+        cur = conn.cursor()
+        sql_insert = """
+            INSERT INTO journal
+            (title,link,print_issn,e_issn,valid_till,publisher_id)
+            SELECT title,link,print_issn,e_issn,?,?
+            FROM journal_staging
+            WHERE upload_id=?
+            ORDER BY row_idx
+        """
+        execute(cur,sql_insert,(valid_till,publisher_id,upload_id))
+        rows_affected = cur.rowcount
+        syncJournalSearch(transaction_conn=conn,publisher_id=publisher_id)
+
+        if not transaction_conn:
+            conn.commit()
+    except Exception as e:
+        if not transaction_conn and conn:
+            conn.rollback()
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+    return rows_affected
+
+def deleteJournalStaging(upload_id: str = None,transaction_conn=None,older_than_hours: int = None) -> int:
+    """
+    deletes the staged rows of an upload, or the leftovers of uploads started more than older_than_hours ago
+    """
+    rows_affected = 0
+    params = []
+
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        cur = conn.cursor()
+        sql = "DELETE FROM journal_staging WHERE 1 = 1 "
+        if upload_id:
+            sql += "AND upload_id=? "
+            params.append(upload_id)
+        elif older_than_hours is not None:
+            sql += "AND created < NOW() - INTERVAL ? HOUR "
+            params.append(int(older_than_hours))
+
+        if params:
+            execute(cur,sql,params)
             rows_affected = cur.rowcount
-            print(f"rows_affected {cur.rowcount}")
 
             if not transaction_conn:
                 conn.commit()
@@ -152,6 +547,195 @@ def deleteJournal(o:Journal,transaction_conn=None,id=None, e_issn=None,publisher
 
     return rows_affected
 
+def readJournalStaging(upload_id: str,transaction_conn=None) -> List[Tuple]:
+    """
+    returns the staged rows (row_idx,title,link,print_issn,e_issn) of an upload in file order
+    """
+    rows = []
+
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        cur = conn.cursor()
+        sql = """
+            SELECT row_idx,title,link,print_issn,e_issn
+            FROM journal_staging
+            WHERE upload_id=?
+            ORDER BY row_idx
+        """
+        execute(cur,sql,(upload_id,))
+        rows = [tuple(row) for row in cur.fetchall()]
+    except Exception as e:
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+    return rows
+
+def countJournalStaging(upload_id: str,transaction_conn=None,lock: bool = False) -> int:
+    """
+    returns the number of staged rows of an upload, with lock the rows are locked until the end of the transaction
+    """
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        cur = conn.cursor()
+        sql = "SELECT COUNT(*) FROM journal_staging WHERE upload_id=? "
+        if lock:
+            sql += "FOR UPDATE"
+        execute(cur,sql,(upload_id,))
+        return cur.fetchone()[0]
+    except Exception as e:
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+def readJournalStagingConflicts(upload_id: str,publisher_id: int,transaction_conn=None) -> List[Tuple]:
+    """
+    returns the staged rows whose issn belongs to a journal of another publisher
+    as (row_idx,issn,journal_id,title,publisher_name)
+    """
+    rows = []
+
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        cur = conn.cursor()
+        # one join per issn column, both use the issn indexes of journal_search
+        sql = """
+            SELECT s.row_idx,s.e_issn,j.journal_id,j.title,j.publisher_name
+            FROM journal_staging s JOIN journal_search j ON j.e_issn=s.e_issn
+            WHERE s.upload_id=? AND j.publisher_id<>?
+            UNION ALL
+            SELECT s.row_idx,s.print_issn,j.journal_id,j.title,j.publisher_name
+            FROM journal_staging s JOIN journal_search j ON j.print_issn=s.print_issn
+            WHERE s.upload_id=? AND j.publisher_id<>?
+            ORDER BY 1
+        """
+        execute(cur,sql,(upload_id,publisher_id,upload_id,publisher_id))
+        rows = [tuple(row) for row in cur.fetchall()]
+    except Exception as e:
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+    return rows
+
+def matchJournalStaging(upload_id: str,matches: List[Tuple],transaction_conn=None) -> int:
+    """
+    stores the matches (row_idx,journal_id,changed) of staged rows with existing journals
+    """
+    if not matches:
+        return 0
+
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        cur = conn.cursor()
+        sql_update = """
+            UPDATE journal_staging
+            SET journal_id=?,changed=?
+            WHERE upload_id=? AND row_idx=?
+        """
+        params = [(journal_id,1 if changed else 0,upload_id,row_idx) for row_idx,journal_id,changed in matches]
+        for i in range(0,len(params),JOURNAL_SEARCH_BATCH_SIZE):
+            execute(cur,sql_update,params[i:i+JOURNAL_SEARCH_BATCH_SIZE],many=True)
+
+        if not transaction_conn:
+            conn.commit()
+    except Exception as e:
+        if not transaction_conn and conn:
+            conn.rollback()
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+    return len(matches)
+
+def syncJournalStaging(upload_id: str,publisher_id: int,valid_till,transaction_conn=None) -> Dict[str,int]:
+    """
+    applies a matched upload (see matchJournalStaging) to the publisher's journals: unmatched journals are deleted,
+    changed ones updated, unmatched rows inserted and valid_till set where it differs. ids of matched journals are kept,
+    only the journal_search rows of inserted and changed journals are rewritten
+    returns the number of deleted, inserted, updated and valid_till changed journals
+    """
+    counts = {'deleted': 0,'inserted': 0,'updated': 0,'valid_till': 0}
+
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
+        cur = conn.cursor()
+
+        # journal_search first, journal is the reference of its unmatched rows
+        for table,column in (('journal_search','journal_id'),('journal','id')):
+            execute(cur,f"""
+                DELETE j FROM {table} j
+                LEFT JOIN journal_staging s ON s.upload_id=? AND s.journal_id=j.{column}
+                WHERE j.publisher_id=? AND s.journal_id IS NULL
+            """,(upload_id,publisher_id))
+        counts['deleted'] = cur.rowcount
+        # a re-uploaded list replaces the archived journals as well, like a deletion of the publisher's journals
+        execute(cur,"DELETE FROM journal_archive WHERE publisher_id=?",(publisher_id,))
+
+        execute(cur,"""
+            UPDATE journal j JOIN journal_staging s ON s.journal_id=j.id
+            SET j.title=s.title,j.link=s.link,j.print_issn=s.print_issn,j.e_issn=s.e_issn
+            WHERE s.upload_id=? AND s.changed=1
+        """,(upload_id,))
+        counts['updated'] = cur.rowcount
+
+        for table,column in (('journal_search','journal_id'),('journal','id')):
+            execute(cur,f"""
+                UPDATE {table} j JOIN journal_staging s ON s.journal_id=j.{column}
+                SET j.valid_till=?
+                WHERE s.upload_id=? AND NOT (j.valid_till <=> ?)
+            """,(valid_till,upload_id,valid_till))
+        counts['valid_till'] = cur.rowcount
+
+        execute(cur,"""
+            INSERT INTO journal
+            (title,link,print_issn,e_issn,valid_till,publisher_id)
+            SELECT title,link,print_issn,e_issn,?,?
+            FROM journal_staging
+            WHERE upload_id=? AND journal_id IS NULL
+            ORDER BY row_idx
+        """,(valid_till,publisher_id,upload_id))
+        counts['inserted'] = cur.rowcount
+
+        # the new journals are the publisher's journals without a match
+        execute(cur,"""
+            SELECT j.id FROM journal j
+            LEFT JOIN journal_staging s ON s.upload_id=? AND s.journal_id=j.id
+            WHERE j.publisher_id=? AND s.journal_id IS NULL
+            UNION ALL
+            SELECT journal_id FROM journal_staging
+            WHERE upload_id=? AND changed=1
+        """,(upload_id,publisher_id,upload_id))
+        ids = [row[0] for row in cur.fetchall()]
+        syncJournalSearch(transaction_conn=conn,journal_ids=ids)
+
+        if not transaction_conn:
+            conn.commit()
+    except Exception as e:
+        if not transaction_conn and conn:
+            conn.rollback()
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+    return counts
+
 def readJournals(
                 transaction_conn=None,
                 keyword: str = None, 
@@ -165,37 +749,56 @@ def readJournals(
                  id: int = None,
                  order: str = None,
                  limit: int = None,
+                 include_archived: bool = False,
                  ) -> List[Journal]:
     l_journal: List[Journal] = []
 
     try:
 
-        conn = transaction_conn if transaction_conn else get_db()
+        conn = transaction_conn if transaction_conn else get_db(read_only=True,snapshot=True)
         cur = conn.cursor()
 
         if keyword:
             keyword = keyword.strip()
-            kw1 = kw2 = keyword
             expr = "%" + keyword + "%"
-            kw1 = kw1.replace(' &',' and')
-            kw1 = "%" + kw1 + "%"
-            kw2 = kw2.replace(' and',' &')
-            kw2 = "%" + kw2 + "%"
-
-
-        sql = "SELECT j.id, j.title, j.link, j.print_issn, j.e_issn, j.valid_till, j. publisher_id "
-        sql += "FROM journal j LEFT JOIN publisher p ON j.publisher_id=p.id "
+            # title_norm spells '&' as 'and', so both spellings of a keyword match. a keyword that is mostly
+            # punctuation ('C++', 'C#') folds to almost nothing, it only matches the raw title
+            keyword_norm = normalizeTitle(keyword)
+            expr_norm = None
+            if len(keyword_norm.replace(' ','')) * 2 > len(''.join(keyword.split())):
+                expr_norm = "%" + keyword_norm + "%"
+
+        sql = "SELECT s.journal_id, s.title, s.link, s.print_issn, s.e_issn, s.valid_till, s.publisher_id "
+        if include_archived and not isSnapshot(conn):
+            sql += f"""FROM (
+                SELECT {JOURNAL_SEARCH_COLUMNS} FROM journal_search
+                UNION ALL
+                SELECT a.id,a.title,a.title_norm,a.link,a.print_issn,a.e_issn,a.valid_till,a.publisher_id,
+                p.name,p.oa_status,p.application_requirement
+                FROM journal_archive a JOIN publisher p ON a.publisher_id=p.id
+            ) s """
+        else:
+            sql += "FROM journal_search s "
         sql += "WHERE 1=1 "
         if only_active:
-            sql += "AND j.valid_till >= CURDATE() "
+            if isSnapshot(conn):
+                sql += "AND s.valid_till >= date('now','localtime') "
+            else:
+                sql += "AND s.valid_till >= CURDATE() "
         if keyword:
-            sql += "AND (j.title LIKE ? OR j.title LIKE ? OR j.title LIKE ? OR j.print_issn LIKE ? OR j.e_issn LIKE ? OR p.name LIKE ?) "
+            sql += "AND (s.title LIKE ? "
+            if expr_norm:
+                if isSnapshot(conn):
+                    sql += "OR s.journal_id IN (SELECT rowid FROM journal_search_fts WHERE title_norm LIKE ?) "
+                else:
+                    sql += "OR s.title_norm LIKE ? "
+            sql += "OR s.print_issn LIKE ? OR s.e_issn LIKE ? OR s.publisher_name LIKE ?) "
         if publisher:
-            sql += "AND p.id = "+str(publisher.id) + " "
+            sql += "AND s.publisher_id = "+str(publisher.id) + " "
         if e_issn:
-            sql += "AND j.e_issn = '" + e_issn + "' "
+            sql += "AND s.e_issn = '" + e_issn + "' "
         if id:
-            sql += "AND j.id = " + str(id) + " "
+            sql += "AND s.journal_id = " + str(id) + " "
         if order_sql:
             sql += order_sql
         if limit_sql:
@@ -207,13 +810,13 @@ def readJournals(
             for i,b in enumerate(a):
                 if i>0: s += ","
                 field,dir = b.split(".")
-                if field == 'title': field = "j.title"
-                if field == 'publisher': field = "p.name"
-                if field == 'e_issn': field = "j.e_issn"
-                if field == 'p_issn': field = "j.print_issn"
-                if field == 'application_requirement': field = "p.application_requirement"
-                if field == 'oa_status': field = "p.oa_status"
-                if field == 'publisher_name': field = "p.name"
+                if field == 'title': field = "s.title"
+                if field == 'publisher': field = "s.publisher_name"
+                if field == 'e_issn': field = "s.e_issn"
+                if field == 'p_issn': field = "s.print_issn"
+                if field == 'application_requirement': field = "s.application_requirement"
+                if field == 'oa_status': field = "s.oa_status"
+                if field == 'publisher_name': field = "s.publisher_name"
                 s += field + " " + dir
             sql += ' ORDER BY ' + s
 
@@ -221,9 +824,10 @@ def readJournals(
             sql += ' LIMIT ' + str(limit)
 
         if keyword:
-            cur.execute(sql,(expr,kw1,kw2,expr,expr,expr,))
+            params = (expr,expr_norm,expr,expr,expr,) if expr_norm else (expr,expr,expr,expr,)
+            execute(cur,sql,params)
         else:
-            cur.execute(sql)
+            execute(cur,sql)
 
         for row in cur:
             j = Journal()
@@ -259,6 +863,7 @@ def readJournals(
 def saveLink(o:Link,transaction_conn=None,) -> Link:
     try:
         conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
         cur = conn.cursor()
 
         sql = """
@@ -267,7 +872,7 @@ def saveLink(o:Link,transaction_conn=None,) -> Link:
             VALUES 
             (?,?,?,?,?)
             """                  
-        cur.execute(sql,
+        execute(cur,sql,
                     (o.publisher.id,
                     o.link,
                     o.linktype.key,
@@ -289,10 +894,101 @@ def saveLink(o:Link,transaction_conn=None,) -> Link:
 
     return o
 
+# persists the links of a publisher as a diff against the links stored in the database
+# links are matched by id, unknown or missing ids are inserted, unreferenced links deleted
+# inserts, updates and deletes are each sent as one batch
+def saveLinks(o:Publisher,transaction_conn=None,) -> Tuple[int,int,int]:
+    l_insert: List[Link] = []
+    l_update: List[Link] = []
+    m_link: Dict[int,Tuple] = {}
+
+    sql_select = """
+        SELECT id,link,linktype,linktext_de,linktext_en
+        FROM link
+        WHERE publisher_id=?
+    """
+    sql_insert = """
+        INSERT INTO link
+        (publisher_id,link,linktype,linktext_de,linktext_en)
+        VALUES
+        (?,?,?,?,?)
+    """
+    sql_update = """
+        UPDATE link
+        SET link=?,linktype=?,linktext_de=?,linktext_en=?
+        WHERE id=?
+    """
+    sql_delete = "DELETE FROM link WHERE id=?"
+
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
+        cur = conn.cursor()
+
+        execute(cur,sql_select,(o.id,))
+        for row in cur.fetchall():
+            m_link[row[0]] = tuple(row[1:])
+
+        for link in o.links:
+            link.publisher = o
+            values = (link.link,
+                      link.linktype.key if link.linktype else None,
+                      link.linktext_de,
+                      link.linktext_en)
+            try:
+                id = int(link.id) if link.id is not None and link.id != '' else None
+            except ValueError:
+                id = None
+
+            if id in m_link:
+                if m_link.pop(id) != values:
+                    link.id = id
+                    l_update.append(link)
+                else:
+                    link.id = id
+            else:
+                link.id = None
+                l_insert.append(link)
+
+        if m_link:
+            execute(cur,sql_delete,[(id,) for id in m_link.keys()],many=True)
+        if l_update:
+            execute(cur,sql_update,
+                    [(l.link,
+                      l.linktype.key if l.linktype else None,
+                      l.linktext_de,
+                      l.linktext_en,
+                      l.id) for l in l_update],
+                    many=True)
+        # ids of bulk inserted links are not returned, reread the publisher if needed
+        if l_insert:
+            execute(cur,sql_insert,
+                    [(o.id,
+                      l.link,
+                      l.linktype.key if l.linktype else None,
+                      l.linktext_de,
+                      l.linktext_en) for l in l_insert],
+                    many=True)
+
+        if not transaction_conn:
+            conn.commit()
+    except Exception as e:
+        if not transaction_conn and conn:
+            conn.rollback()
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+    return len(l_insert),len(l_update),len(m_link)
+
 
 def savePublisher(o:Publisher,transaction_conn=None,) -> Publisher:
     try:
         conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
         cur = conn.cursor()
 
         sql_update = """
@@ -318,7 +1014,7 @@ def savePublisher(o:Publisher,transaction_conn=None,) -> Publisher:
             """                  
 
         if o.id is None or int(o.id) == -1:
-            cur.execute(sql_insert,
+            execute(cur,sql_insert,
                         (o.name,
                         o.validity,
                         o.oa_status.key,
@@ -338,7 +1034,7 @@ def savePublisher(o:Publisher,transaction_conn=None,) -> Publisher:
                         ))
             o.id = cur.lastrowid
         else:
-            cur.execute(sql_update,
+            execute(cur,sql_update,
                         (o.name,
                         o.validity,
                         o.oa_status.key,
@@ -357,11 +1053,15 @@ def savePublisher(o:Publisher,transaction_conn=None,) -> Publisher:
                         o.doaj_linked,
                         o.id,
                         ))
-            deleteLink(None,transaction_conn=conn,publisher_id=o.id)
-            
-        for link in o.links:
-            link.publisher = o
-            link = saveLink(link,transaction_conn=conn)
+
+        saveLinks(o,transaction_conn=conn)
+
+        execute(cur,"UPDATE journal_search SET publisher_name=?,oa_status=?,application_requirement=? WHERE publisher_id=?",
+                    (o.name,
+                    o.oa_status.key,
+                    o.application_requirement.key,
+                    o.id,
+                    ))
 
         if not transaction_conn:
             conn.commit()
@@ -377,9 +1077,10 @@ def savePublisher(o:Publisher,transaction_conn=None,) -> Publisher:
 
     return o
 
-def readPublishers(transaction_conn=None) -> Tuple[List[Publisher],Dict[int,Publisher]]:
+def readPublishers(transaction_conn=None,id=None) -> Tuple[List[Publisher],Dict[int,Publisher]]:
     l_publisher: List[Publisher] = []
     m_publisher: Dict[int,Publisher] = {}
+    params = []
     sql_publisher = """
         SELECT 
         id,name,validity,oa_status,application_requirement,
@@ -393,12 +1094,16 @@ def readPublishers(transaction_conn=None) -> Tuple[List[Publisher],Dict[int,Publ
         id,publisher_id,link,linktype,linktext_de,linktext_en
         FROM link
     """
+    if id:
+        sql_publisher += " WHERE id=?"
+        sql_link += " WHERE publisher_id=?"
+        params.append(id)
 
     try:
-        conn = transaction_conn if transaction_conn else get_db()
+        conn = transaction_conn if transaction_conn else get_db(read_only=True,snapshot=True)
         cur = conn.cursor()
 
-        cur.execute(sql_publisher)
+        execute(cur,sql_publisher,params)
         for row in cur:
             it = iter(range(0,30))     
             p = Publisher()
@@ -423,7 +1128,7 @@ def readPublishers(transaction_conn=None) -> Tuple[List[Publisher],Dict[int,Publ
             l_publisher.append(p)
             m_publisher[p.id] = p
 
-        cur.execute(sql_link)
+        execute(cur,sql_link,params)
         for row in cur:
             it = iter(range(0,30))     
             l = Link()
@@ -458,6 +1163,7 @@ def deleteLink(o:Link,transaction_conn=None,publisher_id=None ) -> int:
 
     try:
         conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
         cur = conn.cursor()
 
         sql = "DELETE FROM link WHERE 1 = 1 "
@@ -469,7 +1175,7 @@ def deleteLink(o:Link,transaction_conn=None,publisher_id=None ) -> int:
             params.append(publisher_id)
 
         if params:
-            cur.execute(sql,params)
+            execute(cur,sql,params)
             rows_affected = cur.rowcount
 
             if not transaction_conn:
@@ -493,6 +1199,7 @@ def deletePublisher(o:Publisher,transaction_conn=None,id=None ) -> int:
 
     try:
         conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
 
         if o:
             deleteLink(None,transaction_conn=conn,publisher_id=o.id)
@@ -510,7 +1217,9 @@ def deletePublisher(o:Publisher,transaction_conn=None,id=None ) -> int:
             params.append(id)
 
         if params:
-            cur.execute(sql,params)
+            execute(cur,"DELETE FROM journal_search WHERE publisher_id=?",params)
+            execute(cur,"DELETE FROM journal_archive WHERE publisher_id=?",params)
+            execute(cur,sql,params)
             rows_affected = cur.rowcount
 
             if not transaction_conn:
@@ -529,23 +1238,25 @@ def deletePublisher(o:Publisher,transaction_conn=None,id=None ) -> int:
     return rows_affected
 
 
+# file contents live in the filestore, include_data only reads the legacy blob column
+# of rows not yet migrated
 def readExcelFiles(transaction_conn=None,id=None, include_data=False) -> List[Excel]:
     e: Excel
     l_excel: List[Excel] = []
 
-    sql = "SELECT id,name,uploaded,valid,publisher_id"
+    sql = "SELECT id,name,uploaded,valid,publisher_id,file_hash,file_size"
     if include_data:
         sql += ",file"
     sql += " FROM excelfilehistory"
     if id:
-        sql += " WHERE id="+id
+        sql += " WHERE id="+str(int(id))
 
     try:
         ensurePublishersLoaded()
-        conn = transaction_conn if transaction_conn else get_db()
+        conn = transaction_conn if transaction_conn else get_db(read_only=True)
         cur = conn.cursor()
 
-        cur.execute(sql)
+        execute(cur,sql)
         for row in cur:
             it = iter(range(0,30))     
             e = Excel()
@@ -554,6 +1265,8 @@ def readExcelFiles(transaction_conn=None,id=None, include_data=False) -> List[Ex
             e.uploaded = row[next(it)]
             e.valid = row[next(it)]
             e.publisher = g.m_publishers[row[next(it)]]
+            e.file_hash = row[next(it)]
+            e.file_size = row[next(it)]
             if include_data:
                 e.file = row[next(it)]
             l_excel.append(e)
@@ -574,29 +1287,34 @@ def readExcelFiles(transaction_conn=None,id=None, include_data=False) -> List[Ex
 def saveExcelFile(o:Excel,transaction_conn=None,) -> Journal:
     try:
         conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
         cur = conn.cursor()
         sql_update = """
             UPDATE excelfilehistory 
-            SET name=?,file=?,valid=?,publisher_id=?
+            SET name=?,file=?,file_hash=?,file_size=?,valid=?,publisher_id=?
             WHERE id=?
         """
         sql_insert = """
-            INSERT INTO excelfilehistory (name,file,valid,publisher_id)
-            VALUES (?,?,?,?)
+            INSERT INTO excelfilehistory (name,file,file_hash,file_size,valid,publisher_id)
+            VALUES (?,?,?,?,?,?)
         """
 
         if o.id is None or int(o.id) == -1:
-            cur.execute(sql_insert,
+            execute(cur,sql_insert,
                         (o.name,
                         o.file,
+                        o.file_hash,
+                        o.file_size,
                         o.valid,
                         o.publisher.id,
                         ))
             o.id = cur.lastrowid
         else:
-            cur.execute(sql_update,
+            execute(cur,sql_update,
                         (o.name,
                         o.file,
+                        o.file_hash,
+                        o.file_size,
                         o.valid,
                         o.publisher.id,
                         o.id,
@@ -616,12 +1334,34 @@ def saveExcelFile(o:Excel,transaction_conn=None,) -> Journal:
     return o
 
 
+def readExcelFileHashes(transaction_conn=None) -> set:
+    hashes = set()
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        cur = conn.cursor()
+        execute(cur,"SELECT DISTINCT file_hash FROM excelfilehistory WHERE file_hash IS NOT NULL")
+        for row in cur:
+            hashes.add(row[0])
+    except Exception as e:
+        if not transaction_conn and conn:
+            conn.rollback()
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+    return hashes
+
+
 def deleteExcelFile(o:Excel,transaction_conn=None,id=None,publisher_id=None ) -> int:
     rows_affected = 0
     params = []
 
     try:
         conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
         cur = conn.cursor()
         sql = "DELETE FROM excelfilehistory WHERE 1 = 1 "
         if o: 
@@ -635,7 +1375,7 @@ def deleteExcelFile(o:Excel,transaction_conn=None,id=None,publisher_id=None ) ->
             params.append(publisher_id)
 
         if params:
-            cur.execute(sql,params)
+            execute(cur,sql,params)
             rows_affected = cur.rowcount
 
             if not transaction_conn:
@@ -667,9 +1407,9 @@ def readSettings(transaction_conn=None) -> List[Setting]:
     """
 
     try:
-        conn = transaction_conn if transaction_conn else get_db()
+        conn = transaction_conn if transaction_conn else get_db(read_only=True,snapshot=True)
         cur = conn.cursor(dictionary=True)
-        cur.execute(sql)
+        execute(cur,sql)
         rows = cur.fetchall()
         for row in rows:
             o = Setting()
@@ -709,6 +1449,7 @@ def saveSetting(o:Setting,transaction_conn=None,) -> Setting:
 
     try:
         conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
         cur = conn.cursor()
 
         params.append(o.name)
@@ -716,7 +1457,7 @@ def saveSetting(o:Setting,transaction_conn=None,) -> Setting:
         params.append(o.value_en)
         params.append(o.value_de)
         if not is_insert: params.append(o.id)
-        cur.execute(sql,params)
+        execute(cur,sql,params)
         if is_insert: o.id = cur.lastrowid
 
         if not transaction_conn:
@@ -739,6 +1480,7 @@ def deleteSetting(o:Setting,transaction_conn=None,id=None ) -> int:
 
     try:
         conn = transaction_conn if transaction_conn else get_db()
+        markWrite()
         cur = conn.cursor()
         sql = "DELETE FROM setting WHERE 1 = 1 "
         params = []
@@ -750,7 +1492,7 @@ def deleteSetting(o:Setting,transaction_conn=None,id=None ) -> int:
             params.append(id)
 
         if params:
-            cur.execute(sql,params)
+            execute(cur,sql,params)
             rows_affected = cur.rowcount
 
             if not transaction_conn:
@@ -770,7 +1512,7 @@ def deleteSetting(o:Setting,transaction_conn=None,id=None ) -> int:
 
 
 class DB():
-    def __init__(self,host,db,user,passwd,port,poolsize=30,app=None,autocommit=True):
+    def __init__(self,host,db,user,passwd,port,poolsize=30,app=None,autocommit=True,pool_name="oajf",replica=None):
         self.host = host
         self.db = db
         self.user = user
@@ -779,16 +1521,22 @@ class DB():
         self.poolsize = poolsize
         self.autocommit = autocommit
         self.app = app 
+        self.pool_name = pool_name
         self.pool = None
-        self.lock = Lock()
+        self.lock = RLock()
+        self.signalhandler = None
+        # optional DB instance for a read replica, read_only connections are taken from there
+        self.replica: DB = replica
+        # optional sqlite snapshot for public reads
+        self.snapshot: Snapshot = None
 
 
     def connect(self):
         if self.poolsize > 0:
             with self.lock:
-                current_app.logger.info("database connect")
+                current_app.logger.info(f"database connect {self.pool_name}")
                 self.pool = mariadb.ConnectionPool(
-                    pool_name="oajf",
+                    pool_name=self.pool_name,
                     pool_size=int(self.poolsize),
                     pool_reset_connection=True,
                     host=self.host,
@@ -798,12 +1546,16 @@ class DB():
                     db=self.db,
                     autocommit=self.autocommit,
                 )
+        if self.replica:
+            self.replica.connect()
 
     def disconnect(self,signalnum=None,frame=None):
+        if self.replica:
+            self.replica.disconnect()
         if self.poolsize > 0:
             with self.lock:
                 with self.app.app_context():
-                    self.app.logger.info(f"database disconnect signalnum:{signalnum} frame:{frame}")
+                    self.app.logger.info(f"database disconnect {self.pool_name} signalnum:{signalnum} frame:{frame}")
                     if self.pool:
                         self.pool.close()
                         self.pool = None
@@ -811,9 +1563,26 @@ class DB():
                         self.signalhandler(signalnum,frame)
 
     # get connection
+    # if read_only and a replica is configured, get the connection from the replica
     # if pool active, get a connection from pool and check if it still works
     # otherwise just get a connection from database
-    def getConnection(self,retrycount=0) -> mariadb.Connection:
+    def getConnection(self,retrycount=0,read_only=False) -> mariadb.Connection:
+        conn = None
+        if read_only and self.replica:
+            return self.replica.getConnection()
+
+        start = time.perf_counter()
+        conn = self._getConnection(retrycount=retrycount)
+        wait = time.perf_counter() - start
+        setPoolWait(wait)
+        metrics.POOL_WAIT.labels(self.pool_name).observe(wait)
+        # the gauges are per process, every process updates its own values
+        free, used, has_pool = getPoolStats(self)
+        if has_pool:
+            metrics.setPoolConnections(self.pool_name, free, used)
+        return conn
+
+    def _getConnection(self,retrycount=0) -> mariadb.Connection:
         conn = None
         if self.poolsize > 0:
             with self.lock:
@@ -845,7 +1614,7 @@ class DB():
                     self.pool._replace_connection(conn)
 
                     retrycount +=1
-                    conn = self.getConnection(retrycount=retrycount)
+                    conn = self._getConnection(retrycount=retrycount)
                 
                 return conn   
         else:
@@ -859,5 +1628,3 @@ class DB():
             )
 
             return conn
-
-
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import datetime
+import traceback
+from typing import List, Optional, Tuple
+
+from flask import current_app, request
+
+from oajf.db import get_db
+from oajf.querylog import execute
+from oajf.sessionbuffer import WriteBehindBuffer
+
+# usage events: searches, searches started from the autocomplete dropdown and opened journal details
+# events are buffered per worker and inserted into the event table in batches,
+# "flask oajf rollupevents" aggregates them into event_hourly for reporting
+
+EVENT_SEARCH = 'search'
+EVENT_AUTOCOMPLETE = 'autocomplete'
+EVENT_CLICK = 'click'
+
+_buffer: EventBuffer = None
+
+def init(app):
+    global _buffer
+
+    if _buffer is None:
+        config = app.config.get('EVENTS', {})
+        if config.get('enabled', True):
+            _buffer = EventBuffer(app, interval=config.get('flush_interval', 2.0))
+
+    return _buffer
+
+
+SQL_INSERT = """
+    INSERT INTO event
+    (dt_datetime,kind,journal_id,keyword,results,ip_group,country_code)
+    VALUES (?,?,?,?,?,?,?)
+"""
+
+class EventBuffer(WriteBehindBuffer):
+    name = 'oajf-events'
+
+    def __init__(self, app, interval: float = 2.0, max_entries: int = 10000):
+        super().__init__(app, interval, max_entries)
+        self.rows: List[Tuple] = []
+
+    def add(self, row: Tuple):
+        self._ensureThread()
+        with self.lock:
+            self.rows.append(row)
+        self._added()
+
+    def _take(self) -> list:
+        rows = self.rows
+        self.rows = []
+        return rows
+
+    def _size(self) -> int:
+        return len(self.rows)
+
+    def _write(self, cur, rows: list):
+        execute(cur, SQL_INSERT, rows, many=True)
+
+
+def record(kind: str, journal_id: int = None, keyword: str = None, results: int = None):
+    """
+    buffers an event of the current request, ip group and country are taken from the in-memory indexes
+    """
+    if _buffer is None:
+        return
+
+    ip_group = None
+    country_code = None
+    ip = request.remote_addr
+    session_interface = current_app.session_interface
+    try:
+        if hasattr(session_interface, 'getGroupForIP'):
+            ip_group = session_interface.getGroupForIP(ip)
+            country_code = session_interface.getCountryCodeForIp(ip)
+    except Exception as e:
+        current_app.logger.error(f"exception={type(e).__name__}")
+
+    if keyword:
+        keyword = keyword.strip()[:250]
+
+    _buffer.add((datetime.datetime.now(), kind, journal_id, keyword or None, results, ip_group, country_code))
+
+
+def rollupEvents(keep_days: Optional[int] = None) -> Tuple[int, int]:
+    """
+    aggregates the events of all completed hours since the last rollup into event_hourly,
+    the last rolled up hour is recomputed to include events flushed late.
+    with keep_days raw events older than this are deleted afterwards.
+    returns the number of written aggregate rows and of deleted events
+    """
+    rows_written = 0
+    rows_deleted = 0
+    conn = None
+
+    try:
+        conn = get_db()
+        cur = conn.cursor()
+
+        now = datetime.datetime.now()
+        end = now.replace(minute=0, second=0, microsecond=0)
+        execute(cur, "SELECT MAX(hour) FROM event_hourly")
+        start = cur.fetchone()[0]
+        if start is None:
+            execute(cur, "SELECT MIN(dt_datetime) FROM event")
+            start = cur.fetchone()[0]
+        if start is not None:
+            start = start.replace(minute=0, second=0, microsecond=0)
+
+        if start is not None and start < end:
+            execute(cur, """
+                REPLACE INTO event_hourly
+                (hour,kind,journal_id,keyword,ip_group,country_code,cnt,results)
+                SELECT TIMESTAMP(DATE(dt_datetime),MAKETIME(HOUR(dt_datetime),0,0)),kind,COALESCE(journal_id,0),COALESCE(keyword,''),
+                COALESCE(ip_group,''),COALESCE(country_code,''),COUNT(*),SUM(COALESCE(results,0))
+                FROM event
+                WHERE dt_datetime >= ? AND dt_datetime < ?
+                GROUP BY 1,2,3,4,5,6
+            """, (start, end))
+            rows_written = cur.rowcount
+
+        if keep_days:
+            # only events already rolled up
+            cutoff = min(end, now - datetime.timedelta(days=keep_days))
+            execute(cur, "DELETE FROM event WHERE dt_datetime < ?", (cutoff,))
+            rows_deleted = cur.rowcount
+
+        conn.commit()
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if conn:
+            conn.close()
+
+    return rows_written, rows_deleted
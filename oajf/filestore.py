@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import os
+import gzip
+import time
+import hashlib
+import tempfile
+import traceback
+from typing import BinaryIO, Iterator, Tuple
+
+from flask import current_app
+
+filestore = None
+
+CHUNK_SIZE = 64 * 1024
+
+def init(app):
+    global filestore
+
+    if filestore is None:
+        with app.app_context():
+            config = current_app.config.get('FILESTORE', {})
+            path = config.get('path', None)
+            if not path:
+                path = os.path.join(app.root_path, 'filestore')
+            filestore = FileStore(
+                path = path,
+                compresslevel = config.get('compresslevel', 6),
+            )
+
+    return filestore
+
+
+def get_filestore() -> FileStore:
+    return filestore
+
+
+class FileStore():
+    """
+    content addressed store for uploaded files
+    files are identified by the sha256 of their uncompressed content and stored gzip compressed
+    as <path>/<2 chars>/<2 chars>/<sha256>.gz, identical uploads are stored only once
+    """
+
+    def __init__(self, path, compresslevel=6):
+        self.path = path
+        self.compresslevel = compresslevel
+        os.makedirs(self.path, exist_ok=True)
+
+    def getPath(self, digest: str) -> str:
+        return os.path.join(self.path, digest[0:2], digest[2:4], digest + '.gz')
+
+    def exists(self, digest: str) -> bool:
+        return os.path.isfile(self.getPath(digest))
+
+    def put(self, f: BinaryIO) -> Tuple[str, int]:
+        """
+        reads f in chunks, hashes and compresses it into a temporary file and moves it in place
+        returns the digest and the uncompressed size
+        if the content is already stored the temporary file is discarded
+        """
+        h = hashlib.sha256()
+        size = 0
+
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as raw:
+                # mtime=0 and no filename keep the compressed output reproducible
+                with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=self.compresslevel, mtime=0) as out:
+                    while chunk := f.read(CHUNK_SIZE):
+                        h.update(chunk)
+                        out.write(chunk)
+                        size += len(chunk)
+
+            digest = h.hexdigest()
+            target = self.getPath(digest)
+            if os.path.isfile(target):
+                # refresh mtime, so garbage collection doesn't remove a file just referenced again
+                os.utime(target)
+                os.remove(tmp)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp, target)
+        except Exception as e:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            current_app.logger.error(f"exception={type(e).__name__}")
+            current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+            raise e
+
+        return digest, size
+
+    def open(self, digest: str) -> BinaryIO:
+        """
+        returns a file object yielding the uncompressed content
+        """
+        return gzip.open(self.getPath(digest), 'rb')
+
+    def delete(self, digest: str) -> bool:
+        try:
+            os.remove(self.getPath(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def digests(self) -> Iterator[Tuple[str, float]]:
+        """
+        yields the digests of all stored files together with their modification time
+        """
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for name in filenames:
+                if name.endswith('.gz') and not name.startswith('.'):
+                    yield name[:-3], os.path.getmtime(os.path.join(dirpath, name))
+
+    def collectGarbage(self, referenced: set, min_age: int = 3600) -> int:
+        """
+        deletes stored files not contained in referenced
+        files younger than min_age seconds are kept, they might belong to an upload in progress
+        """
+        cnt = 0
+        now = time.time()
+        for digest, mtime in list(self.digests()):
+            if digest in referenced or now - mtime < min_age:
+                continue
+            if self.delete(digest):
+                cnt += 1
+
+        return cnt
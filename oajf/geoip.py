@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import os
+import mmap
+import time
+import bisect
+import struct
+import tempfile
+import ipaddress
+import threading
+import traceback
+from array import array
+from typing import Iterable, Optional, Tuple
+
+from flask import current_app
+
+from oajf.db import get_db
+from oajf.querylog import execute
+from oajf import metrics
+
+# the geoip ranges are held by each worker in sorted integer arrays and searched with bisect
+#
+# with GEOIP_FILE configured the workers memory-map the range file written by "flask oajf importgeoip",
+# all workers share the same pages and a new file is picked up by its inode/mtime.
+# otherwise the ranges are loaded from the geoip table, every GEOIP_CHECK_INTERVAL seconds
+# MAX(id) is compared to the loaded version. importgeoip continues the ids of the previous table,
+# so the next check of every worker reloads the ranges
+
+_index: GeoIPIndex = None
+_checked = 0.0
+_lock = threading.Lock()
+
+# range file: magic, number of ranges, padding, then start addresses, end addresses (native uint32)
+# and two ascii bytes of country code per range
+FILE_MAGIC = b'OAJFGEO1'
+FILE_HEADER = struct.Struct('=8sII')
+
+
+class GeoIPIndex():
+    """
+    non overlapping ipv4 ranges as parallel arrays sorted by start address,
+    country codes are stored once and referenced by position
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self.starts = array('I')
+        self.ends = array('I')
+        self.code_ids = array('H')
+        self.codes = []
+
+    def load(self, rows):
+        m_code = {}
+        for ip_from, ip_to, country_code in rows:
+            code_id = m_code.get(country_code, None)
+            if code_id is None:
+                code_id = m_code[country_code] = len(self.codes)
+                self.codes.append(country_code)
+            self.starts.append(ip_from)
+            self.ends.append(ip_to)
+            self.code_ids.append(code_id)
+
+    def getCode(self, i: int) -> str:
+        return self.codes[self.code_ids[i]]
+
+    def lookup(self, ip: str) -> Optional[str]:
+        try:
+            a = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        # the table only holds ipv4 ranges
+        if a.version != 4:
+            return None
+
+        n = int(a)
+        i = bisect.bisect_right(self.starts, n) - 1
+        if i >= 0 and n <= self.ends[i]:
+            return self.getCode(i)
+        return None
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class MappedGeoIPIndex(GeoIPIndex):
+    """
+    index on a memory-mapped range file, the arrays are views into the mapping
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self.version = (st.st_ino, st.st_mtime)
+
+        magic, n, _ = FILE_HEADER.unpack_from(self.mm, 0)
+        if magic != FILE_MAGIC or len(self.mm) != FILE_HEADER.size + 10 * n:
+            raise ValueError(f"{path} is not a geoip range file")
+
+        view = memoryview(self.mm)
+        offset = FILE_HEADER.size
+        self.starts = view[offset:offset + 4 * n].cast('I')
+        offset += 4 * n
+        self.ends = view[offset:offset + 4 * n].cast('I')
+        offset += 4 * n
+        self.code_bytes = view[offset:offset + 2 * n]
+
+    def getCode(self, i: int) -> str:
+        return bytes(self.code_bytes[2 * i:2 * i + 2]).decode('ascii')
+
+    def isCurrent(self) -> bool:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return (st.st_ino, st.st_mtime) == self.version
+
+
+def writeRangeFile(path: str, rows: Iterable[Tuple[int, int, str]]) -> int:
+    """
+    writes ranges sorted by start address into a new range file, which replaces path atomically
+    returns the number of ranges
+    """
+    starts = array('I')
+    ends = array('I')
+    codes = bytearray()
+    for ip_from, ip_to, country_code in rows:
+        starts.append(ip_from)
+        ends.append(ip_to)
+        codes += (country_code or '').encode('ascii')[:2].ljust(2)
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.geoip-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(FILE_HEADER.pack(FILE_MAGIC, len(starts), 0))
+            starts.tofile(f)
+            ends.tofile(f)
+            f.write(codes)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    return len(starts)
+
+
+def _readVersion(cur) -> Tuple[int, int]:
+    execute(cur, "SELECT MAX(id), COUNT(*) FROM geoip")
+    row = cur.fetchone()
+    return (row[0], row[1])
+
+def readRanges(cur):
+    """
+    yields the ranges of the geoip table as integers, sorted by start address
+    """
+    execute(cur, "SELECT INET_ATON(ip_from), INET_ATON(ip_to), country_code FROM geoip ORDER BY ip_from")
+    while rows := cur.fetchmany(10000):
+        yield from rows
+
+def _loadIndex() -> GeoIPIndex:
+    conn = None
+    try:
+        # geoip is never written by the application, no need for read-your-writes
+        conn = get_db(read_only=True, scope=None)
+        cur = conn.cursor()
+        version = _readVersion(cur)
+        index = GeoIPIndex(version)
+        index.load(readRanges(cur))
+        current_app.logger.info(f"geoip index loaded, {len(index)} ranges")
+        return index
+    except Exception as e:
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if conn:
+            conn.close()
+
+def _isCurrent(index: GeoIPIndex) -> bool:
+    if isinstance(index, MappedGeoIPIndex):
+        return index.isCurrent()
+
+    conn = None
+    try:
+        conn = get_db(read_only=True, scope=None)
+        cur = conn.cursor()
+        return _readVersion(cur) == index.version
+    finally:
+        if conn:
+            conn.close()
+
+def _newIndex() -> GeoIPIndex:
+    path = current_app.config.get('GEOIP_FILE', None)
+    if path and os.path.isfile(path):
+        index = MappedGeoIPIndex(path)
+        current_app.logger.info(f"geoip index mapped from {path}, {len(index)} ranges")
+        return index
+    return _loadIndex()
+
+
+def getIndex() -> GeoIPIndex:
+    """
+    returns the index of this process, loads it on first use and reloads it when the data changed
+    """
+    global _index, _checked
+
+    now = time.monotonic()
+    index = _index
+    if index is not None and now - _checked < current_app.config.get('GEOIP_CHECK_INTERVAL', 300):
+        return index
+
+    with _lock:
+        if _index is not None and _index is not index:
+            # reloaded by another thread meanwhile
+            return _index
+        if _index is None or not _isCurrent(_index):
+            _index = _newIndex()
+        _checked = now
+        return _index
+
+def getCountryCode(ip: str) -> Optional[str]:
+    country_code = getIndex().lookup(ip)
+    metrics.cacheHit('geoip', country_code is not None)
+    return country_code
+
+def invalidate():
+    global _index
+    with _lock:
+        _index = None
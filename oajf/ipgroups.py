@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import bisect
+import ipaddress
+from typing import Dict, List, Optional, Tuple
+
+# IP_GROUPS entries are tuples of either one address, one network in cidr notation or a range of two addresses:
+#
+#   IP_GROUPS = {
+#       'campus': [
+#           ('128.130.0.0/15',),
+#           ('192.168.1.10', '192.168.1.20'),
+#           ('2001:629:1000::/36',),
+#       ],
+#   }
+
+
+def parseRange(x) -> Optional[Tuple[int, int, int]]:
+    """
+    returns ip version, first and last address of a config entry as integers
+    """
+    if len(x) == 2:
+        a = ipaddress.ip_address(x[0])
+        b = ipaddress.ip_address(x[1])
+        if a.version != b.version:
+            raise ValueError(f"ip range {x} mixes ipv4 and ipv6")
+        return a.version, int(a), int(b)
+    elif len(x) == 1:
+        if '/' in x[0]:
+            n = ipaddress.ip_network(x[0], strict=False)
+            return n.version, int(n.network_address), int(n.broadcast_address)
+        a = ipaddress.ip_address(x[0])
+        return a.version, int(a), int(a)
+    return None
+
+
+class IPGroupIndex():
+    """
+    the configured ranges are cut into non overlapping segments, each segment holds
+    the names of all groups covering it, so classifying an address is one bisect
+    """
+
+    def __init__(self, m_group: Dict[str, list]):
+        self.starts: Dict[int, List[int]] = {4: [], 6: []}
+        self.groups: Dict[int, List[Optional[str]]] = {4: [], 6: []}
+
+        ranges = {4: [], 6: []}
+        for name, l in m_group.items():
+            for x in l:
+                r = parseRange(x)
+                if r:
+                    version, first, last = r
+                    ranges[version].append((first, last, name))
+
+        for version, l in ranges.items():
+            self._build(version, l, list(m_group.keys()))
+
+    def _build(self, version: int, l: List[Tuple[int, int, str]], order: List[str]):
+        boundaries = set()
+        for first, last, name in l:
+            boundaries.add(first)
+            boundaries.add(last + 1)
+
+        starts = self.starts[version]
+        groups = self.groups[version]
+        for b in sorted(boundaries):
+            names = {name for first, last, name in l if first <= b <= last}
+            # groups are listed in config order, like the linear scan did
+            value = '; '.join(name for name in order if name in names) if names else None
+            # adjacent segments with the same groups are merged
+            if groups and groups[-1] == value:
+                continue
+            starts.append(b)
+            groups.append(value)
+
+    def lookup(self, ip) -> Optional[str]:
+        try:
+            a = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if a.version == 6 and a.ipv4_mapped:
+            a = a.ipv4_mapped
+
+        starts = self.starts[a.version]
+        i = bisect.bisect_right(starts, int(a)) - 1
+        if i < 0:
+            return None
+        return self.groups[a.version][i]
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# issn handling for all import paths
+#
+# values are normalized to the form NNNN-NNNC with an upper case X as check digit. accepted input:
+# "1234-567X", "1234567x", "ISSN 1234 567X", "1234–567X" (any dash), numbers from excel cells
+# with lost leading zeros. the check digit is verified with the mod 11 rule of ISO 3297
+#
+# the batch functions work on whole columns: every distinct raw value is parsed and checked only once,
+# duplicates are found with one dict over the column
+
+INVALID_FORMAT = 'format'
+INVALID_CHECKSUM = 'checksum'
+DUPLICATE = 'duplicate'
+
+_re_issn = re.compile(r'(?<![0-9])([0-9]{4})[\s\-‐-―−]?([0-9]{3}[0-9X])(?![0-9X])', re.IGNORECASE)
+_WEIGHTS = (8, 7, 6, 5, 4, 3, 2)
+
+
+def checkDigit(digits: str) -> str:
+    """
+    returns the check digit for the first seven digits of an issn
+    """
+    s = sum(int(d) * w for d, w in zip(digits, _WEIGHTS))
+    c = (11 - s % 11) % 11
+    return 'X' if c == 10 else str(c)
+
+def _parse(value) -> Tuple[Optional[str], Optional[str]]:
+    """
+    returns the normalized issn and None, or None and the reason, (None, None) for empty values
+    """
+    if value is None:
+        return None, None
+    if isinstance(value, int) and not isinstance(value, bool):
+        # excel stores 01234567 as a number
+        value = str(value).zfill(8)
+    s = str(value).strip()
+    if not s or s == 'None':
+        return None, None
+
+    m = _re_issn.search(s)
+    if not m:
+        return None, INVALID_FORMAT
+    digits = m[1] + m[2].upper()
+    if checkDigit(digits) != digits[7]:
+        return None, INVALID_CHECKSUM
+    return digits[:4] + '-' + digits[4:], None
+
+def normalize(value) -> Optional[str]:
+    """
+    returns the normalized issn, None for empty and invalid values
+    """
+    return _parse(value)[0]
+
+def isValid(value) -> bool:
+    return _parse(value)[0] is not None
+
+
+def checkColumn(values: Sequence, seen: Dict[str, int] = None, offset: int = 0) -> Tuple[List[Optional[str]], List[Tuple[int, object, str]]]:
+    """
+    normalizes and checks a column of raw values
+    returns the normalized values (None for empty and invalid ones) and the errors as (index, raw value, reason)
+    with seen, a dict of issn -> index shared between calls, repeated issns are reported as DUPLICATE
+    and set to None, offset is added to the indexes of a column processed in chunks
+    """
+    parsed: Dict[object, Tuple[Optional[str], Optional[str]]] = {}
+    normalized: List[Optional[str]] = []
+    errors: List[Tuple[int, object, str]] = []
+
+    for i, value in enumerate(values, offset):
+        key = (type(value), value)
+        result = parsed.get(key, None)
+        if result is None:
+            result = parsed[key] = _parse(value)
+        issn, reason = result
+
+        if reason:
+            errors.append((i, value, reason))
+        elif issn is not None and seen is not None:
+            if issn in seen:
+                errors.append((i, value, DUPLICATE))
+                issn = None
+            else:
+                seen[issn] = i
+        normalized.append(issn)
+
+    return normalized, errors
+
+def normalizeColumn(values: Iterable) -> List[Optional[str]]:
+    """
+    normalizes a column, invalid values become None
+    """
+    normalized, errors = checkColumn(list(values))
+    return normalized
+
+def dedup(values: Iterable) -> List[str]:
+    """
+    returns the distinct valid issns of a column in order of their first occurrence
+    """
+    normalized, errors = checkColumn(list(values), seen={})
+    return [issn for issn in normalized if issn is not None]
@@ -0,0 +1,463 @@
+from __future__ import annotations
+
+import io
+import os
+import json
+import time
+import socket
+import shutil
+import datetime
+import tempfile
+import threading
+import traceback
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+from flask import current_app
+from flask_babel import force_locale
+
+from oajf import MESSAGE_TYPE_ERROR, MESSAGE_TYPE_INFO
+from oajf.db import get_db, updatePoolMetrics
+from oajf.querylog import execute
+from oajf.filestore import get_filestore
+from oajf import metrics
+
+# background jobs for long admin operations
+#
+# uploads, doaj syncs and exports are queued in the job table by the web request and run by
+# "flask oajf jobworker", so web workers and their pool connections stay available for public traffic.
+# workers claim queued jobs with a conditional update, several worker processes can share one queue.
+# handlers report progress and messages through the Job object, results (files, json) are put into
+# the filestore and kept until "flask oajf purgejobs" deletes the job
+#
+# with JOBS['inline'] jobs run in the request that queues them, for installations without a worker
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# progress is written at most this often, messages and results when the job finishes
+PROGRESS_INTERVAL = 1.0
+
+JOB_COLUMNS = "id,kind,status,params,lang,created_by,progress,total,messages,result_hash,result_name,result_mimetype,worker,created,started,updated,finished"
+
+_handlers: Dict[str, Callable[[Job], None]] = {}
+# kinds whose input file is still needed for some hours after the job finished
+_keep_input_hours: Dict[str, int] = {}
+
+
+class JobFailed(Exception):
+    """
+    raised by handlers after adding their own error messages to the job
+    """
+
+
+def handler(kind: str, keep_input_hours: int = 0):
+    """
+    registers the decorated function as handler for jobs of kind
+    with keep_input_hours the input file (params['file_hash']) stays referenced that long after the job finished
+    """
+    def decorator(f):
+        _handlers[kind] = f
+        if keep_input_hours:
+            _keep_input_hours[kind] = keep_input_hours
+        return f
+    return decorator
+
+
+class Job():
+    id: int
+    kind: str
+    status: str
+    params: dict
+    lang: str
+    created_by: str
+    progress: int
+    total: int
+    messages: List[List[str]]
+    result_hash: str
+    result_name: str
+    result_mimetype: str
+    worker: str
+    created: datetime.datetime
+    started: datetime.datetime
+    updated: datetime.datetime
+    finished: datetime.datetime
+
+    def __init__(self):
+        self.id = None
+        self.kind = None
+        self.status = JOB_QUEUED
+        self.params = {}
+        self.lang = None
+        self.created_by = None
+        self.progress = 0
+        self.total = None
+        self.messages = []
+        self.result_hash = None
+        self.result_name = None
+        self.result_mimetype = None
+        self.worker = None
+        self.created = None
+        self.started = None
+        self.updated = None
+        self.finished = None
+        self._progress_written = 0.0
+
+    @classmethod
+    def fromRow(cls, row) -> Job:
+        o = cls()
+        (o.id, o.kind, o.status, params, o.lang, o.created_by, o.progress, o.total, messages,
+         o.result_hash, o.result_name, o.result_mimetype, o.worker,
+         o.created, o.started, o.updated, o.finished) = row
+        o.params = json.loads(params) if params else {}
+        o.messages = json.loads(messages) if messages else []
+        return o
+
+    def toDict(self):
+        d = {}
+        d['id'] = self.id
+        d['kind'] = self.kind
+        d['status'] = self.status
+        d['progress'] = self.progress
+        d['total'] = self.total
+        d['messages'] = self.messages
+        d['result_name'] = self.result_name
+        d['has_result'] = self.result_hash is not None
+        d['created_by'] = self.created_by
+        d['created'] = self.created.isoformat() if self.created else None
+        d['started'] = self.started.isoformat() if self.started else None
+        d['finished'] = self.finished.isoformat() if self.finished else None
+        return d
+
+    def isFinished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    # used by the handlers
+
+    def setProgress(self, progress: int, total: int = None):
+        self.progress = progress
+        if total is not None:
+            self.total = total
+        now = time.monotonic()
+        if now - self._progress_written >= PROGRESS_INTERVAL:
+            self._progress_written = now
+            _writeProgress(self)
+
+    def addMessage(self, msg, type: str = MESSAGE_TYPE_INFO):
+        # lazy strings are translated here, in the language of the user who queued the job
+        self.messages.append([type, str(msg)])
+
+    def setResult(self, f: BinaryIO, name: str, mimetype: str):
+        self.result_hash, size = get_filestore().put(f)
+        self.result_name = name
+        self.result_mimetype = mimetype
+
+    def setResultJson(self, data, name: str = 'result.json'):
+        self.setResult(io.BytesIO(json.dumps(data, default=str).encode('utf-8')), name, 'application/json')
+
+    def openResult(self) -> Optional[BinaryIO]:
+        if not self.result_hash:
+            return None
+        return get_filestore().open(self.result_hash)
+
+    def readResultJson(self):
+        f = self.openResult()
+        if f is None:
+            return None
+        with f:
+            return json.loads(f.read().decode('utf-8'))
+
+    def spoolParamFile(self, key: str = 'file_hash') -> BinaryIO:
+        """
+        copies the stored file referenced by params[key] into a seekable temporary file
+        """
+        tmp = tempfile.TemporaryFile()
+        with get_filestore().open(self.params[key]) as f:
+            shutil.copyfileobj(f, tmp)
+        tmp.seek(0)
+        return tmp
+
+
+def getWorkerName() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def enqueue(kind: str, params: dict = None, created_by: str = None, lang: str = None) -> int:
+    """
+    queues a job and returns its id, with JOBS['inline'] the job is run before returning
+    """
+    if kind not in _handlers:
+        raise ValueError(f"no handler for job kind {kind}")
+
+    conn = None
+    try:
+        conn = get_db()
+        cur = conn.cursor()
+        sql = """
+            INSERT INTO job (kind,status,params,lang,created_by)
+            VALUES (?,?,?,?,?)
+        """
+        execute(cur, sql, (kind, JOB_QUEUED, json.dumps(params or {}, default=str), lang, created_by))
+        id = cur.lastrowid
+        conn.commit()
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if conn:
+            conn.close()
+
+    if current_app.config.get('JOBS', {}).get('inline', False):
+        job = _claimJob(id=id)
+        if job:
+            runJob(job)
+
+    return id
+
+def readJobs(id: int = None, limit: int = 100) -> List[Job]:
+    l_job: List[Job] = []
+    conn = None
+    try:
+        conn = get_db()
+        cur = conn.cursor()
+        if id:
+            execute(cur, f"SELECT {JOB_COLUMNS} FROM job WHERE id=?", (int(id),))
+        else:
+            execute(cur, f"SELECT {JOB_COLUMNS} FROM job ORDER BY id DESC LIMIT ?", (int(limit),))
+        for row in cur.fetchall():
+            l_job.append(Job.fromRow(row))
+    except Exception as e:
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if conn:
+            conn.close()
+
+    return l_job
+
+def readJob(id: int) -> Optional[Job]:
+    l_job = readJobs(id=id)
+    return l_job[0] if l_job else None
+
+def readJobFileHashes() -> set:
+    """
+    returns the filestore digests referenced by jobs: results, the input files of unfinished jobs
+    and those of finished jobs registered with keep_input_hours
+    """
+    hashes = set()
+    conn = None
+    try:
+        conn = get_db()
+        cur = conn.cursor()
+        execute(cur, "SELECT result_hash FROM job WHERE result_hash IS NOT NULL")
+        hashes.update(row[0] for row in cur.fetchall())
+        execute(cur, "SELECT params FROM job WHERE status IN (?,?)", (JOB_QUEUED, JOB_RUNNING))
+        rows = cur.fetchall()
+        for kind, hours in _keep_input_hours.items():
+            execute(cur, "SELECT params FROM job WHERE kind=? AND finished > NOW() - INTERVAL ? HOUR", (kind, int(hours)))
+            rows += cur.fetchall()
+        for row in rows:
+            file_hash = json.loads(row[0] or '{}').get('file_hash', None)
+            if file_hash:
+                hashes.add(file_hash)
+    finally:
+        if conn:
+            conn.close()
+
+    return hashes
+
+def purgeJobs(keep_days: int) -> int:
+    """
+    deletes jobs finished more than keep_days ago, their results are removed by filestoreGC
+    """
+    conn = None
+    try:
+        conn = get_db()
+        cur = conn.cursor()
+        execute(cur, "DELETE FROM job WHERE finished < NOW() - INTERVAL ? DAY", (int(keep_days),))
+        cnt = cur.rowcount
+        conn.commit()
+        return cnt
+    finally:
+        if conn:
+            conn.close()
+
+
+def _claimJob(id: int = None, worker: str = None) -> Optional[Job]:
+    """
+    marks the oldest queued job (or the job id) as running for this worker and returns it,
+    None if there is nothing to do or another worker was faster
+    """
+    conn = None
+    try:
+        conn = get_db()
+        cur = conn.cursor()
+        if id is None:
+            execute(cur, "SELECT id FROM job WHERE status=? ORDER BY id LIMIT 1", (JOB_QUEUED,))
+            row = cur.fetchone()
+            if not row:
+                return None
+            id = row[0]
+
+        sql = """
+            UPDATE job SET status=?,worker=?,started=NOW(),updated=NOW()
+            WHERE id=? AND status=?
+        """
+        execute(cur, sql, (JOB_RUNNING, worker or getWorkerName(), id, JOB_QUEUED))
+        claimed = cur.rowcount == 1
+        conn.commit()
+        if not claimed:
+            return None
+
+        execute(cur, f"SELECT {JOB_COLUMNS} FROM job WHERE id=?", (id,))
+        return Job.fromRow(cur.fetchone())
+    finally:
+        if conn:
+            conn.close()
+
+def _writeProgress(job: Job):
+    conn = None
+    try:
+        conn = get_db()
+        cur = conn.cursor()
+        execute(cur, "UPDATE job SET progress=?,total=?,updated=NOW() WHERE id=?", (job.progress, job.total, job.id))
+        conn.commit()
+    except Exception as e:
+        # progress is informational only
+        current_app.logger.error(f"job {job.id}: progress update failed, exception={type(e).__name__}")
+    finally:
+        if conn:
+            conn.close()
+
+def _finishJob(job: Job):
+    conn = None
+    try:
+        conn = get_db()
+        cur = conn.cursor()
+        sql = """
+            UPDATE job SET status=?,progress=?,total=?,messages=?,result_hash=?,result_name=?,result_mimetype=?,
+            updated=NOW(),finished=NOW()
+            WHERE id=?
+        """
+        execute(cur, sql, (job.status, job.progress, job.total, json.dumps(job.messages),
+                           job.result_hash, job.result_name, job.result_mimetype, job.id))
+        conn.commit()
+    finally:
+        if conn:
+            conn.close()
+
+def runJob(job: Job):
+    """
+    runs the handler of a claimed job, in the language of the user who queued it
+    """
+    start = time.perf_counter()
+    try:
+        with force_locale(job.lang or 'de'):
+            try:
+                _handlers[job.kind](job)
+                job.status = JOB_DONE
+            except JobFailed:
+                job.status = JOB_FAILED
+            except Exception as e:
+                current_app.logger.error(f"job {job.id} ({job.kind}) failed, exception={type(e).__name__}")
+                current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+                job.status = JOB_FAILED
+                job.addMessage(f"{type(e).__name__}: {e}", MESSAGE_TYPE_ERROR)
+    finally:
+        if not job.isFinished():
+            job.status = JOB_FAILED
+        _finishJob(job)
+        updatePoolMetrics()
+        metrics.JOBS.labels(job.kind, job.status).inc()
+        metrics.JOB_DURATION.labels(job.kind).observe(time.perf_counter() - start)
+
+def _isProcessAlive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists but belongs to another user
+        return True
+    return True
+
+def failAbandonedJobs() -> int:
+    """
+    marks the running jobs of worker processes on this host that no longer exist as failed,
+    jobs of other live workers and of inline runs in web server processes are left alone
+    """
+    conn = None
+    try:
+        conn = get_db()
+        cur = conn.cursor()
+        host = socket.gethostname()
+        execute(cur, "SELECT id,worker FROM job WHERE status=? AND worker LIKE ?", (JOB_RUNNING, host + ':%'))
+        ids = []
+        for id, worker in cur.fetchall():
+            pid = worker.rsplit(':', 1)[1]
+            if pid.isdigit() and not _isProcessAlive(int(pid)):
+                ids.append(id)
+
+        messages = json.dumps([[MESSAGE_TYPE_ERROR, "worker terminated"]])
+        cnt = 0
+        for id in ids:
+            # status=? again, the job may have finished in the meantime
+            execute(cur, "UPDATE job SET status=?,messages=?,finished=NOW() WHERE id=? AND status=?",
+                    (JOB_FAILED, messages, id, JOB_RUNNING))
+            cnt += cur.rowcount
+        conn.commit()
+        return cnt
+    finally:
+        if conn:
+            conn.close()
+
+
+class JobWorker():
+    """
+    polls the job table from threads threads and runs the claimed jobs, each in its own app context
+    stop() lets running jobs finish
+    """
+
+    def __init__(self, app, threads: int = 2, poll_interval: float = 2.0):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.worker = getWorkerName()
+
+    def run(self):
+        with self.app.app_context():
+            cnt = failAbandonedJobs()
+            if cnt:
+                self.app.logger.warning(f"{cnt} abandoned jobs marked as failed")
+
+        l_thread = []
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._run, name=f'oajf-job-{i}')
+            thread.start()
+            l_thread.append(thread)
+        for thread in l_thread:
+            thread.join()
+
+    def stop(self, signalnum=None, frame=None):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            job = None
+            try:
+                with self.app.app_context():
+                    job = _claimJob(worker=self.worker)
+                    if job:
+                        self.app.logger.info(f"job {job.id} ({job.kind}) started")
+                        runJob(job)
+                        self.app.logger.info(f"job {job.id} ({job.kind}) {job.status}")
+            except Exception as e:
+                self.app.logger.error(f"job worker, exception={type(e).__name__}")
+                self.app.logger.error(f"stacktrace={traceback.format_exc()}")
+            if job is None:
+                self.stopped.wait(self.poll_interval)
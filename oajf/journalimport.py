@@ -0,0 +1,428 @@
+from __future__ import annotations
+
+import uuid
+import datetime
+import traceback
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from flask import current_app
+from flask_babel import lazy_gettext as _
+
+from oajf.db import get_db, normalizeTitle
+from oajf.db import (
+    readJournals as db_readJournals,
+    deleteJournal as db_deleteJournal,
+    saveExcelFile as db_saveExcelFile,
+    saveJournalStaging as db_saveJournalStaging,
+    applyJournalStaging as db_applyJournalStaging,
+    readJournalStaging as db_readJournalStaging,
+    countJournalStaging as db_countJournalStaging,
+    readJournalStagingConflicts as db_readJournalStagingConflicts,
+    matchJournalStaging as db_matchJournalStaging,
+    syncJournalStaging as db_syncJournalStaging,
+    deleteJournalStaging as db_deleteJournalStaging,
+)
+from oajf.querylog import execute
+from oajf.models import Excel, Journal, Publisher
+from oajf import issn
+from oajf.tabular import readRows
+
+# streaming import of publisher title lists
+#
+# the file (.xlsx or .csv/.tsv, see oajf/tabular.py) is read lazily, rows are validated and inserted into journal_staging
+# in chunks, each chunk in its own short transaction. only when the whole file was parsed without errors
+# the staged rows are moved into journal in one transaction together with the deletion of the old journals
+# and the excel history entry, so the import stays all-or-nothing. staged rows are always deleted afterwards,
+# leftovers of killed imports are removed by the next import
+#
+# modes: MODE_APPEND adds the rows to the publisher's journals, MODE_REPLACE deletes the publisher's journals first,
+# MODE_SYNC matches the rows with the existing journals (e-issn, print-issn, title) and only writes the differences,
+# the ids of unchanged journals are kept
+#
+# a dry run stops after staging and returns a preview of the changes, the staged rows are kept under the upload_id
+# until confirm applies them or they expire after STAGING_MAX_AGE_HOURS
+
+CHUNK_SIZE = 1000
+MAX_ERRORS = 5
+MAX_WARNINGS = 20
+STAGING_MAX_AGE_HOURS = 24
+
+MODE_APPEND = 'append'
+MODE_REPLACE = 'replace'
+MODE_SYNC = 'sync'
+MODES = (MODE_SYNC, MODE_REPLACE, MODE_APPEND)
+
+PREVIEW_LIMIT = 1000
+
+HEADER = [
+    (('titel','title'), _("'Titel' oder 'Title' in Zelle A1 erwartet.")),
+    (('link',), _("'Link' in Zelle B1 erwartet.")),
+    (('e-issn',), _("'E-ISSN' in Zelle C1 erwartet.")),
+    (('print-issn',), _("'Print-ISSN' in Zelle D1 erwartet.")),
+]
+
+MESSAGES_E_ISSN = {
+    issn.INVALID_FORMAT: _("Ungültige E-ISSN {0} (Zeile {1})"),
+    issn.INVALID_CHECKSUM: _("Falsche Prüfziffer in E-ISSN {0} (Zeile {1})"),
+    issn.DUPLICATE: _("E-ISSN {0} bereits in Zeile {2}, Zeile {1} wird übersprungen"),
+}
+MESSAGES_PRINT_ISSN = {
+    issn.INVALID_FORMAT: _("Ungültige Print-ISSN {0} (Zeile {1})"),
+    issn.INVALID_CHECKSUM: _("Falsche Prüfziffer in Print-ISSN {0} (Zeile {1})"),
+    issn.DUPLICATE: _("Print-ISSN {0} bereits in Zeile {2}, Zeile {1} wird übersprungen"),
+}
+
+
+class ImportRejected(Exception):
+    """
+    the file is rejected, errors holds the messages for the user
+    """
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(str(e) for e in errors))
+        self.errors = errors
+
+
+class JournalImport():
+
+    def __init__(self, publisher: Publisher, valid_till: datetime.date,
+                 chunk_size: int = CHUNK_SIZE, max_errors: int = MAX_ERRORS,
+                 progress: Callable[[int], None] = None, upload_id: str = None):
+        self.publisher = publisher
+        self.valid_till = valid_till
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.progress = progress
+        # a given upload_id continues with the rows staged by a dry run
+        self.upload_id = upload_id or uuid.uuid4().hex
+        self.errors: List[str] = []
+        # rows repeating an issn of an earlier row are skipped, the first occurrence is imported
+        self.warnings: List[str] = []
+        self.cnt_duplicates = 0
+        self.cnt_staged = 0
+        self.seen_e_issn: Dict[str, int] = {}
+        self.seen_print_issn: Dict[str, int] = {}
+
+    def checkHeader(self, header: Optional[Tuple]) -> Optional[str]:
+        header = header or ()
+        for i, (names, msg) in enumerate(HEADER):
+            value = header[i] if i < len(header) else None
+            if value is None or str(value).strip().lower() not in names:
+                return msg
+        return None
+
+    def parseRows(self, rows: Iterator[Tuple]) -> Iterator[Tuple[int, str, Optional[str], object, object]]:
+        """
+        yields (row_idx,title,link,print_issn,e_issn) of the rows after the header up to the first empty title,
+        the issns as read, parsing stops after max_errors
+        """
+        row_idx = 1
+        try:
+            for row in rows:
+                if len(self.errors) >= self.max_errors:
+                    break
+                if not row or row[0] is None or str(row[0]).strip() == '':
+                    break
+
+                row_idx += 1
+                row = tuple(row[:4]) + (None,) * (4 - len(row))
+                title = str(row[0]).strip()
+                link = str(row[1]).strip() if row[1] is not None else None
+                if link == 'None' or link == '':
+                    link = None
+
+                yield (row_idx, title, link, row[3], row[2])
+        except Exception as e:
+            # errors of the consumer aren't raised in here, only those of reading the file
+            current_app.logger.error(f"exception={type(e).__name__}")
+            current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+            raise ImportRejected([_("Import fehlgeschlagen. Fehler beim Parsen der Input-Datei.")])
+
+    def _checkIssns(self, chunk: List[Tuple], col: int, messages: Dict[str, str]) -> List[Optional[str]]:
+        normalized, errors = issn.checkColumn([row[col] for row in chunk])
+        for i, value, reason in errors:
+            if len(self.errors) < self.max_errors:
+                self.errors.append(messages[reason].format(value, chunk[i][0]))
+        return normalized
+
+    def checkChunk(self, chunk: List[Tuple]) -> List[Tuple]:
+        """
+        normalizes and checks the issn columns of a chunk of parsed rows,
+        rows with an issn of an earlier row of the file are dropped with a warning
+        """
+        print_issns = self._checkIssns(chunk, 3, MESSAGES_PRINT_ISSN)
+        e_issns = self._checkIssns(chunk, 4, MESSAGES_E_ISSN)
+
+        rows = []
+        for row, print_issn, e_issn in zip(chunk, print_issns, e_issns):
+            row_idx = row[0]
+            msg = None
+            if e_issn and e_issn in self.seen_e_issn:
+                msg = MESSAGES_E_ISSN[issn.DUPLICATE].format(e_issn, row_idx, self.seen_e_issn[e_issn])
+            elif print_issn and print_issn in self.seen_print_issn:
+                msg = MESSAGES_PRINT_ISSN[issn.DUPLICATE].format(print_issn, row_idx, self.seen_print_issn[print_issn])
+            if msg:
+                self.cnt_duplicates += 1
+                if len(self.warnings) < MAX_WARNINGS:
+                    self.warnings.append(msg)
+                continue
+
+            if e_issn:
+                self.seen_e_issn[e_issn] = row_idx
+            if print_issn:
+                self.seen_print_issn[print_issn] = row_idx
+            rows.append((row_idx, row[1], row[2], print_issn, e_issn))
+        return rows
+
+    def getWarnings(self) -> List[str]:
+        """
+        returns the warnings for the user, with a summary if there were more than MAX_WARNINGS
+        """
+        warnings = list(self.warnings)
+        if self.cnt_duplicates > len(self.warnings):
+            warnings.append(_("Insgesamt {0} Zeilen mit mehrfachen ISSN übersprungen.").format(self.cnt_duplicates))
+        return warnings
+
+    def stage(self, rows) -> int:
+        """
+        inserts the rows into journal_staging, one transaction per chunk
+        """
+        conn = None
+        try:
+            conn = get_db()
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= self.chunk_size:
+                    self._stageChunk(conn, chunk)
+                    chunk = []
+            self._stageChunk(conn, chunk)
+        finally:
+            if conn:
+                conn.close()
+        return self.cnt_staged
+
+    def _stageChunk(self, conn, chunk: List[Tuple]):
+        if not chunk:
+            return
+        chunk = self.checkChunk(chunk)
+        # rows after the first error are only validated
+        if self.errors:
+            return
+        db_saveJournalStaging(self.upload_id, chunk, transaction_conn=conn)
+        conn.commit()
+        self.cnt_staged += len(chunk)
+        if self.progress:
+            self.progress(self.cnt_staged)
+
+    def _match(self, conn) -> Tuple[List[Tuple[Tuple, Optional[Journal], Dict]], List[Journal], List[Tuple[Tuple, Journal, Journal]]]:
+        """
+        matches the staged rows with the publisher's journals, by e-issn, then print-issn, then normalized title,
+        every journal is matched at most once. returns the staged rows as (row,journal or None,differences),
+        the publisher's journals and the rows whose e-issn and print-issn belong to two different journals
+        """
+        m_e_issn: Dict[str, Journal] = {}
+        m_print_issn: Dict[str, Journal] = {}
+        m_title: Dict[str, Journal] = {}
+        existing = db_readJournals(transaction_conn=conn, publisher=self.publisher, only_active=False, publisher_shallow=True)
+        for j in existing:
+            if j.e_issn:
+                m_e_issn.setdefault(j.e_issn, j)
+            if j.print_issn:
+                m_print_issn.setdefault(j.print_issn, j)
+            m_title.setdefault(normalizeTitle(j.title), j)
+
+        result = []
+        ambiguous = []
+        matched = set()
+        for row in db_readJournalStaging(self.upload_id, transaction_conn=conn):
+            row_idx, title, link, print_issn, e_issn = row
+            j_new = Journal()
+            j_new.title = title
+            j_new.url = link
+            j_new.print_issn = print_issn
+            j_new.e_issn = e_issn
+
+            j_e = m_e_issn.get(e_issn, None) if e_issn else None
+            j_print = m_print_issn.get(print_issn, None) if print_issn else None
+            if j_e and j_print and j_e.id != j_print.id:
+                ambiguous.append((row, j_e, j_print))
+
+            j_match = None
+            for j in (j_e, j_print, m_title.get(normalizeTitle(title), None)):
+                if j and j.id not in matched:
+                    matched.add(j.id)
+                    j_match = j
+                    break
+            result.append((row, j_match, j_new.getDifferences(j_match) if j_match else {}))
+
+        return result, existing, ambiguous
+
+    def match(self, conn) -> List[Tuple[int, int, bool]]:
+        """
+        returns the matches of the staged rows with the publisher's journals as (row_idx,journal_id,changed)
+        """
+        result, existing, ambiguous = self._match(conn)
+        return [(row[0], j.id, bool(diffs)) for row, j, diffs in result if j]
+
+    def preview(self, mode: str = MODE_APPEND) -> Dict:
+        """
+        computes the changes an apply of the staged rows would make, the lists are cut after PREVIEW_LIMIT entries
+        """
+        conn = None
+        try:
+            conn = get_db()
+            result, existing, ambiguous = self._match(conn)
+            conflicts = db_readJournalStagingConflicts(self.upload_id, self.publisher.id, transaction_conn=conn)
+        finally:
+            if conn:
+                conn.close()
+
+        def _row(row):
+            return {'row': row[0], 'title': row[1], 'url': row[2], 'print_issn': row[3], 'e_issn': row[4]}
+
+        def _journal(j):
+            return {'id': j.id, 'title': j.title, 'url': j.url, 'print_issn': j.print_issn, 'e_issn': j.e_issn,
+                    'valid_till': str(j.valid_till) if j.valid_till else None}
+
+        l_new, l_changed, l_removed = [], [], []
+        cnt_unchanged = 0
+        if mode == MODE_SYNC:
+            matched = set()
+            for row, j, diffs in result:
+                if j is None:
+                    l_new.append(_row(row))
+                    continue
+                matched.add(j.id)
+                if diffs:
+                    d = _row(row)
+                    d['id'] = j.id
+                    d['diffs'] = diffs
+                    l_changed.append(d)
+                else:
+                    cnt_unchanged += 1
+            l_removed = [_journal(j) for j in existing if j.id not in matched]
+        else:
+            l_new = [_row(row) for row, j, diffs in result]
+            if mode == MODE_REPLACE:
+                l_removed = [_journal(j) for j in existing]
+
+        l_conflict = []
+        for row, j_e, j_print in ambiguous:
+            d = _row(row)
+            d['reason'] = str(_("E-ISSN und Print-ISSN gehören zu verschiedenen Zeitschriften des Verlags ({0}, {1})").format(j_e.id, j_print.id))
+            l_conflict.append(d)
+        m_row = {row[0]: row for row, j, diffs in result}
+        for row_idx, value, journal_id, title, publisher_name in conflicts:
+            d = _row(m_row[row_idx])
+            d['reason'] = str(_("ISSN {0} gehört zur Zeitschrift {1} ({2}) des Verlags {3}").format(value, title, journal_id, publisher_name))
+            l_conflict.append(d)
+        l_conflict.sort(key=lambda d: d['row'])
+
+        return {
+            'upload_id': self.upload_id,
+            'mode': mode,
+            'valid': self.valid_till.isoformat(),
+            'publisher': {'id': self.publisher.id, 'name': self.publisher.name},
+            'cnt_new': len(l_new),
+            'cnt_changed': len(l_changed),
+            'cnt_unchanged': cnt_unchanged,
+            'cnt_removed': len(l_removed),
+            'cnt_conflict': len(l_conflict),
+            'cnt_duplicates': self.cnt_duplicates,
+            'warnings': [str(msg) for msg in self.getWarnings()],
+            'l_new': l_new[:PREVIEW_LIMIT],
+            'l_changed': l_changed[:PREVIEW_LIMIT],
+            'l_removed': l_removed[:PREVIEW_LIMIT],
+            'l_conflict': l_conflict[:PREVIEW_LIMIT],
+        }
+
+    def apply(self, excel: Excel, mode: str = MODE_APPEND, staged: bool = False) -> Dict[str, int]:
+        """
+        moves the staged journals into journal in one transaction
+        returns the number of deleted, inserted, updated and valid_till changed journals,
+        in MODE_SYNC also of the unchanged ones
+        with staged the rows of a dry run are applied, raises ImportRejected if they are gone
+        """
+        conn = None
+        try:
+            conn = get_db()
+            cur = conn.cursor()
+            # DATABASE['autocommit'] is configurable, the explicit transaction keeps the deletion, the excel entry
+            # and the insert all-or-nothing with either setting
+            execute(cur, "START TRANSACTION")
+            # the lock makes a second confirmation wait for the first one and find no rows
+            if staged and db_countJournalStaging(self.upload_id, transaction_conn=conn, lock=True) == 0:
+                raise ImportRejected([_("Die Vorschau ist abgelaufen oder wurde bereits übernommen.")])
+            counts = {'deleted': 0, 'inserted': 0, 'updated': 0, 'valid_till': 0}
+            if mode == MODE_SYNC:
+                matches = self.match(conn)
+                db_matchJournalStaging(self.upload_id, matches, transaction_conn=conn)
+                counts = db_syncJournalStaging(self.upload_id, self.publisher.id, self.valid_till, transaction_conn=conn)
+                counts['unchanged'] = len(matches) - counts['updated']
+            else:
+                if mode == MODE_REPLACE:
+                    counts['deleted'] = db_deleteJournal(None, transaction_conn=conn, publisher_id=self.publisher.id)
+                counts['inserted'] = db_applyJournalStaging(self.upload_id, self.publisher.id, self.valid_till, transaction_conn=conn)
+            db_saveExcelFile(excel, transaction_conn=conn)
+            db_deleteJournalStaging(self.upload_id, transaction_conn=conn)
+            conn.commit()
+            return counts
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            raise e
+        finally:
+            if conn:
+                conn.close()
+
+    def discard(self):
+        try:
+            db_deleteJournalStaging(self.upload_id)
+        except Exception as e:
+            current_app.logger.error(f"discarding staged upload {self.upload_id} failed, exception={type(e).__name__}")
+
+    def confirm(self, excel: Excel, mode: str = MODE_APPEND) -> Dict[str, int]:
+        """
+        applies the rows staged by a dry run without reading the file again, returns the counts of apply
+        """
+        try:
+            return self.apply(excel, mode, staged=True)
+        finally:
+            self.discard()
+
+    def run(self, f: BinaryIO, excel: Excel, mode: str = MODE_APPEND, dry_run: bool = False) -> Dict:
+        """
+        parses, stages and applies the file f named excel.name, returns the counts of apply
+        with dry_run nothing is applied, the staged rows are kept for confirm and the preview is returned
+        raises ImportRejected if the file is rejected, database errors are passed on
+        """
+        rows = readRows(f, excel.name)
+        try:
+            msg = self.checkHeader(next(rows, None))
+        except Exception as e:
+            rows.close()
+            current_app.logger.error(f"exception={type(e).__name__}")
+            current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+            raise ImportRejected([_("Import fehlgeschlagen. Fehler beim Parsen der Input-Datei.")])
+        if msg:
+            rows.close()
+            raise ImportRejected([msg])
+
+        keep = False
+        try:
+            db_deleteJournalStaging(older_than_hours=STAGING_MAX_AGE_HOURS)
+            try:
+                self.stage(self.parseRows(rows))
+            finally:
+                rows.close()
+            if self.errors:
+                raise ImportRejected(self.errors)
+            if dry_run:
+                preview = self.preview(mode)
+                keep = True
+                return preview
+            return self.apply(excel, mode)
+        finally:
+            if not keep:
+                self.discard()
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import os
+
+# prometheus_client is optional, without it all metrics are no-ops
+# for gunicorn set PROMETHEUS_MULTIPROC_DIR to an empty directory before starting the server
+# and call markProcessDead from the child_exit hook in the gunicorn config:
+#
+#   def child_exit(server, worker):
+#       from oajf.metrics import markProcessDead
+#       markProcessDead(worker.pid)
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+    CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+def _counter(name, documentation, labelnames=()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return Counter(name, documentation, labelnames)
+
+def _histogram(name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS if prometheus_client else None):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return Histogram(name, documentation, labelnames, buckets=buckets)
+
+def _gauge(name, documentation, labelnames=()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    # livesum: sum over the currently running worker processes
+    return Gauge(name, documentation, labelnames, multiprocess_mode='livesum')
+
+
+FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0)
+
+POOL_CONNECTIONS = _gauge('oajf_db_pool_connections', 'Connections in the database pool', ['pool', 'state'])
+POOL_WAIT = _histogram('oajf_db_pool_wait_seconds', 'Time spent waiting for a database connection', ['pool'], buckets=FAST_BUCKETS)
+
+REQUEST_DURATION = _histogram('oajf_request_duration_seconds', 'Request latency', ['endpoint', 'method', 'status'])
+
+QUERIES = _counter('oajf_db_queries_total', 'Executed statements', ['func'])
+QUERY_ERRORS = _counter('oajf_db_query_errors_total', 'Failed statements', ['func'])
+QUERY_DURATION = _histogram('oajf_db_query_duration_seconds', 'Statement wall time', ['func'], buckets=FAST_BUCKETS)
+QUERY_ROWS = _counter('oajf_db_query_rows_total', 'Rows returned or affected by statements', ['func'])
+
+CACHE_REQUESTS = _counter('oajf_cache_requests_total', 'Cache lookups', ['cache', 'result'])
+
+SESSION_WRITES = _counter('oajf_session_writes_total', 'Writes to the session table', ['kind'])
+
+JOBS = _counter('oajf_jobs_total', 'Finished background jobs', ['kind', 'status'])
+JOB_DURATION = _histogram('oajf_job_duration_seconds', 'Background job run time', ['kind'], buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+
+
+def cacheHit(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+def observeQuery(func: str, elapsed: float, rows: int, failed: bool):
+    QUERIES.labels(func).inc()
+    QUERY_DURATION.labels(func).observe(elapsed)
+    if rows:
+        QUERY_ROWS.labels(func).inc(rows)
+    if failed:
+        QUERY_ERRORS.labels(func).inc()
+
+def setPoolConnections(pool: str, free: int, used: int):
+    POOL_CONNECTIONS.labels(pool, 'free').set(free)
+    POOL_CONNECTIONS.labels(pool, 'used').set(used)
+
+
+def generate():
+    """
+    returns the metrics in prometheus text format together with the content type
+    in multiprocess mode the values of all worker processes are aggregated
+    """
+    if prometheus_client is None:
+        return b'', CONTENT_TYPE_LATEST
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR', None):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def markProcessDead(pid):
+    if prometheus_client is not None and os.environ.get('PROMETHEUS_MULTIPROC_DIR', None):
+        multiprocess.mark_process_dead(pid)
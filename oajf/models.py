@@ -161,6 +161,8 @@ class Excel:
     id:int
     name:str
     file:bytes
+    file_hash:str
+    file_size:int
     uploaded:datetime.datetime
     valid:datetime.date
     publisher:Publisher
@@ -169,6 +171,8 @@ class Excel:
         self.id = None
         self.name = None
         self.file = None
+        self.file_hash = None
+        self.file_size = None
         self.uploaded = None
         self.valid = None
         self.publisher = None
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import re
+import sys
+import time
+import logging
+import threading
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from oajf import metrics
+
+# statements slower than this are written to the slow query log
+SLOW_QUERY_THRESHOLD_MS = 500
+SLOW_QUERY_LOGGER = 'oajf.slowquery'
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats: Dict[Tuple[str,str],QueryStat] = {}
+_slowlog = None
+
+def init(app):
+    global SLOW_QUERY_THRESHOLD_MS
+    db_config = app.config.get('DATABASE', {})
+    SLOW_QUERY_THRESHOLD_MS = db_config.get('slow_query_threshold', SLOW_QUERY_THRESHOLD_MS)
+
+
+class QueryStat:
+    func: str
+    shape: str
+    count: int
+    errors: int
+    total_time: float
+    max_time: float
+    rows: int
+    pool_wait: float
+
+    def __init__(self, func, shape):
+        self.func = func
+        self.shape = shape
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.pool_wait = 0.0
+
+    def toDict(self):
+        d = {}
+        d['func'] = self.func
+        d['shape'] = self.shape
+        d['count'] = self.count
+        d['errors'] = self.errors
+        d['total_ms'] = round(self.total_time * 1000, 3)
+        d['avg_ms'] = round(self.total_time * 1000 / self.count, 3) if self.count else 0
+        d['max_ms'] = round(self.max_time * 1000, 3)
+        d['rows'] = self.rows
+        d['pool_wait_ms'] = round(self.pool_wait * 1000, 3)
+        return d
+
+
+_re_string = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_re_number = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_re_in_list = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_re_space = re.compile(r"\s+")
+
+@lru_cache(maxsize=1024)
+def normalizeSql(sql: str) -> str:
+    """
+    returns the shape of a statement: literals replaced by ?, lists of placeholders collapsed
+    and whitespace normalized, so statements differing only in values are counted together
+    """
+    s = _re_string.sub('?', sql)
+    s = _re_number.sub('?', s)
+    s = _re_in_list.sub('(...)', s)
+    s = _re_space.sub(' ', s)
+    return s.strip()
+
+
+def setPoolWait(seconds: float):
+    """
+    remembers the time spent waiting for a connection, attributed to the next statement of this thread
+    """
+    _local.pool_wait = seconds
+
+def _popPoolWait() -> float:
+    wait = getattr(_local, 'pool_wait', 0.0)
+    _local.pool_wait = 0.0
+    return wait
+
+
+def execute(cur, sql: str, params=None, many: bool = False):
+    """
+    executes a statement on cur and records wall time, affected/returned rows,
+    statement shape and pool wait time under the name of the calling function
+    """
+    func = sys._getframe(1).f_code.co_name
+    failed = True
+    start = time.perf_counter()
+    try:
+        if many:
+            cur.executemany(sql, params)
+        elif params is None:
+            cur.execute(sql)
+        else:
+            cur.execute(sql, params)
+        failed = False
+    finally:
+        elapsed = time.perf_counter() - start
+        try:
+            rows = max(cur.rowcount, 0)
+        except Exception:
+            rows = 0
+        record(func, sql, elapsed, rows, _popPoolWait(), failed)
+
+    return cur
+
+
+def record(func: str, sql: str, elapsed: float, rows: int, pool_wait: float = 0.0, failed: bool = False):
+    shape = normalizeSql(sql)
+    key = (func, shape)
+
+    with _lock:
+        stat = _stats.get(key, None)
+        if stat is None:
+            stat = _stats[key] = QueryStat(func, shape)
+        stat.count += 1
+        if failed:
+            stat.errors += 1
+        stat.total_time += elapsed
+        if elapsed > stat.max_time:
+            stat.max_time = elapsed
+        stat.rows += rows
+        stat.pool_wait += pool_wait
+
+    metrics.observeQuery(func, elapsed, rows, failed)
+
+    if elapsed * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+        _getSlowLog().warning(f"{elapsed * 1000:.1f}ms func={func} rows={rows} pool_wait={pool_wait * 1000:.1f}ms sql={shape}")
+
+
+# looked up on first use, a logger created before logging.config.dictConfig would get disabled
+def _getSlowLog() -> logging.Logger:
+    global _slowlog
+    if _slowlog is None:
+        _slowlog = logging.getLogger(SLOW_QUERY_LOGGER)
+    return _slowlog
+
+
+def getQueryStats() -> List[QueryStat]:
+    """
+    returns the statistics of this process, most expensive statements first
+    """
+    with _lock:
+        l = [s for s in _stats.values()]
+    l.sort(key=lambda s: s.total_time, reverse=True)
+    return l
+
+def resetQueryStats():
+    with _lock:
+        _stats.clear()
@@ -3,11 +3,9 @@ import datetime
 import mariadb
 import re
 import logging
-import ipaddress
 import hashlib
 from uuid import uuid4
 from typing import Optional
-from yacryptopan import CryptoPAn
 
 from flask import Flask, request, current_app
 from flask.sessions import SessionInterface as FlaskSessionInterface
@@ -16,7 +14,15 @@ from werkzeug.datastructures import CallbackDict
 from flask_babel.speaklater import LazyString
 
 from oajf.util import logfunc
-from oajf.db import get_db
+from oajf.db import get_db,markWrite,isPrimarySticky,setStickyCookie,SCOPE_SESSION
+import oajf.db
+from oajf.querylog import execute
+from oajf import metrics
+from oajf.sessionbuffer import ActivityBuffer,HistoryBuffer
+from oajf import geoip
+from oajf.ipgroups import IPGroupIndex
+from oajf.cryptopan import CachedCryptoPAn
+from oajf.sessiongc import SessionSweeper
 
 # LazyString not serializable...
 class JSONEncoder(json.JSONEncoder):
@@ -28,7 +34,7 @@ class JSONEncoder(json.JSONEncoder):
 
 class ServerSideSession(CallbackDict, SessionMixin):
 
-    def __init__(self, initial=None, sid=None, permanent=False):
+    def __init__(self, initial=None, sid=None, permanent=False, new=False):
         def on_update(self):
             self.modified = True
             self.accessed = True
@@ -40,6 +46,14 @@ class ServerSideSession(CallbackDict, SessionMixin):
             self.permanent = permanent
         self.modified = False
         self.accessed = False
+        # new: no session row exists yet, it is only written once something is stored in the session
+        self.new = new
+        # the cookie sent by the client names a session unknown to the database
+        self.stale_cookie = False
+        # row read by open_session, save_session doesn't need to read it again
+        self.sd = None
+        # fingerprint of the stored payload, see MariaDBSessionInterface.getFingerprint
+        self.fingerprint = None
 
 
 class SessionData:
@@ -82,50 +96,92 @@ class MariaDBSessionInterface(SessionInterface):
         self.app = app
         self.session_class.permanent = app.config.get('SESSION_PERMANENT',False)
 
-        self.m_ip_group = {}
-        d = app.config.get('IP_GROUPS',{})
-        for k in d.keys():
-            l = d[k]
-            for x in l:
-                if len(x) == 2: c = (ipaddress.IPv4Address(x[0]),ipaddress.IPv4Address(x[1]))
-                elif len(x) == 1: c = (ipaddress.IPv4Address(x[0]),ipaddress.IPv4Address(x[0]))
-                else: c = None
-                if c: self.m_ip_group[c] = k
-
-        self.crypto =  CryptoPAn(''.join([chr(x) for x in range(0, 32)]).encode())
+        self.ip_groups = IPGroupIndex(app.config.get('IP_GROUPS',{}))
+
+        cryptopan_config = app.config.get('CRYPTOPAN',{})
+        self.crypto =  CachedCryptoPAn(''.join([chr(x) for x in range(0, 32)]).encode(),
+                                       maxsize=cryptopan_config.get('cache_size',10000),
+                                       prefix_cache=cryptopan_config.get('prefix_cache',True))
+
+        # 0 writes activity updates synchronously
+        interval = app.config.get('SESSION_ACTIVITY_FLUSH_INTERVAL',0.5)
+        self.activity = ActivityBuffer(app,interval=interval) if interval else None
+        # sessions whose payload didn't change get their activity columns updated at most this often
+        self.touch_interval = datetime.timedelta(seconds=app.config.get('SESSION_ACTIVITY_TOUCH_INTERVAL',60))
+
+        history_config = app.config.get('SESSION_HISTORY',{})
+        if history_config.get('enabled',True):
+            self.history = HistoryBuffer(app,interval=history_config.get('flush_interval',1.0))
+        else:
+            self.history = None
+
+        # optional in-process deletion of expired sessions, alternatively run "flask oajf expiresessions" from cron
+        gc_config = app.config.get('SESSION_GC',{})
+        if gc_config.get('interval',0):
+            self.sweeper = SessionSweeper(app,
+                                          interval=gc_config['interval'],
+                                          batch_size=gc_config.get('batch_size',500),
+                                          pause=gc_config.get('pause',0.1))
+        else:
+            self.sweeper = None
 
     def getGroupForIP(self,ip) -> Optional[str]:
-        l = []
-        a = ipaddress.IPv4Address(ip)
-
-        for k,v in self.m_ip_group.items():
-            if a >= k[0] and a <= k[1]:
-                if not v in l:
-                    l.append(v)
-        
-        return '; '.join(l) if l else None
+        return self.ip_groups.lookup(ip)
 
     #@logfunc
     def open_session(self, app, request):
         sd: SessionData = None
 
+        if self.sweeper:
+            self.sweeper.start()
+
         sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
         if not sid:
             sid = self._generate_sid()
-            return self.session_class(sid=sid, permanent=self.session_class.permanent)
+            return self.session_class(sid=sid, permanent=self.session_class.permanent, new=True)
 
         sd = self.readSessionData(sid)
         if sd is None:
             sid = self._generate_sid()
-            return self.session_class(sid=sid, permanent=self.session_class.permanent)
+            session = self.session_class(sid=sid, permanent=self.session_class.permanent, new=True)
+            session.stale_cookie = True
+            return session
 
         data = json.loads(sd.session_data)
         if data:
-            return self.session_class(dict(data), sid=sid)
-        return self.session_class(sid=sid, permanent=self.session_class.permanent)
+            session = self.session_class(dict(data), sid=sid)
+        else:
+            session = self.session_class(sid=sid, permanent=self.session_class.permanent)
+        session.sd = sd
+        session.fingerprint = self.getFingerprint(sd.session_data,sd.user_agent)
+        return session
+
+    def getFingerprint(self,session_data:str,user_agent:str) -> str:
+        """
+        hash over the serialized session contents and the user agent, the columns
+        which are only rewritten when they change
+        """
+        h = hashlib.sha256()
+        h.update((session_data or '').encode('utf-8'))
+        h.update(b'\0')
+        h.update((user_agent or '').encode('utf-8'))
+        return h.hexdigest()
+
+    def isTouchDue(self,sd:SessionData,now:datetime.datetime) -> bool:
+        if sd.last_activity is None:
+            return True
+        last = sd.last_activity
+        if last.tzinfo is None:
+            last = last.replace(tzinfo=datetime.timezone.utc)
+        return now - last >= self.touch_interval
 
     #@logfunc
     def save_session(self, app, session, response):
+        self._save_session(app, session, response)
+        if oajf.db.database.replica:
+            setStickyCookie(response)
+
+    def _save_session(self, app, session, response):
         sd: SessionData = None
         update_session_data = True
         store_request_data = app.config.get('STORE_REQUEST_DATA',False)
@@ -138,14 +194,30 @@ class MariaDBSessionInterface(SessionInterface):
         domain = self.get_cookie_domain(app)
         path = self.get_cookie_path(app)
 
+        # anonymous read traffic doesn't touch the session table, a session is only stored
+        # once something is put into it (login, explicit language switch, flashed message)
+        if session.new and not session.modified:
+            if session.stale_cookie:
+                response.delete_cookie(app.config["SESSION_COOKIE_NAME"], domain=domain, path=path)
+            return
+
         if not session:
             if session.modified:
+                if self.activity:
+                    self.activity.discard(session.sid)
                 conn = get_db()
+                markWrite(SCOPE_SESSION)
                 cursor = conn.cursor(dictionary=True)
-                cursor.execute('DELETE FROM session WHERE session_id = %s', (session.sid,))
+                execute(cursor,'DELETE FROM session WHERE session_id = %s', (session.sid,))
                 conn.commit()
+                metrics.SESSION_WRITES.labels('delete').inc()
                 conn.close()
 
+                if self.history:
+                    sd = session.sd if session.sd is not None else SessionData()
+                    sd.session_id = session.sid
+                    self.history.add('delete',sd)
+
                 response.delete_cookie(app.config["SESSION_COOKIE_NAME"], domain=domain, path=path)
             return
 
@@ -187,11 +259,47 @@ class MariaDBSessionInterface(SessionInterface):
 #                            continue
 #                    break
 
-        sd = self.readSessionData(session.sid)
+        sd = session.sd
+        if sd is None and not session.new:
+            sd = self.readSessionData(session.sid,read_only=False)
         if sd is None:
             update_session_data = True
-        
+
+        session_data = json.dumps(data,cls=JSONEncoder)
+        user_agent = str(request.user_agent)
+        fingerprint = self.getFingerprint(session_data,user_agent)
+        if sd is not None and session.fingerprint is None:
+            session.fingerprint = self.getFingerprint(sd.session_data,sd.user_agent)
+        unchanged = sd is not None and fingerprint == session.fingerprint
+
+        if update_session_data and unchanged and not self.isTouchDue(sd,last_activity):
+            # nothing changed but the clock, and the last activity was recorded recently
+            metrics.SESSION_WRITES.labels('skipped').inc()
+            update_session_data = False
+
+        if update_session_data and unchanged and self.activity:
+            # only the activity columns change, written in the background by the activity buffer
+            self.activity.add(session.sid,
+                              request.method,
+                              request.path,
+                              json.dumps(post_data),
+                              json.dumps(form_data),
+                              last_activity,
+                              expires)
+            update_session_data = False
+
+            if self.history:
+                sd.http_method = request.method
+                sd.request_path = request.path
+                sd.post_data = json.dumps(post_data)
+                sd.form_data = json.dumps(form_data)
+                sd.last_activity = last_activity
+                sd.expires = expires
+                self.history.add('update',sd)
+
         if update_session_data:
+            if self.activity:
+                self.activity.discard(session.sid)
             if sd is None:
                 sd = SessionData()
                 is_new = True
@@ -202,8 +310,8 @@ class MariaDBSessionInterface(SessionInterface):
             sd.request_path = request.path
             sd.post_data = json.dumps(post_data)
             sd.form_data = json.dumps(form_data)
-            sd.session_data = json.dumps(data,cls=JSONEncoder)
-            sd.user_agent = str(request.user_agent)
+            sd.session_data = session_data
+            sd.user_agent = user_agent
             sd.expires = expires
             sd.last_activity = last_activity
 
@@ -213,7 +321,8 @@ class MariaDBSessionInterface(SessionInterface):
                 sd.ip_group = self.getGroupForIP(sd.ip_address)
                 store_ip_mode = app.config.get('STORE_IPS','plain')
 
-                if store_ip_mode == 'crytopan':
+                # misspelled values accepted for existing configs
+                if store_ip_mode in ('cryptopan','crytopan','crpytopan'):
                     sd.ip_address = self.crypto.anonymize(sd.ip_address)
                 elif store_ip_mode == 'sha256':
                     sd.ip_address = hashlib.sha256(uuid4().hex.encode('utf-8')+sd.ip_address.encode('utf-8')).hexdigest()
@@ -230,14 +339,24 @@ class MariaDBSessionInterface(SessionInterface):
         
 
     #@logfunc
-    def readSessionData(self,session_id:str) -> Optional[SessionData]:
+    def readSessionData(self,session_id:str,read_only=True) -> Optional[SessionData]:
+        o:SessionData = None
+        use_replica = read_only and oajf.db.database.replica and not isPrimarySticky(SCOPE_SESSION)
+
+        o = self._readSessionData(session_id,get_db(read_only=use_replica,scope=SCOPE_SESSION))
+        # a session missing on the replica might just not be replicated yet, so retry on the primary
+        if o is None and use_replica:
+            o = self._readSessionData(session_id,get_db())
+
+        return o
+
+    def _readSessionData(self,session_id:str,conn) -> Optional[SessionData]:
         o:SessionData = None
-        conn = get_db()
         cur = conn.cursor(dictionary=True)
         try:
             l = []
             sql = "SELECT id,session_id,ip_address,ip_group,country_code,http_method,request_path,post_data,form_data,session_data,user_agent,last_activity,expires FROM session WHERE session_id=?"
-            cur.execute(sql,(session_id,))
+            execute(cur,sql,(session_id,))
             row = cur.fetchone()
 
             if row:
@@ -261,8 +380,10 @@ class MariaDBSessionInterface(SessionInterface):
     #@logfunc
     def writeSessionData(self,o: SessionData):
         conn = get_db()
+        markWrite(SCOPE_SESSION)
         cur = conn.cursor()
         try:
+            action = 'insert' if o.id is None else 'update'
             if o.id is None: 
                 sql = """
                 INSERT INTO session
@@ -278,7 +399,7 @@ class MariaDBSessionInterface(SessionInterface):
                 ?,?,?,?
                 )
                 """
-                cur.execute(sql,
+                execute(cur,sql,
                     (o.session_id,
                     o.ip_address,
                     o.ip_group,
@@ -294,6 +415,7 @@ class MariaDBSessionInterface(SessionInterface):
                     )
                 )
                 o.id = cur.lastrowid
+                metrics.SESSION_WRITES.labels('insert').inc()
             else:
                 sql = """
                 UPDATE session SET 
@@ -302,7 +424,7 @@ class MariaDBSessionInterface(SessionInterface):
                 WHERE 
                 session_id=?
                 """
-                cur.execute(sql,
+                execute(cur,sql,
                     (o.session_id,
                     o.ip_address,
                     o.ip_group,
@@ -318,8 +440,12 @@ class MariaDBSessionInterface(SessionInterface):
                     o.session_id,
                     )
                 )
+                metrics.SESSION_WRITES.labels('update').inc()
             conn.commit()
 
+            if self.history:
+                self.history.add(action,o)
+
         except mariadb.Error as e:
             current_app.logger.error(type(e))
             current_app.logger.error(e)
@@ -339,27 +465,4 @@ class MariaDBSessionInterface(SessionInterface):
 
     #@logfunc
     def getCountryCodeForIp(self,ip:str) -> Optional[str]:
-        country_code:str = None
-        conn = get_db()
-        cur = conn.cursor(dictionary=True)
-        try:
-            l = []
-            sql = "SELECT country_code FROM geoip WHERE ? >= ip_from and ? <= ip_to"
-            cur.execute(sql,(ip,ip,))
-            row = cur.fetchone()
-
-            if row:
-                for v in row.values():
-                    country_code = v
-            return country_code
-        except mariadb.Error as e:
-            current_app.logger.error(type(e))
-            current_app.logger.error(e)
-            raise e
-        except Exception as e:
-            current_app.logger.error(type(e))
-            current_app.logger.error(e)
-            raise e
-        finally:
-            if conn:
-                conn.close()
+        return geoip.getCountryCode(ip)
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import os
+import time
+import atexit
+import datetime
+import threading
+import traceback
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+from oajf.db import get_db
+from oajf.querylog import execute
+from oajf import metrics
+
+
+class WriteBehindBuffer(ABC):
+    """
+    collects rows in memory and writes them in batches from a background thread every interval seconds,
+    and once more when the process exits normally. a full buffer is written by the adding thread
+    rows of a failed write are dropped, a killed worker loses at most one interval
+    """
+    name = 'oajf-write-behind'
+
+    def __init__(self, app, interval: float = 0.5, max_entries: int = 10000):
+        self.app = app
+        self.interval = interval
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.pid = None
+
+    @abstractmethod
+    def _take(self) -> list:
+        """
+        returns the buffered rows and empties the buffer, called with self.lock held
+        """
+
+    @abstractmethod
+    def _size(self) -> int:
+        """
+        returns the number of buffered rows
+        """
+
+    @abstractmethod
+    def _write(self, cur, rows: list):
+        """
+        writes the rows taken from the buffer, the caller commits
+        """
+
+    def _added(self):
+        if self._size() >= self.max_entries:
+            self.flush()
+
+    def flush(self) -> int:
+        with self.lock:
+            rows = self._take()
+        if not rows:
+            return 0
+
+        conn = None
+        try:
+            with self.app.app_context():
+                conn = get_db()
+                cur = conn.cursor()
+                self._write(cur, rows)
+                conn.commit()
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            self.app.logger.error(f"{self.name} flush failed, {len(rows)} rows dropped")
+            self.app.logger.error(f"exception={type(e).__name__}")
+            self.app.logger.error(f"stacktrace={traceback.format_exc()}")
+            return 0
+        finally:
+            if conn:
+                conn.close()
+
+        return len(rows)
+
+    # the thread is started in the worker process on first use, threads don't survive a fork
+    def _ensureThread(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self._take()
+            thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+# write-behind buffer for the activity columns of existing sessions
+#
+# requests that don't modify the session only update request_path, last_activity and friends.
+# these updates are collected per worker process, coalesced per session_id (the latest request wins)
+# and written every SESSION_ACTIVITY_FLUSH_INTERVAL seconds in one batch by a background thread,
+# and once more when the process exits normally
+#
+# loss semantics: activity updates are bookkeeping only, session contents are always written synchronously.
+# a worker that is killed or crashes loses at most the updates of the last interval, a failed flush
+# drops its batch, the next request of each session buffers a fresh update
+#
+# the batch is a plain UPDATE, not an upsert: a session deleted in the meantime (logout, expiry)
+# must not be recreated by a late activity update. the last_activity condition keeps an older buffered
+# update from overwriting a newer one written synchronously or by another worker
+
+SQL_UPDATE = """
+    UPDATE session SET
+    http_method=?,request_path=?,post_data=?,form_data=?,last_activity=?,expires=?
+    WHERE session_id=? AND (last_activity IS NULL OR last_activity < ?)
+"""
+
+class ActivityBuffer(WriteBehindBuffer):
+    name = 'oajf-session-activity'
+
+    def __init__(self, app, interval: float = 0.5, max_entries: int = 10000):
+        super().__init__(app, interval, max_entries)
+        self.pending: Dict[str, Tuple] = {}
+
+    def add(self, session_id: str, http_method: str, request_path: str, post_data: str, form_data: str,
+            last_activity: datetime.datetime, expires: datetime.datetime):
+        self._ensureThread()
+        with self.lock:
+            self.pending[session_id] = (http_method, request_path, post_data, form_data, last_activity, expires)
+        self._added()
+
+    def discard(self, session_id: str):
+        """
+        drops a buffered update, called when the session is written or deleted synchronously
+        """
+        with self.lock:
+            self.pending.pop(session_id, None)
+
+    def _take(self) -> list:
+        pending = self.pending
+        self.pending = {}
+        rows = []
+        for session_id, (http_method, request_path, post_data, form_data, last_activity, expires) in pending.items():
+            rows.append((http_method, request_path, post_data, form_data, last_activity, expires, session_id, last_activity))
+        return rows
+
+    def _size(self) -> int:
+        return len(self.pending)
+
+    def _write(self, cur, rows: list):
+        execute(cur, SQL_UPDATE, rows, many=True)
+        metrics.SESSION_WRITES.labels('activity').inc(len(rows))
+
+
+# append-only session history, replaces the session__ai/au/bd triggers
+#
+# every insert, update, activity update and delete of a session adds one row to session_history,
+# buffered per worker and inserted in batches. the table is partitioned by month,
+# "flask oajf rotatesessionhistory" adds partitions ahead of time and drops expired ones
+
+SQL_HISTORY_INSERT = """
+    INSERT INTO session_history
+    (session_id,action,dt_datetime,ip_address,ip_group,country_code,http_method,request_path,
+    post_data,form_data,session_data,user_agent,last_activity,expires)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+class HistoryBuffer(WriteBehindBuffer):
+    name = 'oajf-session-history'
+
+    def __init__(self, app, interval: float = 1.0, max_entries: int = 10000):
+        super().__init__(app, interval, max_entries)
+        self.rows: List[Tuple] = []
+
+    def add(self, action: str, sd):
+        """
+        records the state of the SessionData sd, the values are copied immediately
+        """
+        row = (sd.session_id,
+               action,
+               datetime.datetime.now(),
+               getattr(sd, 'ip_address', None),
+               getattr(sd, 'ip_group', None),
+               getattr(sd, 'country_code', None),
+               getattr(sd, 'http_method', None),
+               getattr(sd, 'request_path', None),
+               getattr(sd, 'post_data', None),
+               getattr(sd, 'form_data', None),
+               getattr(sd, 'session_data', None),
+               getattr(sd, 'user_agent', None),
+               getattr(sd, 'last_activity', None),
+               getattr(sd, 'expires', None),
+               )
+        self._ensureThread()
+        with self.lock:
+            self.rows.append(row)
+        self._added()
+
+    def _take(self) -> list:
+        rows = self.rows
+        self.rows = []
+        return rows
+
+    def _size(self) -> int:
+        return len(self.rows)
+
+    def _write(self, cur, rows: list):
+        execute(cur, SQL_HISTORY_INSERT, rows, many=True)
+        metrics.SESSION_WRITES.labels('history').inc(len(rows))
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import os
+import time
+import datetime
+import threading
+import traceback
+
+from flask import current_app
+
+from oajf.db import get_db
+from oajf.querylog import execute
+from oajf import metrics
+
+# expired sessions are deleted by "flask oajf expiresessions" (cron) or by the optional sweeper thread
+# rows are selected by index range scans on expires/last_activity and deleted by primary key
+# in small batches, each in its own transaction with a pause in between, so live traffic
+# never waits long for row locks
+
+SWEEPER_LOCK = 'oajf_session_gc'
+
+
+def deleteExpiredSessions(lifetime: datetime.timedelta, batch_size: int = 500, pause: float = 0.1, transaction_conn=None) -> int:
+    """
+    deletes sessions past their expiry date, sessions without one (non permanent cookies)
+    expire lifetime after their last activity. returns the number of deleted rows
+    """
+    # expires and last_activity are stored in utc
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    conditions = [
+        ("expires < ?", "expires", now),
+        ("expires IS NULL AND last_activity < ?", "last_activity", now - lifetime),
+    ]
+
+    cnt = 0
+    conn = None
+    try:
+        conn = transaction_conn if transaction_conn else get_db()
+        cur = conn.cursor()
+        for where, order, value in conditions:
+            while True:
+                execute(cur, f"SELECT id FROM session WHERE {where} ORDER BY {order} LIMIT ?", (value, batch_size))
+                ids = [row[0] for row in cur.fetchall()]
+                if not ids:
+                    break
+                execute(cur, f"DELETE FROM session WHERE id IN ({','.join(str(int(id)) for id in ids)})")
+                conn.commit()
+                cnt += cur.rowcount
+                metrics.SESSION_WRITES.labels('expired').inc(cur.rowcount)
+                if len(ids) < batch_size:
+                    break
+                time.sleep(pause)
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+    finally:
+        if not transaction_conn and conn:
+            conn.close()
+
+    return cnt
+
+
+class SessionSweeper():
+    """
+    runs deleteExpiredSessions every interval seconds in a background thread of each worker,
+    a database lock lets only one worker sweep at a time
+    """
+
+    def __init__(self, app, interval: float = 3600, batch_size: int = 500, pause: float = 0.1):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.lock = threading.Lock()
+        self.pid = None
+
+    # the thread is started in the worker process on first use, threads don't survive a fork
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            thread = threading.Thread(target=self._run, name='oajf-session-gc', daemon=True)
+            thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.sweep()
+            except Exception as e:
+                self.app.logger.error(f"session sweep failed, exception={type(e).__name__}")
+
+    def sweep(self) -> int:
+        conn = None
+        try:
+            conn = get_db()
+            cur = conn.cursor()
+            execute(cur, "SELECT GET_LOCK(?,0)", (SWEEPER_LOCK,))
+            if not cur.fetchone()[0]:
+                return 0
+            try:
+                cnt = deleteExpiredSessions(self.app.permanent_session_lifetime,
+                                            batch_size=self.batch_size,
+                                            pause=self.pause,
+                                            transaction_conn=conn)
+            finally:
+                execute(cur, "SELECT RELEASE_LOCK(?)", (SWEEPER_LOCK,))
+                cur.fetchall()
+            if cnt:
+                self.app.logger.info(f"{cnt} expired sessions deleted")
+            return cnt
+        finally:
+            if conn:
+                conn.close()
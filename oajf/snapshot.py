@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import datetime
+import tempfile
+import threading
+import traceback
+
+from flask import current_app
+
+from oajf.querylog import execute
+
+# read-only sqlite copy of the tables needed by the public pages
+# (publisher, link, journal_search, setting), exported from mariadb by "flask oajf exportsnapshot"
+# frontends configured with DATABASE['snapshot'] serve public reads from this file
+
+TABLES = {
+    'publisher': [
+        'id', 'name', 'validity', 'oa_status', 'application_requirement',
+        'funder_info', 'cost_coverage', 'valid_tu', 'article_type', 'further_info',
+        'funder_info_en', 'cost_coverage_en', 'valid_tu_en', 'article_type_en', 'further_info_en',
+        'is_doaj', 'doaj_linked',
+    ],
+    'link': ['id', 'publisher_id', 'link', 'linktype', 'linktext_de', 'linktext_en'],
+    'journal_search': [
+        'journal_id', 'title', 'title_norm', 'link', 'print_issn', 'e_issn', 'valid_till',
+        'publisher_id', 'publisher_name', 'oa_status', 'application_requirement',
+    ],
+    'setting': ['id', 'name', 'value', 'value_en', 'value_de'],
+}
+
+# NOCASE collations approximate the case insensitive sorting of mariadb's utf8mb4_general_ci
+SCHEMA = [
+    """
+    CREATE TABLE publisher (
+        id INTEGER PRIMARY KEY,
+        name TEXT COLLATE NOCASE NOT NULL,
+        validity TEXT,
+        oa_status TEXT,
+        application_requirement TEXT,
+        funder_info TEXT,
+        cost_coverage TEXT,
+        valid_tu TEXT,
+        article_type TEXT,
+        further_info TEXT,
+        funder_info_en TEXT,
+        cost_coverage_en TEXT,
+        valid_tu_en TEXT,
+        article_type_en TEXT,
+        further_info_en TEXT,
+        is_doaj INTEGER NOT NULL DEFAULT 0,
+        doaj_linked INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE link (
+        id INTEGER PRIMARY KEY,
+        publisher_id INTEGER NOT NULL,
+        link TEXT,
+        linktype TEXT,
+        linktext_de TEXT,
+        linktext_en TEXT
+    )
+    """,
+    """
+    CREATE TABLE journal_search (
+        journal_id INTEGER PRIMARY KEY,
+        title TEXT COLLATE NOCASE NOT NULL,
+        title_norm TEXT NOT NULL,
+        link TEXT,
+        print_issn TEXT,
+        e_issn TEXT,
+        valid_till DATE,
+        publisher_id INTEGER NOT NULL,
+        publisher_name TEXT COLLATE NOCASE NOT NULL,
+        oa_status TEXT,
+        application_requirement TEXT
+    )
+    """,
+    """
+    CREATE TABLE setting (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        value TEXT,
+        value_en TEXT,
+        value_de TEXT
+    )
+    """,
+    "CREATE TABLE snapshot_info (name TEXT PRIMARY KEY, value TEXT)",
+]
+
+# created after loading, bulk inserts into unindexed tables are faster
+INDEXES = [
+    "CREATE INDEX idx_link_publisher ON link (publisher_id)",
+    "CREATE INDEX idx_js_title ON journal_search (title)",
+    "CREATE INDEX idx_js_publisher_name ON journal_search (publisher_name, title)",
+    "CREATE INDEX idx_js_oa_status ON journal_search (oa_status, title)",
+    "CREATE INDEX idx_js_application_requirement ON journal_search (application_requirement, title)",
+    "CREATE INDEX idx_js_valid_till ON journal_search (valid_till)",
+    "CREATE INDEX idx_js_publisher ON journal_search (publisher_id)",
+    "CREATE INDEX idx_js_e_issn ON journal_search (e_issn)",
+    "CREATE INDEX idx_js_print_issn ON journal_search (print_issn)",
+    "CREATE INDEX idx_publisher_name ON publisher (name)",
+]
+
+# the trigram tokenizer (sqlite >= 3.34) lets LIKE '%...%' on titles use the full text index
+FTS = [
+    "CREATE VIRTUAL TABLE journal_search_fts USING fts5(title_norm, content='journal_search', content_rowid='journal_id', tokenize='trigram')",
+    "INSERT INTO journal_search_fts(journal_search_fts) VALUES ('rebuild')",
+]
+
+BATCH_SIZE = 5000
+
+
+def _convert_date(value: bytes):
+    return datetime.date.fromisoformat(value.decode()) if value else None
+
+sqlite3.register_converter('DATE', _convert_date)
+sqlite3.register_adapter(datetime.date, lambda d: d.isoformat())
+
+
+def exportSnapshot(conn, path: str) -> dict:
+    """
+    copies the public tables from the mariadb connection conn into a new sqlite file
+    all tables are read in one consistent snapshot transaction, the file is built next to path
+    and moved in place atomically, so readers never see a partially written file
+    returns the number of rows per table
+    """
+    counts = {}
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.snapshot-', suffix='.sqlite')
+    os.close(fd)
+
+    try:
+        lite = sqlite3.connect(tmp)
+        lite.execute("PRAGMA journal_mode=OFF")
+        lite.execute("PRAGMA synchronous=OFF")
+        for sql in SCHEMA:
+            lite.execute(sql)
+
+        cur = conn.cursor()
+        execute(cur, "START TRANSACTION WITH CONSISTENT SNAPSHOT")
+        for table, columns in TABLES.items():
+            counts[table] = 0
+            sql_insert = f"INSERT INTO {table} ({','.join(columns)}) VALUES ({','.join(['?'] * len(columns))})"
+            execute(cur, f"SELECT {','.join(columns)} FROM {table}")
+            while rows := cur.fetchmany(BATCH_SIZE):
+                lite.executemany(sql_insert, rows)
+                counts[table] += len(rows)
+        conn.rollback()
+
+        for sql in INDEXES + FTS:
+            lite.execute(sql)
+        lite.execute("INSERT INTO snapshot_info (name,value) VALUES ('created',?)", (datetime.datetime.now().isoformat(),))
+        lite.commit()
+        lite.execute("ANALYZE")
+        lite.execute("VACUUM")
+        lite.close()
+
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except Exception as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        current_app.logger.error(f"exception={type(e).__name__}")
+        current_app.logger.error(f"stacktrace={traceback.format_exc()}")
+        raise e
+
+    return counts
+
+
+class SnapshotConnection():
+    """
+    read-only connection to the snapshot file, mimics the parts of the mariadb connection
+    used by the read functions in oajf.db
+    close() only returns the connection to its thread, the file is reopened after it has been replaced
+    """
+    dialect = 'sqlite'
+
+    def __init__(self, path: str):
+        self.path = path
+        self.stat = os.stat(path)
+        self.conn = sqlite3.connect(
+            f"file:{path}?mode=ro&immutable=1",
+            uri=True,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+        )
+
+    def isCurrent(self) -> bool:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return st.st_ino == self.stat.st_ino and st.st_mtime == self.stat.st_mtime
+
+    def cursor(self, dictionary=False):
+        cur = self.conn.cursor()
+        if dictionary:
+            cur.row_factory = sqlite3.Row
+        return cur
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def dispose(self):
+        self.conn.close()
+
+
+class Snapshot():
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+
+    def available(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def getConnection(self) -> SnapshotConnection:
+        conn: SnapshotConnection = getattr(self.local, 'conn', None)
+        if conn is not None and not conn.isCurrent():
+            conn.dispose()
+            conn = None
+        if conn is None:
+            conn = self.local.conn = SnapshotConnection(self.path)
+        return conn
+
+
+def isSnapshot(conn) -> bool:
+    return getattr(conn, 'dialect', None) == 'sqlite'
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import io
+import csv
+import codecs
+import os.path
+from typing import BinaryIO, Iterator, Tuple
+
+import openpyxl
+
+# row readers for uploaded title lists
+#
+# .xlsx files are read with openpyxl in read only mode, .csv/.tsv/.txt files with the csv module straight from
+# the binary stream. the encoding is taken from a byte order mark, otherwise utf-8 is assumed when the first
+# SAMPLE_SIZE bytes decode as utf-8 and cp1252 (excel's "CSV" export on windows) if not. the delimiter is
+# detected in the same sample. both readers yield tuples, empty csv cells are None like empty excel cells
+
+SAMPLE_SIZE = 64 * 1024
+DELIMITERS = ',;\t|'
+
+MIMETYPES = {
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.csv': 'text/csv',
+    '.tsv': 'text/tab-separated-values',
+    '.txt': 'text/plain',
+}
+EXTENSIONS = tuple(MIMETYPES.keys())
+
+
+def getExtension(filename: str) -> str:
+    return os.path.splitext(filename or '')[1].lower()
+
+def isSupported(filename: str) -> bool:
+    return getExtension(filename) in MIMETYPES
+
+def getMimetype(filename: str) -> str:
+    return MIMETYPES.get(getExtension(filename), MIMETYPES['.xlsx'])
+
+def detectEncoding(sample: bytes) -> str:
+    """
+    returns the encoding of a text file from its first bytes
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith(codecs.BOM_UTF16_LE) or sample.startswith(codecs.BOM_UTF16_BE):
+        return 'utf-16'
+    try:
+        # final=False: the sample may end within a multibyte character
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+def detectDialect(sample: str, extension: str = None) -> csv.Dialect:
+    """
+    returns the csv dialect of a decoded sample, .tsv files are always tab separated
+    """
+    if extension == '.tsv':
+        return csv.excel_tab
+    # the sniffer needs complete lines
+    lines = sample.splitlines()
+    if len(lines) > 1:
+        lines = lines[:-1]
+    try:
+        return csv.Sniffer().sniff("\n".join(lines), delimiters=DELIMITERS)
+    except csv.Error:
+        header = lines[0] if lines else ''
+        delimiter = max(DELIMITERS, key=header.count)
+        return csv.excel_tab if delimiter == '\t' else type('dialect', (csv.excel,), {'delimiter': delimiter})
+
+def readCsvRows(f: BinaryIO, extension: str = '.csv') -> Iterator[Tuple]:
+    sample = f.read(SAMPLE_SIZE)
+    f.seek(0)
+    encoding = detectEncoding(sample)
+    dialect = detectDialect(sample.decode(encoding, errors='ignore'), extension)
+
+    text = io.TextIOWrapper(f, encoding=encoding, newline='')
+    try:
+        for row in csv.reader(text, dialect):
+            yield tuple(value if value != '' else None for value in row)
+    finally:
+        # the caller owns f
+        text.detach()
+
+def readXlsxRows(f: BinaryIO) -> Iterator[Tuple]:
+    wb = openpyxl.load_workbook(f, read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            yield tuple(row)
+    finally:
+        wb.close()
+
+def readRows(f: BinaryIO, filename: str) -> Iterator[Tuple]:
+    """
+    yields the rows of an uploaded file as tuples, including the header row, the reader is chosen by the file extension
+    """
+    extension = getExtension(filename)
+    if extension == '.xlsx':
+        return readXlsxRows(f)
+    return readCsvRows(f, extension)
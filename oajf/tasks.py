@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import os
+import datetime
+import tempfile
+from typing import Dict, List
+
+import xlsxwriter
+from flask import g
+from flask_babel import lazy_gettext as _, ngettext
+
+from oajf import MESSAGE_TYPE_ERROR, MESSAGE_TYPE_SUCCESS, MESSAGE_TYPE_WARNING
+from oajf.db import get_db
+from oajf.db import readJournals as db_readJournals
+from oajf.models import Journal, Excel
+from oajf.util import get_publishers, iterDOAJDump, DOAJDumpError, getDOAJChangesFileAsExcelWorkbook, getDOAJWithdrawnIssns
+from oajf.journalimport import JournalImport, ImportRejected, MODE_APPEND, MODE_REPLACE, MODE_SYNC, STAGING_MAX_AGE_HOURS
+from oajf.jobs import Job, JobFailed, handler
+from oajf.filestore import get_filestore
+
+# handlers of the background jobs, see oajf/jobs.py
+# jobs run outside of a request: journals are read from the primary, never from the snapshot
+
+JOB_UPLOAD = 'upload'
+JOB_UPLOAD_PREVIEW = 'upload_preview'
+JOB_UPLOAD_CONFIRM = 'upload_confirm'
+JOB_DOAJ_SYNC = 'doaj_sync'
+JOB_DOAJ_WITHDRAWN = 'doaj_withdrawn'
+JOB_EXPORT_JOURNALS = 'export_journals'
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def _readJournals(**kwargs) -> List[Journal]:
+    conn = get_db()
+    try:
+        return db_readJournals(transaction_conn=conn, **kwargs)
+    finally:
+        conn.close()
+
+
+def _uploadExcel(params: dict, publisher) -> Excel:
+    e = Excel()
+    e.name = params['filename']
+    e.file_hash = params['file_hash']
+    e.file_size = params['file_size']
+    e.valid = params['valid']
+    e.publisher = publisher
+    return e
+
+def _uploadMode(params: dict) -> str:
+    # jobs queued before the modes were introduced only have delete_journals
+    return params.get('mode', None) or (MODE_REPLACE if params.get('delete_journals', False) else MODE_APPEND)
+
+def _addUploadMessages(job: Job, counts: Dict[str, int], mode: str):
+    job.addMessage(_("Excel-Datei erfolgreich importiert."), MESSAGE_TYPE_SUCCESS)
+    msg = ngettext("{0} Zeitschrift gelöscht.", "{0} Zeitschriften gelöscht.", counts['deleted'])
+    job.addMessage(msg.format(counts['deleted']), MESSAGE_TYPE_SUCCESS)
+    msg = ngettext("{0} Zeitschrift importiert.", "{0} Zeitschriften importiert.", counts['inserted'])
+    job.addMessage(msg.format(counts['inserted']), MESSAGE_TYPE_SUCCESS)
+    if mode == MODE_SYNC:
+        msg = ngettext("{0} Zeitschrift aktualisiert.", "{0} Zeitschriften aktualisiert.", counts['updated'])
+        job.addMessage(msg.format(counts['updated']), MESSAGE_TYPE_SUCCESS)
+        msg = ngettext("{0} Zeitschrift unverändert.", "{0} Zeitschriften unverändert.", counts['unchanged'])
+        job.addMessage(msg.format(counts['unchanged']), MESSAGE_TYPE_SUCCESS)
+        msg = ngettext("Gültigkeitsende von {0} Zeitschrift geändert.", "Gültigkeitsende von {0} Zeitschriften geändert.", counts['valid_till'])
+        job.addMessage(msg.format(counts['valid_till']), MESSAGE_TYPE_SUCCESS)
+
+@handler(JOB_UPLOAD)
+def uploadJournals(job: Job):
+    """
+    imports an uploaded title list, params: publisher_id, valid, filename, file_hash, file_size, mode
+    """
+    params = job.params
+    get_publishers()
+    publisher = g.m_publishers[int(params['publisher_id'])]
+    mode = _uploadMode(params)
+
+    importer = JournalImport(publisher, datetime.date.fromisoformat(params['valid']), progress=job.setProgress)
+    with job.spoolParamFile() as f:
+        try:
+            counts = importer.run(f, _uploadExcel(params, publisher), mode=mode)
+        except ImportRejected as ex:
+            for msg in ex.errors:
+                job.addMessage(msg, MESSAGE_TYPE_ERROR)
+            raise JobFailed()
+
+    _addUploadMessages(job, counts, mode)
+    for msg in importer.getWarnings():
+        job.addMessage(msg, MESSAGE_TYPE_WARNING)
+
+
+# the uploaded file is saved with the excel history entry when the preview is confirmed
+@handler(JOB_UPLOAD_PREVIEW, keep_input_hours=STAGING_MAX_AGE_HOURS)
+def previewUpload(job: Job):
+    """
+    dry run of an upload, same params as JOB_UPLOAD. the rows stay staged, the result holds the preview
+    of JournalImport.preview for admin_upload_preview.html, its upload_id is the token of JOB_UPLOAD_CONFIRM
+    """
+    params = job.params
+    get_publishers()
+    publisher = g.m_publishers[int(params['publisher_id'])]
+
+    importer = JournalImport(publisher, datetime.date.fromisoformat(params['valid']), progress=job.setProgress)
+    with job.spoolParamFile() as f:
+        try:
+            preview = importer.run(f, _uploadExcel(params, publisher), mode=_uploadMode(params), dry_run=True)
+        except ImportRejected as ex:
+            for msg in ex.errors:
+                job.addMessage(msg, MESSAGE_TYPE_ERROR)
+            raise JobFailed()
+
+    job.setResultJson(preview, 'upload_preview.json')
+
+
+@handler(JOB_UPLOAD_CONFIRM)
+def confirmUpload(job: Job):
+    """
+    applies the rows staged by a JOB_UPLOAD_PREVIEW, params: those of the preview and its upload_id
+    """
+    params = job.params
+    get_publishers()
+    publisher = g.m_publishers[int(params['publisher_id'])]
+    mode = _uploadMode(params)
+
+    if not get_filestore().exists(params['file_hash']):
+        job.addMessage(_("Die hochgeladene Datei ist nicht mehr vorhanden, bitte erneut hochladen."), MESSAGE_TYPE_ERROR)
+        raise JobFailed()
+
+    importer = JournalImport(publisher, datetime.date.fromisoformat(params['valid']), upload_id=params['upload_id'])
+    try:
+        counts = importer.confirm(_uploadExcel(params, publisher), mode=mode)
+    except ImportRejected as ex:
+        for msg in ex.errors:
+            job.addMessage(msg, MESSAGE_TYPE_ERROR)
+        raise JobFailed()
+
+    _addUploadMessages(job, counts, mode)
+
+
+@handler(JOB_DOAJ_SYNC)
+def compareDOAJDump(job: Job):
+    """
+    compares the DOAJ dump with the journals of the DOAJ publisher,
+    the result holds the new (l_new) and changed (l_updated) journals for admin_doaj_dump.html
+    """
+    l_new: List[Dict] = []
+    l_updated: List[Dict] = []
+    m_eissn: Dict[str, Journal] = {}
+    m_pissn: Dict[str, Journal] = {}
+
+    publishers = [p for p in get_publishers() if p.is_doaj == 1]
+    p = publishers[0]
+
+    for j in _readJournals(publisher=p, publisher_shallow=True):
+        if j.e_issn:
+            if j.e_issn in m_eissn:
+                job.addMessage(_("E-ISSN mehrfach gefunden für Zeitschriften in der Datenbank: {0}").format(j.e_issn), MESSAGE_TYPE_WARNING)
+            else:
+                m_eissn[j.e_issn] = j
+
+        if j.print_issn:
+            if j.print_issn in m_pissn:
+                job.addMessage(_("Print-ISSN mehrfach gefunden für Zeitschriften in der Datenbank: {0}").format(j.print_issn), MESSAGE_TYPE_WARNING)
+            else:
+                m_pissn[j.print_issn] = j
+
+    # the dump is compared while it is downloaded, only the differences are kept
+    cnt = 0
+    try:
+        for j in iterDOAJDump():
+            job.setProgress(cnt)
+            cnt += 1
+            d = {'title': j.title, 'e_issn': j.e_issn, 'print_issn': j.print_issn, 'url': j.url}
+
+            j_db = None
+            if j.e_issn and j.e_issn in m_eissn:
+                j_db = m_eissn[j.e_issn]
+            elif j.print_issn and j.print_issn in m_pissn:
+                j_db = m_pissn[j.print_issn]
+
+            if j_db:
+                diffs = j.getDifferences(j_db)
+                if diffs:
+                    d['id'] = j_db.id
+                    d['valid_till'] = j_db.valid_till
+                    d['diffs'] = diffs
+                    l_updated.append(d)
+            else:
+                l_new.append(d)
+    except DOAJDumpError as e:
+        job.addMessage(e.args[0], MESSAGE_TYPE_ERROR)
+        raise JobFailed()
+    job.setProgress(cnt, total=cnt)
+
+    if len(l_new) == 0 and len(l_updated) == 0:
+        job.addMessage("Weder neue noch zu aktualisierende Zeitschriften gefunden.", MESSAGE_TYPE_WARNING)
+
+    job.setResultJson({'l_new': l_new, 'l_updated': l_updated}, 'doaj_dump.json')
+
+
+@handler(JOB_DOAJ_WITHDRAWN)
+def readDOAJWithdrawn(job: Job):
+    """
+    finds the active journals withdrawn from DOAJ,
+    the result holds the journals (l_journal) for admin_doaj_withdrawn.html
+    """
+    l_journal: List[Dict] = []
+
+    wb, data, errs = getDOAJChangesFileAsExcelWorkbook()
+    if errs:
+        for e in errs:
+            job.addMessage(e, MESSAGE_TYPE_ERROR)
+        raise JobFailed()
+
+    map_issn = getDOAJWithdrawnIssns(wb)
+
+    get_publishers()
+
+    for i, (k, v) in enumerate(map_issn.items()):
+        job.setProgress(i, total=len(map_issn))
+        for j in _readJournals(e_issn=k, only_active=True, publisher_shallow=True):
+            publisher = g.m_publishers[j.publisher.id]
+            l_journal.append({
+                'id': j.id,
+                'title': j.title,
+                'url': j.url,
+                'e_issn': j.e_issn,
+                'print_issn': j.print_issn,
+                'publisher': {'id': publisher.id, 'name': publisher.name},
+                'withdraw_reason': v[2],
+                'withdraw_date': v[1],
+                'to_be_deleted': 1 if publisher.is_doaj == 1 or publisher.doaj_linked == 1 else 0,
+            })
+    job.setProgress(len(map_issn))
+
+    if len(l_journal) == 0:
+        job.addMessage("Keine zu löschenden Zeitschriften gefunden.", MESSAGE_TYPE_WARNING)
+
+    job.setResultJson({'l_journal': l_journal}, 'doaj_withdrawn.json')
+
+
+def writeJournalsXlsx(journals: List[Journal], path: str):
+    wb = xlsxwriter.Workbook(path, {'constant_memory': True})
+    sheet = wb.add_worksheet('journals')
+    row = 0
+    col = iter(range(0,20))
+    sheet.write(row,next(col),'id')
+    sheet.write(row,next(col),'title')
+    sheet.write(row,next(col),'url')
+    sheet.write(row,next(col),'e-issn')
+    sheet.write(row,next(col),'print-issn')
+    sheet.write(row,next(col),'valid')
+    sheet.write(row,next(col),'publisher')
+
+    for j in journals:
+        row += 1
+        col = iter(range(0,20))
+        sheet.write(row,next(col),j.id)
+        sheet.write(row,next(col),j.title)
+        sheet.write(row,next(col),j.url)
+        sheet.write(row,next(col),j.e_issn)
+        sheet.write(row,next(col),j.print_issn)
+        sheet.write(row,next(col),str(j.valid_till))
+        sheet.write(row,next(col),str(j.publisher))
+    wb.close()
+
+@handler(JOB_EXPORT_JOURNALS)
+def exportJournals(job: Job):
+    """
+    writes the journals of an admin search into Journals.xlsx, params: keyword, only_active, publisher_id, order
+    """
+    params = job.params
+    get_publishers()
+    publisher = None
+    if params.get('publisher_id', None):
+        publisher = g.m_publishers.get(int(params['publisher_id']), None)
+    only_active = bool(params.get('only_active', False))
+
+    journals = _readJournals(keyword=params.get('keyword', None), only_active=only_active, publisher=publisher,
+                             order=params.get('order', None), include_archived=not only_active)
+    job.setProgress(0, total=len(journals))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'Journals.xlsx')
+        writeJournalsXlsx(journals, path)
+        with open(path, 'rb') as f:
+            job.setResult(f, 'Journals.xlsx', XLSX_MIMETYPE)
+    job.setProgress(len(journals))
@@ -1,7 +1,8 @@
 import io
+import codecs
 import traceback
 from functools import wraps
-from typing import List, Tuple
+from typing import Dict, Iterator, List, NamedTuple, Tuple
 
 import requests
 import openpyxl
@@ -13,6 +14,8 @@ from flask_babel import lazy_gettext as _
 from oajf.db import readPublishers as db_readPublishers
 from oajf.db import readSettings as db_readSettings
 from oajf.models import Journal
+from oajf.issn import normalizeColumn as issn_normalizeColumn
+from oajf import metrics
 
 def logfunc(f):
     from oajf.db import getPoolStats
@@ -47,6 +50,7 @@ def logfunc(f):
 @logfunc
 def get_publishers(force_reload=False):
     publishers = getattr(g, 'publishers', None)
+    metrics.cacheHit('publishers', publishers is not None and not force_reload)
     if publishers is None or force_reload:
         publishers, m_publishers = db_readPublishers()
 
@@ -55,9 +59,32 @@ def get_publishers(force_reload=False):
         
     return publishers
 
+# refreshes a single publisher in the request cache instead of reloading all publishers
+# removes the publisher from the cache if it no longer exists
+@logfunc
+def reload_publisher(id):
+    publishers = getattr(g, 'publishers', None)
+    if publishers is None:
+        return get_publishers()
+
+    id = int(id)
+    l_publisher, m_publisher = db_readPublishers(id=id)
+    old = g.m_publishers.pop(id, None)
+    if old is not None:
+        publishers[:] = [p for p in publishers if p.id != id]
+
+    p = m_publisher.get(id, None)
+    if p is not None:
+        publishers.append(p)
+        publishers.sort()
+        g.m_publishers[id] = p
+
+    return publishers
+
 @logfunc
 def get_settings(force_reload=False):
     l_setting = getattr(g, 'l_setting', None)
+    metrics.cacheHit('settings', l_setting is not None and not force_reload)
     if l_setting is None or force_reload:
         l_setting = db_readSettings()
         g.l_setting = l_setting
@@ -159,46 +186,143 @@ def getDOAJChangesFileAsExcelWorkbook(url=None) -> Tuple[openpyxl.workbook.Workb
     return wb,data,errs
 
 
-def getDOAJDump(url=None) -> Tuple[List[Journal],List[str]]:
+def getDOAJWithdrawnIssns(wb: openpyxl.workbook.Workbook) -> Dict[str,List]:
     """
-    fetches the full DOAJ dump (csv file) and returns it as a list of journals
-    also checks the file for conformance to the expected format
+    reads the sheet 'Withdrawn' of the DOAJ-changes file, returns a map of normalized issn to [title,date,reason]
+    rows without a valid issn are skipped
     """
-    errs = []
-    l_journal: List[Journal] = []
+    rows = []
+    sheet = wb['Withdrawn']
+    for i,row in enumerate(sheet.rows):
+        if i < 6:
+            continue
+
+        title = row[0].value
+        if title: title = title.strip()
+        date = row[2].value
+        reason = row[3].value
+        if reason: reason = reason.strip()
+        rows.append((row[1].value,[title,date,reason]))
+
+    map_issn: Dict[str,List] = {}
+    for issn,(raw,values) in zip(issn_normalizeColumn(raw for raw,values in rows),rows):
+        if issn:
+            map_issn[issn] = values
+    return map_issn
+
+
+# columns of the DOAJ dump used by the import, the other ~50 columns aren't read
+DOAJ_DUMP_COLUMNS = {
+    'title': 'Journal title',
+    'url': 'URL in DOAJ',
+    'print_issn': 'Journal ISSN (print version)',
+    'e_issn': 'Journal EISSN (online version)',
+    'added_on_date': 'Added on Date',
+    'last_updated_date': 'Last updated Date',
+}
+DOAJ_DUMP_CHUNK_SIZE = 64 * 1024
+DOAJ_DUMP_BATCH_SIZE = 1000
+DOAJ_DUMP_TIMEOUT = 60
+
+class DOAJDumpError(Exception):
+    pass
+
+class DOAJRecord(NamedTuple):
+    """
+    one journal of the DOAJ dump, issns are normalized, invalid ones are None
+    """
+    title: str
+    url: str
+    print_issn: str
+    e_issn: str
+    added_on_date: str
+    last_updated_date: str
+
+    def getDifferences(self, other: Journal) -> Dict[str,List[str]]:
+        return Journal.getDifferences(self, other)
+
+    def toJournal(self) -> Journal:
+        j = Journal()
+        j.title = self.title
+        j.url = self.url
+        j.print_issn = self.print_issn
+        j.e_issn = self.e_issn
+        j.added_on_date = self.added_on_date
+        j.last_updated_date = self.last_updated_date
+        return j
+
+def _iterLines(chunks: Iterator[bytes]) -> Iterator[str]:
+    """
+    decodes a stream of byte chunks and yields its lines including the line ends, as csv.reader expects them
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    rest = ''
+    for chunk in chunks:
+        rest += decoder.decode(chunk)
+        start = 0
+        while (end := rest.find('\n', start)) >= 0:
+            yield rest[start:end + 1]
+            start = end + 1
+        rest = rest[start:]
+    rest += decoder.decode(b'', final=True)
+    if rest:
+        yield rest
+
+def _doajRecords(rows: List[List[str]]) -> List[DOAJRecord]:
+    # invalid issns are dropped, they could neither be matched nor stored
+    print_issns = issn_normalizeColumn(row[2] for row in rows)
+    e_issns = issn_normalizeColumn(row[3] for row in rows)
+    return [DOAJRecord(row[0], row[1], print_issn, e_issn, row[4], row[5])
+            for row, print_issn, e_issn in zip(rows, print_issns, e_issns)]
 
+def iterDOAJDump(url=None) -> Iterator[DOAJRecord]:
+    """
+    streams the full DOAJ dump (csv file) and yields its journals, only a chunk of the download and
+    a batch of rows are held in memory. raises DOAJDumpError if the dump can't be fetched or has an unexpected format
+    """
     if not url:
         url = getSettingValue('doaj_dump_link')
     if not url:
-        errs.append(_("URL für DOAJ-Dump nicht gesetzt."))
-        return [],errs
+        raise DOAJDumpError(_("URL für DOAJ-Dump nicht gesetzt."))
 
     try:
-        r = requests.get(url, allow_redirects=True)
+        r = requests.get(url, allow_redirects=True, stream=True, timeout=DOAJ_DUMP_TIMEOUT)
+        r.raise_for_status()
     except Exception as e:
-        errs.append(_(f"Fehler beim Holden des DOAJ-Dumps {e}"))
-        return [],errs
-    
-    try:
-        data = io.StringIO(r.content.decode('utf-8'),newline='')
-        data.seek(0)
+        raise DOAJDumpError(_("Fehler beim Holen des DOAJ-Dumps {0}").format(e))
 
-        reader = csv.DictReader(data, delimiter=',', quotechar='"')
-        for row in reader:
-            j = Journal()
-            j.title = row.get('Journal title',None)
-            j.url = row.get('URL in DOAJ',None)
-            j.print_issn = row.get('Journal ISSN (print version)',None)
-            j.e_issn = row.get('Journal EISSN (online version)',None)
-            j.added_on_date = row.get('Added on Date',None)
-            j.last_updated_date= row.get('Last updated Date',None)
-            l_journal.append(j)
-    except Exception as e:
-        app.logger.error(f"exception={type(e).__name__}")
-        app.logger.error(f"stacktrace={traceback.format_exc()}")
-        errs.append(_(f"Fehler beim Parsen des DOAJ-Dumps."))
-        errs.append(e)
-        return [],errs
-    
-    return l_journal,[]
+    with r:
+        try:
+            reader = csv.reader(_iterLines(r.iter_content(chunk_size=DOAJ_DUMP_CHUNK_SIZE)), delimiter=',', quotechar='"')
+            header = next(reader, [])
+            missing = [name for name in DOAJ_DUMP_COLUMNS.values() if name not in header]
+            if missing:
+                raise DOAJDumpError(_("Spalten fehlen im DOAJ-Dump: {0}").format(", ".join(missing)))
+            idx = [header.index(name) for name in DOAJ_DUMP_COLUMNS.values()]
+
+            batch = []
+            for row in reader:
+                if not row:
+                    continue
+                batch.append([row[i] if i < len(row) else None for i in idx])
+                if len(batch) >= DOAJ_DUMP_BATCH_SIZE:
+                    yield from _doajRecords(batch)
+                    batch = []
+            yield from _doajRecords(batch)
+        except DOAJDumpError:
+            raise
+        except Exception as e:
+            app.logger.error(f"exception={type(e).__name__}")
+            app.logger.error(f"stacktrace={traceback.format_exc()}")
+            raise DOAJDumpError(_("Fehler beim Parsen des DOAJ-Dumps. {0}").format(e))
+
+def getDOAJDump(url=None) -> Tuple[List[DOAJRecord],List[str]]:
+    """
+    fetches the full DOAJ dump (csv file) and returns it as a list of records
+    also checks the file for conformance to the expected format
+    """
+    try:
+        return list(iterDOAJDump(url)),[]
+    except DOAJDumpError as e:
+        return [],[e.args[0]]
 
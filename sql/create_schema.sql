@@ -43,18 +43,75 @@ CREATE TABLE `journal` (
 	INDEX `fk_journal_publisher` (`publisher_id`),
     INDEX `idx_e_issn` (`e_issn`),
     INDEX `idx_print_issn` (`print_issn`),
+    INDEX `idx_valid_till` (`valid_till`),
 	CONSTRAINT `fk_journal_publisher` FOREIGN KEY (`publisher_id`) REFERENCES `publisher` (`id`) ON UPDATE NO ACTION ON DELETE NO ACTION
 );
 
+CREATE TABLE `journal_archive` (
+	`id` INT(10) UNSIGNED NOT NULL,
+	`title` VARCHAR(250) NOT NULL,
+	`title_norm` VARCHAR(300) NOT NULL,
+	`link` VARCHAR(2048) NULL DEFAULT NULL,
+	`print_issn` CHAR(9) NULL DEFAULT NULL,
+	`e_issn` CHAR(9) NULL DEFAULT NULL,
+	`valid_till` DATE NULL,
+	`publisher_id` INT(10) UNSIGNED NOT NULL,
+	`archived_at` DATETIME NOT NULL DEFAULT current_timestamp(),
+	PRIMARY KEY (`id`),
+	INDEX `idx_ja_publisher` (`publisher_id`),
+	INDEX `idx_ja_e_issn` (`e_issn`)
+);
+
+CREATE TABLE `journal_staging` (
+	`upload_id` CHAR(32) NOT NULL,
+	`row_idx` INT(10) UNSIGNED NOT NULL,
+	`title` VARCHAR(250) NOT NULL,
+	`link` VARCHAR(2048) NULL DEFAULT NULL,
+	`print_issn` CHAR(9) NULL DEFAULT NULL,
+	`e_issn` CHAR(9) NULL DEFAULT NULL,
+	`journal_id` INT(10) UNSIGNED NULL DEFAULT NULL,
+	`changed` TINYINT(1) NOT NULL DEFAULT 0,
+	`created` DATETIME NOT NULL DEFAULT current_timestamp(),
+	PRIMARY KEY (`upload_id`,`row_idx`),
+	INDEX `idx_jst_journal` (`upload_id`,`journal_id`),
+	INDEX `idx_jst_created` (`created`)
+);
+
+CREATE TABLE `journal_search` (
+	`journal_id` INT(10) UNSIGNED NOT NULL,
+	`title` VARCHAR(250) NOT NULL,
+	`title_norm` VARCHAR(300) NOT NULL,
+	`link` VARCHAR(2048) NULL DEFAULT NULL,
+	`print_issn` CHAR(9) NULL DEFAULT NULL,
+	`e_issn` CHAR(9) NULL DEFAULT NULL,
+	`valid_till` DATE NULL,
+	`publisher_id` INT(10) UNSIGNED NOT NULL,
+	`publisher_name` VARCHAR(255) NOT NULL,
+	`oa_status` VARCHAR(50) NULL DEFAULT NULL,
+	`application_requirement` VARCHAR(50) NULL DEFAULT NULL,
+	PRIMARY KEY (`journal_id`),
+	INDEX `idx_js_title` (`title`),
+	INDEX `idx_js_publisher_name` (`publisher_name`,`title`),
+	INDEX `idx_js_oa_status` (`oa_status`,`title`),
+	INDEX `idx_js_application_requirement` (`application_requirement`,`title`),
+	INDEX `idx_js_valid_till` (`valid_till`),
+	INDEX `idx_js_publisher` (`publisher_id`),
+	INDEX `idx_js_e_issn` (`e_issn`),
+	INDEX `idx_js_print_issn` (`print_issn`)
+);
+
 CREATE TABLE `excelfilehistory` (
 	`id` INT(10) UNSIGNED NOT NULL AUTO_INCREMENT,
 	`name` TINYTEXT NOT NULL DEFAULT 'Name nicht vorhanden',
-	`file` LONGBLOB NOT NULL,
+	`file` LONGBLOB NULL DEFAULT NULL,
+	`file_hash` CHAR(64) NULL DEFAULT NULL,
+	`file_size` INT(10) UNSIGNED NULL DEFAULT NULL,
 	`uploaded` TIMESTAMP NOT NULL DEFAULT current_timestamp(),
 	`valid` DATE NOT NULL,
 	`publisher_id` INT(10) UNSIGNED NOT NULL,
 	PRIMARY KEY (`id`),
 	INDEX `fk_excelfilehistory_publisher` (`publisher_id`),
+	INDEX `idx_file_hash` (`file_hash`),
 	CONSTRAINT `fk_excelfilehistory_publisher` FOREIGN KEY (`publisher_id`) REFERENCES `publisher` (`id`) ON UPDATE NO ACTION ON DELETE NO ACTION
 );
 
@@ -83,40 +140,63 @@ CREATE TABLE IF NOT EXISTS `session`
     `last_activity` DATETIME(6),
     `expires` DATETIME(6),
     PRIMARY KEY (`id`),
-    CONSTRAINT `uniq_session_id` UNIQUE (`session_id`)
+    CONSTRAINT `uniq_session_id` UNIQUE (`session_id`),
+    INDEX `idx_expires` (`expires`),
+    INDEX `idx_last_activity` (`last_activity`)
 );
 
-CREATE TABLE `session_h` LIKE `session`;
-ALTER TABLE `session_h`
-    MODIFY COLUMN `id` int(11) NOT NULL,
-    DROP PRIMARY KEY,
-    DROP CONSTRAINT `uniq_session_id`,
-    ADD `action` VARCHAR(8) DEFAULT 'insert' FIRST, 
-    ADD `revision` INT(6) DEFAULT 0 NULL AFTER action,
-    ADD `dt_datetime` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP AFTER revision,
-    ADD PRIMARY KEY (`id`,`revision`);
-
-DROP TRIGGER IF EXISTS `session__ai`;
-DROP TRIGGER IF EXISTS `session__au`;
-DROP TRIGGER IF EXISTS `session__bd`;
-
-CREATE TRIGGER `session__ai` AFTER INSERT ON session 
-    FOR EACH ROW
-    INSERT INTO `session_h` 
-    SELECT 'insert', 1, NOW(), t.* 
-    FROM `session` AS t WHERE t.id = NEW.id;
+-- written by the application in batches, monthly partitions are added by "flask oajf rotatesessionhistory"
+CREATE TABLE IF NOT EXISTS `session_history`
+(
+    `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    `session_id` VARCHAR(64) NOT NULL,
+    `action` VARCHAR(8) NOT NULL,
+    `dt_datetime` DATETIME(6) NOT NULL,
+    `ip_address` TEXT,
+    `ip_group` VARCHAR(50) NULL,
+    `country_code` CHAR(2) NULL DEFAULT NULL,
+    `http_method` TEXT,
+    `request_path` TEXT,
+    `post_data` TEXT,
+    `form_data` TEXT,
+    `session_data` TEXT,
+    `user_agent` TEXT,
+    `last_activity` DATETIME(6),
+    `expires` DATETIME(6),
+    PRIMARY KEY (`id`,`dt_datetime`),
+    INDEX `idx_sh_session_id` (`session_id`)
+)
+PARTITION BY RANGE COLUMNS(`dt_datetime`) (
+    PARTITION `pmax` VALUES LESS THAN (MAXVALUE)
+);
 
-CREATE TRIGGER `session__au` AFTER UPDATE ON session 
-    FOR EACH ROW
-    INSERT INTO `session_h` 
-    SELECT 'update', (SELECT MAX(th.revision)+1 FROM session_h th2 WHERE th.id=th2.id AND th.revision=th2.revision),NOW(), t.* 
-    FROM `session` AS t,`session_h` as th WHERE t.id = NEW.id and th.id=t.id;
+-- usage events written by the application in batches, aggregated by "flask oajf rollupevents"
+CREATE TABLE IF NOT EXISTS `event`
+(
+    `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    `dt_datetime` DATETIME NOT NULL,
+    `kind` ENUM('search','autocomplete','click') NOT NULL,
+    `journal_id` INT(10) UNSIGNED NULL DEFAULT NULL,
+    `keyword` VARCHAR(250) NULL DEFAULT NULL,
+    `results` INT(10) UNSIGNED NULL DEFAULT NULL,
+    `ip_group` VARCHAR(50) NULL DEFAULT NULL,
+    `country_code` CHAR(2) NULL DEFAULT NULL,
+    PRIMARY KEY (`id`),
+    INDEX `idx_event_dt_datetime` (`dt_datetime`)
+);
 
-CREATE TRIGGER `session__bd` BEFORE DELETE ON session 
-    FOR EACH ROW
-    INSERT INTO `session_h` 
-    SELECT 'delete', (SELECT MAX(th.revision)+1 FROM session_h th2 WHERE th.id=th2.id AND th.revision=th2.revision),NOW(), t.* 
-    FROM `session` AS t,`session_h` as th WHERE t.id = OLD.id and th.id=t.id;
+CREATE TABLE IF NOT EXISTS `event_hourly`
+(
+    `hour` DATETIME NOT NULL,
+    `kind` ENUM('search','autocomplete','click') NOT NULL,
+    `journal_id` INT(10) UNSIGNED NOT NULL DEFAULT 0,
+    `keyword` VARCHAR(250) NOT NULL DEFAULT '',
+    `ip_group` VARCHAR(50) NOT NULL DEFAULT '',
+    `country_code` CHAR(2) NOT NULL DEFAULT '',
+    `cnt` INT(10) UNSIGNED NOT NULL,
+    `results` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    PRIMARY KEY (`hour`,`kind`,`journal_id`,`keyword`,`ip_group`,`country_code`)
+);
 
 CREATE TABLE IF NOT EXISTS `geoip`
 (
@@ -124,5 +204,29 @@ CREATE TABLE IF NOT EXISTS `geoip`
     `ip_from` INET4 NOT NULL,
     `ip_to` INET4 NOT NULL,
     `country_code` CHAR(2) NOT NULL,
-    PRIMARY KEY (`id`)
-);
\ No newline at end of file
+    PRIMARY KEY (`id`),
+    INDEX `idx_ip_from` (`ip_from`)
+);
+
+CREATE TABLE `job` (
+	`id` INT(10) UNSIGNED NOT NULL AUTO_INCREMENT,
+	`kind` VARCHAR(50) NOT NULL,
+	`status` ENUM('queued','running','done','failed') NOT NULL DEFAULT 'queued',
+	`params` LONGTEXT NULL DEFAULT NULL,
+	`lang` VARCHAR(10) NULL DEFAULT NULL,
+	`created_by` VARCHAR(100) NULL DEFAULT NULL,
+	`progress` INT(10) UNSIGNED NOT NULL DEFAULT 0,
+	`total` INT(10) UNSIGNED NULL DEFAULT NULL,
+	`messages` LONGTEXT NULL DEFAULT NULL,
+	`result_hash` CHAR(64) NULL DEFAULT NULL,
+	`result_name` VARCHAR(255) NULL DEFAULT NULL,
+	`result_mimetype` VARCHAR(100) NULL DEFAULT NULL,
+	`worker` VARCHAR(100) NULL DEFAULT NULL,
+	`created` DATETIME NOT NULL DEFAULT current_timestamp(),
+	`started` DATETIME NULL DEFAULT NULL,
+	`updated` DATETIME NULL DEFAULT NULL,
+	`finished` DATETIME NULL DEFAULT NULL,
+	PRIMARY KEY (`id`),
+	INDEX `idx_job_status` (`status`,`id`),
+	INDEX `idx_job_finished` (`finished`)
+);
@@ -4,10 +4,18 @@ ALTER TABLE IF EXISTS `excelfilehistory` DROP FOREIGN KEY IF EXISTS `fk_excelfil
 
 DROP TABLE IF EXISTS `publisher`;
 DROP TABLE IF EXISTS `journal`;
+DROP TABLE IF EXISTS `journal_search`;
+DROP TABLE IF EXISTS `journal_archive`;
+DROP TABLE IF EXISTS `journal_staging`;
 DROP TABLE IF EXISTS `excelfilehistory`;
 DROP TABLE IF EXISTS `link`;
 DROP TABLE IF EXISTS `session`;
 DROP TABLE IF EXISTS `session_h`;
+DROP TABLE IF EXISTS `session_history`;
+DROP TABLE IF EXISTS `geoip_staging`;
 DROP TABLE IF EXISTS `geoip`;
+DROP TABLE IF EXISTS `event`;
+DROP TABLE IF EXISTS `event_hourly`;
+DROP TABLE IF EXISTS `job`;
 DROP TABLE IF EXISTS `setting`;
 
@@ -0,0 +1,28 @@
+-- usage events (searches, autocomplete selections, clicks) and their hourly aggregates
+-- run "flask oajf rollupevents" hourly from cron
+CREATE TABLE IF NOT EXISTS `event`
+(
+    `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    `dt_datetime` DATETIME NOT NULL,
+    `kind` ENUM('search','autocomplete','click') NOT NULL,
+    `journal_id` INT(10) UNSIGNED NULL DEFAULT NULL,
+    `keyword` VARCHAR(250) NULL DEFAULT NULL,
+    `results` INT(10) UNSIGNED NULL DEFAULT NULL,
+    `ip_group` VARCHAR(50) NULL DEFAULT NULL,
+    `country_code` CHAR(2) NULL DEFAULT NULL,
+    PRIMARY KEY (`id`),
+    INDEX `idx_event_dt_datetime` (`dt_datetime`)
+);
+
+CREATE TABLE IF NOT EXISTS `event_hourly`
+(
+    `hour` DATETIME NOT NULL,
+    `kind` ENUM('search','autocomplete','click') NOT NULL,
+    `journal_id` INT(10) UNSIGNED NOT NULL DEFAULT 0,
+    `keyword` VARCHAR(250) NOT NULL DEFAULT '',
+    `ip_group` VARCHAR(50) NOT NULL DEFAULT '',
+    `country_code` CHAR(2) NOT NULL DEFAULT '',
+    `cnt` INT(10) UNSIGNED NOT NULL,
+    `results` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    PRIMARY KEY (`hour`,`kind`,`journal_id`,`keyword`,`ip_group`,`country_code`)
+);
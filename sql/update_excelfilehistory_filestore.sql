@@ -0,0 +1,7 @@
+-- moves excel file contents out of the database into the filestore
+-- apply, then run "flask oajf migrateexcelfiles" to move existing blobs
+ALTER TABLE `excelfilehistory`
+    MODIFY COLUMN `file` LONGBLOB NULL DEFAULT NULL,
+    ADD COLUMN IF NOT EXISTS `file_hash` CHAR(64) NULL DEFAULT NULL AFTER `file`,
+    ADD COLUMN IF NOT EXISTS `file_size` INT(10) UNSIGNED NULL DEFAULT NULL AFTER `file_hash`,
+    ADD INDEX IF NOT EXISTS `idx_file_hash` (`file_hash`);
@@ -0,0 +1,4 @@
+-- "flask oajf importgeoip" loads into geoip_staging and swaps the tables,
+-- the index serves the sorted range reads and the overlap check
+ALTER TABLE `geoip` ADD INDEX IF NOT EXISTS `idx_ip_from` (`ip_from`);
+DROP TABLE IF EXISTS `geoip_staging`;
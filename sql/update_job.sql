@@ -0,0 +1,23 @@
+-- queue of background jobs, run by "flask oajf jobworker"
+CREATE TABLE IF NOT EXISTS `job` (
+	`id` INT(10) UNSIGNED NOT NULL AUTO_INCREMENT,
+	`kind` VARCHAR(50) NOT NULL,
+	`status` ENUM('queued','running','done','failed') NOT NULL DEFAULT 'queued',
+	`params` LONGTEXT NULL DEFAULT NULL,
+	`lang` VARCHAR(10) NULL DEFAULT NULL,
+	`created_by` VARCHAR(100) NULL DEFAULT NULL,
+	`progress` INT(10) UNSIGNED NOT NULL DEFAULT 0,
+	`total` INT(10) UNSIGNED NULL DEFAULT NULL,
+	`messages` LONGTEXT NULL DEFAULT NULL,
+	`result_hash` CHAR(64) NULL DEFAULT NULL,
+	`result_name` VARCHAR(255) NULL DEFAULT NULL,
+	`result_mimetype` VARCHAR(100) NULL DEFAULT NULL,
+	`worker` VARCHAR(100) NULL DEFAULT NULL,
+	`created` DATETIME NOT NULL DEFAULT current_timestamp(),
+	`started` DATETIME NULL DEFAULT NULL,
+	`updated` DATETIME NULL DEFAULT NULL,
+	`finished` DATETIME NULL DEFAULT NULL,
+	PRIMARY KEY (`id`),
+	INDEX `idx_job_status` (`status`,`id`),
+	INDEX `idx_job_finished` (`finished`)
+);
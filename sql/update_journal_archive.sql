@@ -0,0 +1,18 @@
+-- archive for expired journals, filled nightly by "flask oajf archivejournals"
+ALTER TABLE `journal`
+    ADD INDEX IF NOT EXISTS `idx_valid_till` (`valid_till`);
+
+CREATE TABLE IF NOT EXISTS `journal_archive` (
+	`id` INT(10) UNSIGNED NOT NULL,
+	`title` VARCHAR(250) NOT NULL,
+	`title_norm` VARCHAR(300) NOT NULL,
+	`link` VARCHAR(2048) NULL DEFAULT NULL,
+	`print_issn` CHAR(9) NULL DEFAULT NULL,
+	`e_issn` CHAR(9) NULL DEFAULT NULL,
+	`valid_till` DATE NULL,
+	`publisher_id` INT(10) UNSIGNED NOT NULL,
+	`archived_at` DATETIME NOT NULL DEFAULT current_timestamp(),
+	PRIMARY KEY (`id`),
+	INDEX `idx_ja_publisher` (`publisher_id`),
+	INDEX `idx_ja_e_issn` (`e_issn`)
+);
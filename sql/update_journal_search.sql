@@ -0,0 +1,24 @@
+-- denormalized copy of journal and the publisher columns used for filtering and sorting
+-- apply, then run "flask oajf rebuildjournalsearch" to fill the table
+CREATE TABLE IF NOT EXISTS `journal_search` (
+	`journal_id` INT(10) UNSIGNED NOT NULL,
+	`title` VARCHAR(250) NOT NULL,
+	`title_norm` VARCHAR(300) NOT NULL,
+	`link` VARCHAR(2048) NULL DEFAULT NULL,
+	`print_issn` CHAR(9) NULL DEFAULT NULL,
+	`e_issn` CHAR(9) NULL DEFAULT NULL,
+	`valid_till` DATE NULL,
+	`publisher_id` INT(10) UNSIGNED NOT NULL,
+	`publisher_name` VARCHAR(255) NOT NULL,
+	`oa_status` VARCHAR(50) NULL DEFAULT NULL,
+	`application_requirement` VARCHAR(50) NULL DEFAULT NULL,
+	PRIMARY KEY (`journal_id`),
+	INDEX `idx_js_title` (`title`),
+	INDEX `idx_js_publisher_name` (`publisher_name`,`title`),
+	INDEX `idx_js_oa_status` (`oa_status`,`title`),
+	INDEX `idx_js_application_requirement` (`application_requirement`,`title`),
+	INDEX `idx_js_valid_till` (`valid_till`),
+	INDEX `idx_js_publisher` (`publisher_id`),
+	INDEX `idx_js_e_issn` (`e_issn`),
+	INDEX `idx_js_print_issn` (`print_issn`)
+);
@@ -0,0 +1,12 @@
+-- uploads are parsed into journal_staging in chunks and moved into journal at the end
+CREATE TABLE IF NOT EXISTS `journal_staging` (
+	`upload_id` CHAR(32) NOT NULL,
+	`row_idx` INT(10) UNSIGNED NOT NULL,
+	`title` VARCHAR(250) NOT NULL,
+	`link` VARCHAR(2048) NULL DEFAULT NULL,
+	`print_issn` CHAR(9) NULL DEFAULT NULL,
+	`e_issn` CHAR(9) NULL DEFAULT NULL,
+	`created` DATETIME NOT NULL DEFAULT current_timestamp(),
+	PRIMARY KEY (`upload_id`,`row_idx`),
+	INDEX `idx_jst_created` (`created`)
+);
@@ -0,0 +1,5 @@
+-- re-uploads in sync mode match the staged rows with the existing journals of the publisher
+ALTER TABLE `journal_staging`
+	ADD COLUMN IF NOT EXISTS `journal_id` INT(10) UNSIGNED NULL DEFAULT NULL AFTER `e_issn`,
+	ADD COLUMN IF NOT EXISTS `changed` TINYINT(1) NOT NULL DEFAULT 0 AFTER `journal_id`,
+	ADD INDEX IF NOT EXISTS `idx_jst_journal` (`upload_id`,`journal_id`);
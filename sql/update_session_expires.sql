@@ -0,0 +1,4 @@
+-- indexes for deleting expired sessions, see "flask oajf expiresessions"
+ALTER TABLE `session`
+    ADD INDEX IF NOT EXISTS `idx_expires` (`expires`),
+    ADD INDEX IF NOT EXISTS `idx_last_activity` (`last_activity`);
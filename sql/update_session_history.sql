@@ -0,0 +1,30 @@
+-- replaces the session_h triggers by the append-only session_history table written by the application
+-- apply, then run "flask oajf rotatesessionhistory" (and monthly from cron) to create the partitions
+-- session_h is kept with the existing history and can be dropped once it is no longer needed
+DROP TRIGGER IF EXISTS `session__ai`;
+DROP TRIGGER IF EXISTS `session__au`;
+DROP TRIGGER IF EXISTS `session__bd`;
+
+CREATE TABLE IF NOT EXISTS `session_history`
+(
+    `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    `session_id` VARCHAR(64) NOT NULL,
+    `action` VARCHAR(8) NOT NULL,
+    `dt_datetime` DATETIME(6) NOT NULL,
+    `ip_address` TEXT,
+    `ip_group` VARCHAR(50) NULL,
+    `country_code` CHAR(2) NULL DEFAULT NULL,
+    `http_method` TEXT,
+    `request_path` TEXT,
+    `post_data` TEXT,
+    `form_data` TEXT,
+    `session_data` TEXT,
+    `user_agent` TEXT,
+    `last_activity` DATETIME(6),
+    `expires` DATETIME(6),
+    PRIMARY KEY (`id`,`dt_datetime`),
+    INDEX `idx_sh_session_id` (`session_id`)
+)
+PARTITION BY RANGE COLUMNS(`dt_datetime`) (
+    PARTITION `pmax` VALUES LESS THAN (MAXVALUE)
+);